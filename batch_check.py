@@ -0,0 +1,145 @@
+from pipeline.stages import run_consistency_pipeline, run_grammar_pipeline
+from filereader.cache import configure_doc_cache_from_args
+from pipeline.spill import configure_spill_from_args, dump_json
+from filereader.reader import extract_text_from_path
+from llm.model import set_rate_limit
+from llm.replay import configure_from_args
+from llm.dedup import configure_dedup
+from llm.routing import configure_routes_from_args
+from llm.pool import configure_pool_from_args
+from llm.scheduler import SCHEDULER, configure_scheduler_from_args
+from monitor.logs import setup_logging
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Batch Check for a directory of documents")
+    parser.add_argument("--model_name", type=str, default="qwen-plus", help="Model name")
+    parser.add_argument("--base_url", type=str, default="https://dashscope.aliyuncs.com/compatible-mode/v1", help="Base URL")
+    parser.add_argument("--endpoints", type=str, default=None, help="Pool of model endpoints and keys replacing --base_url, a JSON file or JSON string, see README")
+    parser.add_argument("--endpoint_failure_threshold", type=int, default=3, help="Consecutive failures after which a pooled endpoint is taken out of rotation")
+    parser.add_argument("--endpoint_cooldown", type=float, default=30.0, help="Seconds before a tripped endpoint receives a probe request")
+    parser.add_argument("--inputs", type=str, default="./dataset", help="Directory or glob of docx/pdf files")
+    parser.add_argument("--pipeline", type=str, default="all", choices=["consistency", "grammar", "all"], help="Pipelines to run")
+    parser.add_argument("--concurrency", type=int, default=4, help="Documents processed concurrently")
+    parser.add_argument("--llm_concurrency", type=int, default=0, help="LLM calls in flight across all documents, taken in turn by each document, 0 means unlimited")
+    parser.add_argument("--rate_limit", type=float, default=0, help="LLM requests per second shared by all documents, 0 means unlimited")
+    parser.add_argument("--prescreen_threshold", type=float, default=0.0, help="Only grammar chunks whose local pre-screen score reaches this value are sent to the LLM, 0 disables the pre-screen")
+    parser.add_argument("--prescreen_lm", type=str, default=None, help="Optional character bigram model for the pre-screen, built with prescreen.py --build_lm")
+    parser.add_argument("--grammar_output", type=str, default="full", choices=["full", "edits"], help="Grammar check output: the full corrected text, or only edit operations applied locally")
+    parser.add_argument("--correct_output", type=str, default="full", choices=["full", "spans"], help="Consistency correction output: the full marked chunk, or only the spans to mark applied locally")
+    parser.add_argument("--dedup_cache_size", type=int, default=4096, help="Grammar/correction results kept for deduplicating repeated chunks and sentences, 0 disables deduplication")
+    parser.add_argument("--shard_chunks", type=int, default=0, help="Split documents into shards of this many 1024-char chunks, extracted concurrently and reconciled, 0 disables sharding")
+    parser.add_argument("--shard_concurrency", type=int, default=4, help="Shards processed at the same time in sharded mode")
+    parser.add_argument("--doc_cache_mb", type=float, default=64.0, help="Memory for parsed documents and chunk boundaries keyed by content hash, 0 disables the memory tier")
+    parser.add_argument("--doc_cache_disk_mb", type=float, default=0.0, help="Disk space for parsed documents, least recently used files are evicted beyond it, 0 disables the disk tier")
+    parser.add_argument("--doc_cache_dir", type=str, default=None, help="Directory of the parsed document disk cache, defaults to {log_dir}/doc_cache")
+    parser.add_argument("--spill_budget_mb", type=float, default=0.0, help="Memory budget in MB for intermediate results, beyond which they are written to disk, 0 keeps everything in memory")
+    parser.add_argument("--spill_dir", type=str, default=None, help="Directory for spilled intermediate results, defaults to {log_dir}/spill")
+    parser.add_argument("--model_routes", type=str, default=None, help="Per-stage model routing, a JSON file or JSON string, see README")
+    parser.add_argument("--log_dir", type=str, default="./logs", help="Output path")
+    parser.add_argument("--record", type=str, default=None, help="Record every LLM request/response to this .jsonl.gz file")
+    parser.add_argument("--replay", type=str, default=None, help="Serve LLM responses offline from a recorded .jsonl.gz file")
+    parser.add_argument("--replay_latency", type=str, default="original", choices=["original", "zero"], help="Replay with the recorded latency or immediately")
+    args = parser.parse_args()
+    return args
+
+def collect_files(inputs: str):
+    """目录或glob展开为docx/pdf文件列表"""
+    pattern = os.path.join(inputs, "*") if os.path.isdir(inputs) else inputs
+    return sorted(p for p in glob.glob(pattern) if p.lower().endswith((".docx", ".pdf")))
+
+def output_names(files):
+    """输出目录名沿用文档名，同名的docx/pdf追加扩展名区分"""
+    stems = [os.path.basename(p).rsplit(".", 1)[0] for p in files]
+    return [
+        stem if stems.count(stem) == 1 else f"{stem}_{p.rsplit('.', 1)[-1].lower()}"
+        for stem, p in zip(stems, files)
+    ]
+
+async def process_document(path: str, name: str, args, semaphore, logger):
+    """
+    处理单个文档：只解析一次，依次运行所选pipeline，结果保存到 {log_dir}/{name}/
+    返回该文档的耗时统计
+    """
+    save_dir = os.path.join(args.log_dir, name)
+    summary = {"file": path, "status": "ok", "timings": {}}
+
+    async def log_callback(msg, msg_type="log"):
+        logger.debug(f"[{name}] {msg}")
+
+    # 每个文档作为调度器中的一个客户端，并发LLM调用在文档之间轮转
+    job = SCHEDULER.new_job(name, client_id=name)
+    async with semaphore, SCHEDULER.admit(job):
+        start = time.perf_counter()
+        try:
+            # 解析在线程池中进行，不阻塞其他文档的LLM调用
+            text = await asyncio.to_thread(extract_text_from_path, path)
+            summary["timings"]["parse"] = round(time.perf_counter() - start, 3)
+            summary["chars"] = len(text)
+            os.makedirs(save_dir, exist_ok=True)
+
+            if args.pipeline in ("grammar", "all"):
+                t = time.perf_counter()
+                grammar_results = await run_grammar_pipeline(text, args, log_callback, logger=logger)
+                summary["timings"]["grammar"] = round(time.perf_counter() - t, 3)
+                with open(os.path.join(save_dir, "grammar_check_results.json"), "w", encoding="utf-8") as f:
+                    dump_json(grammar_results, f)
+
+            if args.pipeline in ("consistency", "all"):
+                t = time.perf_counter()
+                corrected = await run_consistency_pipeline(text, args, log_callback, logger=logger)
+                summary["timings"]["consistency"] = round(time.perf_counter() - t, 3)
+                with open(os.path.join(save_dir, "corrected_result.txt"), "w", encoding="utf-8") as f:
+                    dump_json(corrected, f)
+        except Exception as e:
+            logger.exception(f"文档处理失败: {path}")
+            summary["status"] = "error"
+            summary["error"] = str(e)
+        summary["timings"]["total"] = round(time.perf_counter() - start, 3)
+        summary["queue_wait"] = job.report()
+    logger.info(f"完成 {path}: {summary['timings']}")
+    return summary
+
+async def run_batch(args, logger):
+    files = collect_files(args.inputs)
+    logger.info(f"共 {len(files)} 个文档，并发数 {args.concurrency}，限速 {args.rate_limit or '无'} 次/秒")
+    semaphore = asyncio.Semaphore(args.concurrency)
+    start = time.perf_counter()
+    documents = await asyncio.gather(*(
+        process_document(p, name, args, semaphore, logger)
+        for p, name in zip(files, output_names(files))
+    ))
+    batch_summary = {
+        "documents": documents,
+        "total_documents": len(documents),
+        "failed_documents": sum(d["status"] != "ok" for d in documents),
+        "total_chars": sum(d.get("chars", 0) for d in documents),
+        "wall_seconds": round(time.perf_counter() - start, 3),
+    }
+    os.makedirs(args.log_dir, exist_ok=True)
+    summary_path = os.path.join(args.log_dir, "batch_summary.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(batch_summary, f, ensure_ascii=False, indent=4)
+    logger.info(f"批处理完成，汇总已保存到: {summary_path}")
+    return batch_summary
+
+if __name__ == "__main__":
+    args = parse_args()
+    logger = setup_logging(args.log_dir, "batch_check.log")
+    configure_from_args(args)
+    # 所有文档共用同一个去重缓存，模板化文档中的重复条款只检查一次
+    configure_dedup(args.dedup_cache_size)
+    configure_routes_from_args(args)
+    configure_pool_from_args(args)
+    configure_spill_from_args(args)
+    configure_doc_cache_from_args(args)
+    configure_scheduler_from_args(args)
+    # 所有文档共用同一个限流器
+    set_rate_limit(args.rate_limit)
+    asyncio.run(run_batch(args, logger))
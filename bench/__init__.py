@@ -0,0 +1,5 @@
+__all__ = [
+    "mock_server",
+    "benchmark",
+    "startup",
+]
@@ -0,0 +1,352 @@
+# bench/benchmark.py
+# 端到端性能基准：在 dataset/*.docx 与合成长文本上运行两条pipeline，
+# 统计吞吐、LLM调用 p50/p95 延迟、调用次数与峰值RSS。
+# 默认启动本地 mock 服务，完全离线：
+# uv run python -m bench.benchmark --synthetic_sizes 20000,100000
+import sys
+import os
+
+# 添加项目根目录到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from filereader.reader import extract_text_from_docx, extract_text_from_pdf
+from monitor.tracing import start_trace, SPAN_KIND_CLIENT
+from llm.replay import configure_from_args
+from llm.dedup import configure_dedup
+from llm.routing import configure_routes_from_args
+from llm.pool import configure_pool_from_args
+from pipeline.spill import configure_spill_from_args
+from llm.scheduler import SCHEDULER, configure_scheduler_from_args
+from monitor.metrics import estimate_cost, set_model_price
+
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import random
+import resource
+import socket
+import subprocess
+import time
+import urllib.request
+import uuid
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark")
+    parser.add_argument("--model_name", type=str, default="mock", help="Model name")
+    parser.add_argument("--base_url", type=str, default=None, help="Base URL, a local mock server is started when omitted")
+    parser.add_argument("--endpoints", type=str, default=None, help="Pool of model endpoints and keys replacing --base_url, a JSON file or JSON string, see README")
+    parser.add_argument("--endpoint_failure_threshold", type=int, default=3, help="Consecutive failures after which a pooled endpoint is taken out of rotation")
+    parser.add_argument("--endpoint_cooldown", type=float, default=30.0, help="Seconds before a tripped endpoint receives a probe request")
+    parser.add_argument("--inputs", type=str, default="./dataset/*.docx", help="Glob of docx/pdf inputs")
+    parser.add_argument("--synthetic_sizes", type=str, default="20000", help="Comma separated lengths of synthetic inputs, empty to disable")
+    parser.add_argument("--pipelines", type=str, default="grammar,consistency", help="Comma separated pipelines to run")
+    parser.add_argument("--prescreen_threshold", type=float, default=0.0, help="Only grammar chunks whose local pre-screen score reaches this value are sent to the LLM, 0 disables the pre-screen")
+    parser.add_argument("--prescreen_lm", type=str, default=None, help="Optional character bigram model for the pre-screen, built with prescreen.py --build_lm")
+    parser.add_argument("--grammar_output", type=str, default="full", choices=["full", "edits"], help="Grammar check output: the full corrected text, or only edit operations applied locally")
+    parser.add_argument("--correct_output", type=str, default="full", choices=["full", "spans"], help="Consistency correction output: the full marked chunk, or only the spans to mark applied locally")
+    parser.add_argument("--dedup_cache_size", type=int, default=4096, help="Results kept for deduplicating repeated chunks and sentences, 0 disables deduplication")
+    parser.add_argument("--shard_chunks", type=str, default="0", help="Comma separated --shard_chunks values the consistency pipeline is run with, 0 is unsharded")
+    parser.add_argument("--shard_concurrency", type=int, default=4, help="Shards processed at the same time in sharded mode")
+    parser.add_argument("--spill_budget_mb", type=float, default=0.0, help="Memory budget in MB for intermediate results, beyond which they are written to disk, 0 keeps everything in memory")
+    parser.add_argument("--spill_dir", type=str, default=None, help="Directory for spilled intermediate results, defaults to {log_dir}/spill")
+    parser.add_argument("--model_routes", type=str, default=None, help="Per-stage model routing, a JSON file or JSON string")
+    parser.add_argument("--max_jobs", type=int, default=0, help="Jobs run at the same time in the mixed load, 0 means unlimited")
+    parser.add_argument("--llm_concurrency", type=int, default=0, help="LLM calls in flight across all jobs, queued fairly per client, 0 means unlimited")
+    parser.add_argument("--short_job_chars", type=int, default=20000, help="Interactive jobs up to this size are scheduled ahead of longer ones")
+    parser.add_argument("--mixed_load", type=int, default=0, help="Also run the largest input through consistency while this many short grammar jobs from other clients arrive")
+    parser.add_argument("--mixed_short_chars", type=int, default=500, help="Length of each short job in the mixed load")
+    parser.add_argument("--mixed_interval", type=float, default=0.5, help="Seconds between short job arrivals in the mixed load")
+    parser.add_argument("--prompt_price", type=float, default=0.0, help="Price per 1k prompt tokens of --model_name, used for the per-stage cost")
+    parser.add_argument("--completion_price", type=float, default=0.0, help="Price per 1k completion tokens of --model_name, used for the per-stage cost")
+    parser.add_argument("--mock_latency", type=float, default=0.05, help="Mean latency of the mock server in seconds")
+    parser.add_argument("--mock_latency_dist", type=str, default="lognormal", help="Latency distribution of the mock server")
+    parser.add_argument("--mock_token_delay", type=float, default=0.0, help="Delay between streamed tokens of the mock server")
+    parser.add_argument("--mock_cache_min_tokens", type=int, default=1024, help="Minimum shared prefix the mock server reports as cached")
+    parser.add_argument("--mock_max_concurrency", type=int, default=0, help="Requests the mock server serves at the same time, simulating provider capacity, 0 means unlimited")
+    parser.add_argument("--mock_error_rate", type=float, default=0.0, help="Error rate of the mock server")
+    parser.add_argument("--mock_bad_output_models", type=str, default="", help="Comma separated models whose mock replies are sometimes cut in half")
+    parser.add_argument("--mock_bad_output_rate", type=float, default=0.0, help="Probability of a cut reply for --mock_bad_output_models")
+    parser.add_argument("--record", type=str, default=None, help="Record every LLM request/response to this .jsonl.gz file")
+    parser.add_argument("--replay", type=str, default=None, help="Replay LLM responses from a recorded .jsonl.gz file instead of calling a server")
+    parser.add_argument("--replay_latency", type=str, default="zero", choices=["original", "zero"], help="Replay with the recorded latency or immediately")
+    parser.add_argument("--log_dir", type=str, default="./logs/bench", help="Output path")
+    parser.add_argument("--output", type=str, default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+    return args
+
+
+SENTENCES = [
+    "{name}于{year}年在{place}成立，注册资本为{money}万元。",
+    "根据合同约定，{name}应在{year}年底前完成全部交付。",
+    "{name}的负责人表示，项目预算已调整为{money}万元。",
+    "该设备由{name}生产，产地为{place}，额定功率为{power}千瓦。",
+    "截至{year}年，{name}共有员工{staff}人。",
+    "我们今天吃了饭去{place}开会了",
+]
+NAMES = ["星河科技", "蓝海集团", "张三", "李四", "华北电力公司", "第一研究所"]
+PLACES = ["北京", "上海", "深圳", "泰国", "日本", "成都"]
+
+
+def synthetic_text(size: int, seed: int = 0) -> str:
+    """生成指定长度的合成文本，实体与属性在文中多次出现，部分前后矛盾"""
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        sentence = rng.choice(SENTENCES).format(
+            name=rng.choice(NAMES),
+            year=rng.randint(2015, 2024),
+            place=rng.choice(PLACES),
+            money=rng.randint(100, 9999),
+            power=rng.randint(1, 50),
+            staff=rng.randint(10, 5000),
+        )
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)[:size]
+
+
+def start_mock_server(args):
+    """在子进程中启动mock服务，避免其内存计入本进程RSS"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    process = subprocess.Popen([
+        sys.executable, "-m", "bench.mock_server",
+        "--port", str(port),
+        "--latency_dist", args.mock_latency_dist,
+        "--latency_mean", str(args.mock_latency),
+        "--latency_std", str(args.mock_latency / 2),
+        "--token_delay", str(args.mock_token_delay),
+        "--error_rate", str(args.mock_error_rate),
+        "--max_concurrency", str(getattr(args, "mock_max_concurrency", 0)),
+        "--cache_min_tokens", str(args.mock_cache_min_tokens),
+        "--bad_output_models", getattr(args, "mock_bad_output_models", ""),
+        "--bad_output_rate", str(getattr(args, "mock_bad_output_rate", 0.0)),
+    ], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    base_url = f"http://127.0.0.1:{port}/v1"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"{base_url}/models", timeout=1)
+            return process, base_url
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("mock服务启动失败")
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def peak_rss_mb() -> float:
+    # Linux 下 ru_maxrss 单位为KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_inputs(pattern: str):
+    inputs = []
+    for path in sorted(glob.glob(pattern)):
+        if path.endswith(".pdf"):
+            text = extract_text_from_pdf(path)
+        else:
+            text = extract_text_from_docx(path)
+        inputs.append((os.path.basename(path), text))
+    return inputs
+
+
+async def run_case(name: str, text: str, pipeline: str, args, logger):
+    from pipeline.stages import run_consistency_pipeline, run_grammar_pipeline
+
+    async def log_callback(msg, msg_type="log"):
+        pass
+
+    run = run_consistency_pipeline if pipeline == "consistency" else run_grammar_pipeline
+    job_id = str(uuid.uuid4())
+    start = time.perf_counter()
+    with start_trace(job_id, f"pipeline.{pipeline}", pipeline=pipeline) as tracer:
+        await run(text, args, log_callback, logger=logger)
+    elapsed = time.perf_counter() - start
+    tracer.export(args.log_dir)
+
+    calls = [
+        (span.end_ns - span.start_ns) / 1e9
+        for span in tracer.spans if span.kind == SPAN_KIND_CLIENT and span.end_ns
+    ]
+    llm_spans = [span for span in tracer.spans if span.kind == SPAN_KIND_CLIENT]
+    prompt_tokens = sum(span.attributes.get("llm.prompt_tokens", 0) for span in llm_spans)
+    cached_tokens = sum(span.attributes.get("llm.cached_prompt_tokens", 0) for span in llm_spans)
+    return {
+        "input": name,
+        "pipeline": pipeline,
+        "chars": len(text),
+        "seconds": round(elapsed, 3),
+        "chars_per_second": round(len(text) / elapsed, 1) if elapsed else 0.0,
+        "llm_calls": len(calls),
+        "llm_p50": round(percentile(calls, 50), 3),
+        "llm_p95": round(percentile(calls, 95), 3),
+        "prompt_tokens": prompt_tokens,
+        "cached_ratio": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "job_id": job_id,
+        "llm_spans": [
+            {
+                "stage": span.name.removeprefix("llm."),
+                "model": span.attributes.get("llm.model", ""),
+                "seconds": (span.end_ns - span.start_ns) / 1e9,
+                "prompt_tokens": span.attributes.get("llm.prompt_tokens", 0),
+                "completion_tokens": span.attributes.get("llm.completion_tokens", 0),
+            }
+            for span in llm_spans if span.end_ns
+        ],
+    }
+
+
+async def run_job(name: str, text: str, pipeline: str, client_id: str, args, logger, delay: float = 0.0):
+    """与web服务相同，以调度器中一个交互任务的身份运行用例，耗时包含排队时间"""
+    await asyncio.sleep(delay)
+    job = SCHEDULER.new_job(name, client_id, interactive=True, size=len(text))
+    start = time.perf_counter()
+    async with SCHEDULER.admit(job):
+        await run_case(name, text, pipeline, args, logger)
+    return {"input": name, "pipeline": pipeline, "client": client_id, "chars": len(text),
+            "seconds": round(time.perf_counter() - start, 3), **job.report()}
+
+
+async def run_mixed_load(text: str, args, logger):
+    """一个长文档一致性检测任务（按 --shard_chunks 中最大的值分片）运行时，其他客户端陆续提交短小的语法检查任务"""
+    shard_chunks = max(int(n) for n in args.shard_chunks.split(","))
+    case_args = argparse.Namespace(**{**vars(args), "shard_chunks": shard_chunks})
+    configure_dedup(args.dedup_cache_size)
+    jobs = [run_job("long", text, "consistency", "upload", case_args, logger)]
+    for i in range(args.mixed_load):
+        jobs.append(run_job(f"short_{i}", synthetic_text(args.mixed_short_chars, seed=i + 1), "grammar",
+                            f"user{i}", case_args, logger, delay=(i + 1) * args.mixed_interval))
+    return list(await asyncio.gather(*jobs))
+
+
+def print_mixed_report(rows):
+    header = f"{'job':<12}{'pipeline':<13}{'priority':<13}{'chars':>8}{'seconds':>9}{'admit':>8}{'llm_wait':>10}{'calls':>7}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['input']:<12}{r['pipeline']:<13}{r['priority']:<13}{r['chars']:>8}{r['seconds']:>9}"
+              f"{r['admission_wait']:>8}{r['llm_wait']:>10}{r['llm_calls']:>7}")
+    short = [r["seconds"] for r in rows if r["input"] != "long"]
+    if short:
+        print(f"短任务耗时 p50 {percentile(short, 50)}s, p95 {percentile(short, 95)}s")
+
+
+def stage_report(report):
+    """按 (阶段, 模型) 汇总所有用例的LLM调用耗时与估算费用"""
+    groups = {}
+    for case in report:
+        for call in case["llm_spans"]:
+            groups.setdefault((call["stage"], call["model"]), []).append(call)
+    rows = []
+    for (stage, model), calls in sorted(groups.items()):
+        seconds = [c["seconds"] for c in calls]
+        rows.append({
+            "stage": stage,
+            "model": model,
+            "calls": len(calls),
+            "p50": round(percentile(seconds, 50), 3),
+            "p95": round(percentile(seconds, 95), 3),
+            "prompt_tokens": sum(c["prompt_tokens"] for c in calls),
+            "completion_tokens": sum(c["completion_tokens"] for c in calls),
+            "cost": round(sum(estimate_cost(model, c["prompt_tokens"], c["completion_tokens"]) for c in calls), 4),
+        })
+    return rows
+
+
+def print_report(report):
+    header = f"{'input':<24}{'pipeline':<13}{'chars':>8}{'seconds':>9}{'chars/s':>10}{'calls':>7}{'p50':>8}{'p95':>8}{'cached':>8}{'rss(MB)':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in report:
+        print(f"{r['input'][:23]:<24}{r['pipeline']:<13}{r['chars']:>8}{r['seconds']:>9}{r['chars_per_second']:>10}"
+              f"{r['llm_calls']:>7}{r['llm_p50']:>8}{r['llm_p95']:>8}{r['cached_ratio']:>8}{r['peak_rss_mb']:>9}")
+
+
+def print_stage_report(rows):
+    header = f"{'stage':<22}{'model':<18}{'calls':>7}{'p50':>8}{'p95':>8}{'prompt':>9}{'compl':>8}{'cost':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['stage']:<22}{r['model'][:17]:<18}{r['calls']:>7}{r['p50']:>8}{r['p95']:>8}"
+              f"{r['prompt_tokens']:>9}{r['completion_tokens']:>8}{r['cost']:>9}")
+
+
+async def main(args):
+    logger = logging.getLogger("bench")
+    logger.setLevel(logging.WARNING)
+
+    inputs = load_inputs(args.inputs)
+    for size in filter(None, args.synthetic_sizes.split(",")):
+        inputs.append((f"synthetic_{size}", synthetic_text(int(size))))
+
+    # langchain等按需导入，先预热，避免导入耗时计入第一个用例
+    from llm.model import warmup
+    await warmup(args.model_name, args.base_url, logger)
+
+    report = []
+    for name, text in inputs:
+        for pipeline in filter(None, args.pipelines.split(",")):
+            # 一致性检测按每个分片大小各运行一次，比较分片模式随文档长度的扩展性
+            shard_sizes = [int(n) for n in args.shard_chunks.split(",")] if pipeline == "consistency" else [0]
+            for shard_chunks in shard_sizes:
+                case_args = argparse.Namespace(**{**vars(args), "shard_chunks": shard_chunks})
+                # 每个用例从空的去重缓存开始，否则后面的用例（如不同分片大小）会复用前面用例的LLM结果
+                configure_dedup(args.dedup_cache_size)
+                result = await run_case(name, text, pipeline, case_args, logger)
+                if shard_chunks:
+                    result["pipeline"] = f"{pipeline}/s{shard_chunks}"
+                report.append(result)
+                print(f"完成 {name} / {result['pipeline']}: {result['seconds']}s, {result['llm_calls']} 次调用")
+
+    mixed = []
+    if args.mixed_load and inputs:
+        # 最长的输入作为长任务
+        mixed = await run_mixed_load(max((text for _, text in inputs), key=len), args, logger)
+    return report, mixed
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    mock_process = None
+    configure_from_args(args)
+    configure_routes_from_args(args)
+    configure_spill_from_args(args)
+    configure_scheduler_from_args(args)
+    set_model_price(args.model_name, args.prompt_price, args.completion_price)
+    if args.replay:
+        args.base_url = args.base_url or "http://replay.invalid/v1"
+    elif args.endpoints:
+        # 请求由连接池分配到各端点
+        args.base_url = args.base_url or "http://pool.invalid/v1"
+        configure_pool_from_args(args)
+    elif args.base_url is None:
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+        mock_process, args.base_url = start_mock_server(args)
+    try:
+        report, mixed = asyncio.run(main(args))
+    finally:
+        if mock_process is not None:
+            mock_process.terminate()
+    print_report(report)
+    print()
+    stages = stage_report(report)
+    print_stage_report(stages)
+    if mixed:
+        print()
+        print_mixed_report(mixed)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"cases": report, "stages": stages, "mixed": mixed}, f, ensure_ascii=False, indent=4)
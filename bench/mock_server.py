@@ -0,0 +1,274 @@
+# bench/mock_server.py
+# 本地 OpenAI 兼容 mock 服务，用于离线压测与性能回归。
+# 根据 system prompt 判断调用的是哪个chain，返回对应格式的固定回复；可配置延迟分布、逐token输出间隔与错误率。
+# uv run python -m bench.mock_server --port 8001 --latency_dist lognormal --latency_mean 0.8
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import uuid
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible server")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host")
+    parser.add_argument("--port", type=int, default=8001, help="Port")
+    parser.add_argument("--latency_dist", type=str, default="fixed", choices=["fixed", "uniform", "lognormal"], help="Latency distribution of the first token")
+    parser.add_argument("--latency_mean", type=float, default=0.2, help="Mean latency in seconds")
+    parser.add_argument("--latency_std", type=float, default=0.1, help="Latency std (lognormal) or half width (uniform) in seconds")
+    parser.add_argument("--token_delay", type=float, default=0.0, help="Delay between streamed tokens in seconds")
+    parser.add_argument("--max_concurrency", type=int, default=0, help="Requests served at the same time, later requests wait in a FIFO queue, 0 means unlimited")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Probability of answering with a 500/429 error")
+    parser.add_argument("--bad_output_models", type=str, default="", help="Comma separated models whose replies are sometimes cut in half, to exercise model escalation")
+    parser.add_argument("--bad_output_rate", type=float, default=0.0, help="Probability of a cut reply for --bad_output_models")
+    parser.add_argument("--cache_min_tokens", type=int, default=1024, help="Minimum shared prefix length reported as cached prompt tokens")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    return parser.parse_args(argv)
+
+
+def _stable_hash(text: str) -> int:
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _count_tokens(text: str) -> int:
+    # 粗略估算：中文约1字1token，英文约4字符1token
+    cjk = len(re.findall(r"[一-鿿]", text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+# ---------- 各chain的固定回复 ----------
+
+def _grammar_reply(text: str) -> str:
+    # 约1/5的chunk判定为有错误，结果对相同输入保持确定
+    if _stable_hash(text) % 5 == 0:
+        return json.dumps({"correct": False, "content": text, "reason": "标点使用错误"}, ensure_ascii=False)
+    return json.dumps({"correct": True, "content": text, "reason": ""}, ensure_ascii=False)
+
+
+def _grammar_edit_reply(text: str) -> str:
+    # 与完整输出使用相同的判定，有错误时把第一个逗号改为分号
+    pos = text.find("，")
+    if _stable_hash(text) % 5 == 0 and pos != -1:
+        edits = [{"start": pos, "original": "，", "replacement": "；", "type": "标点错误", "reason": "标点使用错误"}]
+        return json.dumps({"correct": False, "edits": edits}, ensure_ascii=False)
+    return json.dumps({"correct": True, "edits": []}, ensure_ascii=False)
+
+
+def _entity_reply(text: str) -> str:
+    text = text.split("当前输入文本:")[-1]
+    words = list(dict.fromkeys(re.findall(r"[一-鿿]{2,4}", text)))
+    entities = []
+    for word in words[:3]:
+        entities.append({
+            "name": word,
+            "type": "概念",
+            "attributes": {"出现位置": str(_stable_hash(text + word) % 10)},
+            "events": [],
+            "relations": [],
+        })
+    return json.dumps(entities, ensure_ascii=False)
+
+
+def _consistency_check_reply(text: str) -> str:
+    try:
+        name = json.loads(text).get("name", "")
+    except ValueError:
+        name = ""
+    has_conflict = _stable_hash(text) % 4 == 0
+    conflicts = [{"type": "属性冲突", "description": f"{name}的属性前后不一致"}] if has_conflict else []
+    return json.dumps({
+        "entity_name": name,
+        "has_conflict": has_conflict,
+        "conflicts": conflicts,
+        "explanation": "",
+    }, ensure_ascii=False)
+
+
+def _summary_reply(text: str) -> str:
+    return text.split("当前输入文本:")[-1][:200]
+
+
+def _correct_reply(text: str) -> str:
+    match = re.search(r"原始文本:(.*)$", text, re.S)
+    return match.group(1) if match else text
+
+
+def _span_reply(text: str) -> str:
+    # 每条冲突标记原文中第一次出现实体名称的位置
+    match = re.search(r"冲突列表:(.*?)\n原始文本:(.*)$", text, re.S)
+    if not match:
+        return json.dumps({"spans": []})
+    conflicts, chunk = json.loads(match.group(1)), match.group(2)
+    spans = [
+        {"anchor": c["entity_name"], "conflict_ids": [c["id"]]}
+        for c in conflicts if c.get("entity_name") and c["entity_name"] in chunk
+    ]
+    return json.dumps({"spans": spans}, ensure_ascii=False)
+
+
+def _feedback_reply(text: str) -> str:
+    return "用户希望修改结果更加自然。"
+
+
+# system prompt 特征 -> 回复函数
+REPLIES = [
+    # 两种语法检查的角色描述相同，编辑操作格式需要先匹配
+    ("只输出需要修改之处的编辑操作", _grammar_edit_reply),
+    ("语法和拼写纠错专家", _grammar_reply),
+    ("通用信息抽取模型", _entity_reply),
+    ("实体一致性分析器", _consistency_check_reply),
+    ("文档压缩专家", _summary_reply),
+    ("一致性矛盾细粒度标注器", _correct_reply),
+    ("一致性矛盾片段定位器", _span_reply),
+    ("反馈分析专家", _feedback_reply),
+]
+
+
+def build_reply(messages) -> str:
+    system = "\n".join(m.get("content", "") for m in messages if m.get("role") == "system")
+    human = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    for marker, reply in REPLIES:
+        if marker in system:
+            return reply(human)
+    return "ok"
+
+
+def create_mock_app(config) -> FastAPI:
+    app = FastAPI(title="TextGuard mock LLM")
+    rng = random.Random(config.seed)
+    stats = {"requests": 0, "errors": 0, "bad_outputs": 0, "prompt_tokens": 0, "cached_tokens": 0}
+    app.state.stats = stats
+    bad_output_models = set(filter(None, config.bad_output_models.split(",")))
+    seen_prefixes = set()
+
+    def cached_prefix_tokens(messages) -> int:
+        """模拟模型服务的前缀缓存：以整条消息为单位，计算与之前请求相同的最长前缀token数"""
+        digest = hashlib.sha1()
+        prefixes = []
+        total = cached = 0
+        for message in messages:
+            digest.update(json.dumps(message, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+            prefix = digest.hexdigest()
+            total += _count_tokens(message.get("content", ""))
+            if prefix in seen_prefixes:
+                cached = total
+            prefixes.append(prefix)
+        seen_prefixes.update(prefixes)
+        return cached if cached >= config.cache_min_tokens else 0
+
+    capacity = asyncio.Semaphore(config.max_concurrency) if config.max_concurrency > 0 else None
+
+    def sample_latency() -> float:
+        if config.latency_dist == "uniform":
+            return max(0.0, rng.uniform(config.latency_mean - config.latency_std, config.latency_mean + config.latency_std))
+        if config.latency_dist == "lognormal" and config.latency_mean > 0:
+            # 按均值与标准差换算对数正态参数
+            variance = config.latency_std ** 2
+            sigma2 = math.log(1 + variance / config.latency_mean ** 2)
+            mu = math.log(config.latency_mean) - sigma2 / 2
+            return rng.lognormvariate(mu, sigma2 ** 0.5)
+        return config.latency_mean
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model"}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        # 模拟模型服务的容量上限：超出的请求在服务端排队，流式响应输出结束后才释放
+        if capacity is not None:
+            await capacity.acquire()
+        streaming = False
+        try:
+            await asyncio.sleep(sample_latency())
+            if rng.random() < config.error_rate:
+                stats["errors"] += 1
+                status = rng.choice([429, 500])
+                return JSONResponse({"error": {"message": "mock error", "type": "server_error"}}, status_code=status)
+
+            messages = body.get("messages", [])
+            content = build_reply(messages)
+            model = body.get("model", "mock")
+            if model in bad_output_models and rng.random() < config.bad_output_rate:
+                # 模拟小模型输出不完整的JSON
+                stats["bad_outputs"] += 1
+                content = content[:len(content) // 2]
+            completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+            created = int(time.time())
+            usage = {
+                "prompt_tokens": sum(_count_tokens(m.get("content", "")) for m in messages),
+                "completion_tokens": _count_tokens(content),
+            }
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            usage["prompt_tokens_details"] = {"cached_tokens": cached_prefix_tokens(messages)}
+            stats["prompt_tokens"] += usage["prompt_tokens"]
+            stats["cached_tokens"] += usage["prompt_tokens_details"]["cached_tokens"]
+
+            if not body.get("stream"):
+                return {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": usage,
+                }
+
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+            async def event_stream():
+                def chunk(delta, finish_reason=None):
+                    return {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                    }
+                yield f"data: {json.dumps(chunk({'role': 'assistant', 'content': ''}), ensure_ascii=False)}\n\n"
+                # 每次输出若干字符，模拟逐token生成
+                for i in range(0, len(content), 4):
+                    if config.token_delay:
+                        await asyncio.sleep(config.token_delay)
+                    yield f"data: {json.dumps(chunk({'content': content[i:i + 4]}), ensure_ascii=False)}\n\n"
+                yield f"data: {json.dumps(chunk({}, 'stop'), ensure_ascii=False)}\n\n"
+                if include_usage:
+                    final = chunk({})
+                    final["choices"] = []
+                    final["usage"] = usage
+                    yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            async def limited_stream():
+                try:
+                    async for part in event_stream():
+                        yield part
+                finally:
+                    capacity.release()
+
+            streaming = True
+            return StreamingResponse(event_stream() if capacity is None else limited_stream(), media_type="text/event-stream")
+        finally:
+            if capacity is not None and not streaming:
+                capacity.release()
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    config = parse_args()
+    uvicorn.run(create_mock_app(config), host=config.host, port=config.port, log_level="warning")
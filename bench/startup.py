@@ -0,0 +1,114 @@
+# bench/startup.py
+# 启动耗时基准：统计各入口模块的冷启动导入耗时，以及服务从启动到可用、到第一个请求完成的耗时。
+# 每次测量都在新的子进程中进行：
+# uv run python -m bench.startup --serve
+import sys
+import os
+
+# 添加项目根目录到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.benchmark import start_mock_server
+
+import argparse
+import asyncio
+import json
+import socket
+import subprocess
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Startup benchmark")
+    parser.add_argument("--modules", type=str, default="main,web,consistency_check,grammar_check,batch_check", help="Comma separated modules to import")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, the best is reported")
+    parser.add_argument("--serve", action="store_true", help="Also measure server readiness and first request latency, with and without --warmup")
+    parser.add_argument("--mock_latency", type=float, default=0.05, help="Mean latency of the mock server in seconds")
+    parser.add_argument("--output", type=str, default=None, help="Write the report as JSON")
+    args = parser.parse_args()
+    # start_mock_server 所需的其余mock参数
+    args.mock_latency_dist = "uniform"
+    args.mock_token_delay = 0.0
+    args.mock_error_rate = 0.0
+    args.mock_cache_min_tokens = 1024
+    return args
+
+
+def import_seconds(module: str) -> float:
+    """在新进程中导入模块，返回导入耗时（不含解释器启动）"""
+    code = f"import time; s = time.perf_counter(); import {module}; print(time.perf_counter() - s)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+async def first_request_seconds(port: int) -> float:
+    """通过websocket发送一个语法纠错请求，返回到任务完成的耗时"""
+    import websockets
+    start = time.perf_counter()
+    async with websockets.connect(f"ws://127.0.0.1:{port}/ws/chat", max_size=None) as ws:
+        await ws.send(json.dumps({"message": "今天天气很好，我们一起去公园散步。", "pipeline": "grammar"}))
+        while True:
+            data = json.loads(await ws.recv())
+            if data.get("done") or data.get("error"):
+                return time.perf_counter() - start
+
+
+def serve_seconds(base_url: str, warmup: bool):
+    """
+    启动服务子进程，返回 (进程启动到/metrics可用的耗时, 第一个请求的耗时)
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "mock"))
+    env["TEXTGUARD_ARGS"] = f"--model_name mock --base_url {base_url} --log_dir /tmp/textguard_startup" + (" --warmup" if warmup else "")
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:create_app", "--factory", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=1)
+                break
+            except OSError:
+                if process.poll() is not None or time.perf_counter() - start > 60:
+                    raise RuntimeError("服务启动失败")
+                time.sleep(0.01)
+        ready = time.perf_counter() - start
+        return ready, asyncio.run(first_request_seconds(port))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(args):
+    report = {"imports": {}, "serve": {}}
+    for module in args.modules.split(","):
+        report["imports"][module] = round(min(import_seconds(module) for _ in range(args.repeat)), 3)
+        print(f"import {module:<20}{report['imports'][module]:>8}s")
+    if args.serve:
+        mock_process, base_url = start_mock_server(args)
+        try:
+            for warmup in (False, True):
+                runs = [serve_seconds(base_url, warmup) for _ in range(args.repeat)]
+                name = "warmup" if warmup else "cold"
+                report["serve"][name] = {
+                    "ready": round(min(r[0] for r in runs), 3),
+                    "first_request": round(min(r[1] for r in runs), 3),
+                }
+                print(f"serve {name:<8} ready {report['serve'][name]['ready']:>7}s  first request {report['serve'][name]['first_request']:>7}s")
+        finally:
+            mock_process.terminate()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+    return report
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -1,7 +1,8 @@
-from llm.model import get_entity_extract_chain, get_entity_consistency_check_chain, get_memory_summary_chain, get_consistency_correct_chain
-from llm.entity import extract_entities, check_entity_consistency, summarize_entity_memory
+from pipeline.engine import PipelineContext, run_sync
+from pipeline.stages import CONSISTENCY_PIPELINE
+from pipeline.spill import dump_json
 from llm.entity import EntityStore
-from filereader.reader import extract_text_from_pdf, extract_text_from_docx, chunking
+from filereader.reader import extract_text_from_docx
 
 import argparse
 import logging
@@ -14,6 +15,9 @@ def parse_args():
     parser.add_argument("--base_url", type=str, default="https://dashscope.aliyuncs.com/compatible-mode/v1", help="Base URL")
     parser.add_argument("--docx_data", type=str, default="./dataset/test_long.docx", help="Docs Dataset path")
     #parser.add_argument("--pdf_data", type=str, default="./dataset/test.pdf", help="PDF Dataset path")
+    parser.add_argument("--correct_output", type=str, default="full", choices=["full", "spans"], help="Consistency correction output: the full marked chunk, or only the spans to mark applied locally")
+    parser.add_argument("--shard_chunks", type=int, default=0, help="Split documents into shards of this many 1024-char chunks, extracted concurrently and reconciled, 0 disables sharding")
+    parser.add_argument("--shard_concurrency", type=int, default=4, help="Shards processed at the same time in sharded mode")
     parser.add_argument("--log_dir", type=str, default="./logs", help="Output path")
     args = parser.parse_args()
     return args
@@ -53,57 +57,29 @@ def check_consistency(args, **kwargs):
     检查文档中的实体一致性
     返回冲突检测结果列表
     '''
-    logger = kwargs.get("logger")
+    return check_consistency_with_store(args, **kwargs)[0]
 
-    # chain获取
-    entity_extract_chain = get_entity_extract_chain(args.model_name, args.base_url)
-    entity_consistency_check_chain = get_entity_consistency_check_chain(args.model_name, args.base_url)
-    memory_summary_chain = get_memory_summary_chain(args.model_name, args.base_url)
+def check_consistency_with_store(args, **kwargs):
+    '''
+    同 check_consistency，
+    返回 (冲突检测结果列表, 实体存储)，实体存储带有抽取时记录的实体出现位置，供修正阶段分配冲突
+    '''
+    logger = kwargs.get("logger")
 
-    # 文档读取
-    logger.info(f"读取文档: {args.docx_data}")
-    text = extract_text_from_docx(args.docx_data)
-    chunks = chunking(text)
-
-    # chunking后，保留上下文提取实体
-    ent_store = EntityStore()
-    previous_memory = ""
-
-    for i, chunk in enumerate(chunks):
-        chunk_input = f"前文要点总结:{previous_memory}\n当前输入文本:{chunk}" if previous_memory else chunk
-        # 提出本chunk的实体
-        ents = extract_entities(entity_extract_chain, chunk_input)
-        for ent in ents:
-            ent_store.add_entity(ent)
-        logger.info(f"当前chunk实体: {ents}")
-
-        if i < len(chunks) - 1:
-            # 更新memory，用于下一chunk
-            previous_memory = summarize_entity_memory(memory_summary_chain, chunk_input)
-            logger.info(f"对第{i+1}个chunk总结: {previous_memory}")
-
-    # # 不chunking，直接提取所有实体
-    # logger.info("开始提取所有实体")
-    # ents = extract_entities(entity_extract_chain, text)
-    # for ent in ents:
-    #     ent_store.add_entity(ent)
-    # logger.info(f"所有实体: {ents}")
-
-    # 冲突检测
-    consistency_results = []
-    logger.info(f"提取出的所有实体: {ent_store.all_entities()}")
-    logger.info("开始检测实体冲突")
-    for ent in ent_store.all_entities():
-        res = check_entity_consistency(entity_consistency_check_chain, ent)
-        logger.info(f"对于实体 {ent.entity_id} 的冲突分析: {res}")
-        consistency_results.append(res)
+    # 文档读取，已读取过的文档可通过 text 传入
+    text = kwargs.get("text")
+    inputs = {"text": text} if text is not None else {"source": {"path": args.docx_data}}
+    ctx = PipelineContext(args, logger=logger)
+    values = run_sync(CONSISTENCY_PIPELINE.run(ctx, targets=["consistency_results", "entity_store"], **inputs))
+    consistency_results = values["consistency_results"]
+    ent_store = values["entity_store"]
 
     # 保存一致性检查结果
     consistency_save_name = kwargs.get("save_name", "consistency_result.json")
     save_dir = os.path.join(args.log_dir, os.path.basename(args.docx_data).split(".")[0])
     os.makedirs(save_dir, exist_ok=True)
     with open(os.path.join(save_dir, consistency_save_name), "w", encoding="utf-8") as f:
-        json.dump(consistency_results, f, ensure_ascii=False, indent=4)
+        dump_json(consistency_results, f)
         logger.info(f"一致性检查结果已保存到: {os.path.join(save_dir, consistency_save_name)}")
     # 保留全部实体列表
     all_entities_save_name = "all_entities.json"
@@ -111,7 +87,7 @@ def check_consistency(args, **kwargs):
         json.dump([ent.model_dump() for ent in ent_store.all_entities()], f, ensure_ascii=False, indent=4)
         logger.info(f"所有实体已保存到: {os.path.join(save_dir, all_entities_save_name)}")
 
-    return consistency_results
+    return consistency_results, ent_store
 
 def correct_based_on_consistency(args, **kwargs):
     """
@@ -121,34 +97,23 @@ def correct_based_on_consistency(args, **kwargs):
     consistency_results = kwargs.get("consistency_results")
     logger = kwargs.get("logger")
 
-    # 对输入的实体进行剔除，只保留冲突实体
-    conflict_ents = [ent for ent in consistency_results if ent["has_conflict"] is True]
-    logger.info(f"冲突实体: {conflict_ents}")
-    consistency_correct_chain = get_consistency_correct_chain(args.model_name, args.base_url)
-
-    # 文档读取
-    logger.info(f"读取文档: {args.docx_data}")
-    text = extract_text_from_docx(args.docx_data)
-    chunks = chunking(text)
-    res_list = []
-
-    # 对每个chunk进行修正
-    for chunk in chunks:
-        chunk_input = f"原始文本:{chunk}\n实体冲突分析结果:{consistency_results}"
-        res = consistency_correct_chain.invoke(chunk_input).content
-        logger.info(f"段落修正结果: \n{res}")
-        res_dict = {
-            "original_text": chunk,
-            "corrected_text": res
-        }
-        res_list.append(res_dict)
+    # 文档读取，已读取过的文档可通过 text 传入；已有检查结果时不再重复抽取与检查
+    text = kwargs.get("text")
+    inputs = {"text": text} if text is not None else {"source": {"path": args.docx_data}}
+    # 没有实体出现位置时，按实体名称在chunk中的出现分配冲突
+    entity_store = kwargs.get("entity_store") or EntityStore()
+    ctx = PipelineContext(args, logger=logger)
+    values = run_sync(CONSISTENCY_PIPELINE.run(
+        ctx, targets=["corrected"], consistency_results=consistency_results, entity_store=entity_store, **inputs
+    ))
+    res_list = values["corrected"]
 
     # 保存修正后的结果为txt文件
     save_name = kwargs.get("save_name", "corrected_result.txt")
     save_dir = os.path.join(args.log_dir, os.path.basename(args.docx_data).split(".")[0])
     os.makedirs(save_dir, exist_ok=True)
     with open(os.path.join(save_dir, save_name), "w", encoding="utf-8") as f:
-        json.dump(res_list, f, ensure_ascii=False, indent=4)
+        dump_json(res_list, f)
         logger.info(f"修正后的结果已保存到: {os.path.join(save_dir, save_name)}")
     
     return res_list
@@ -172,11 +137,14 @@ if __name__ == "__main__":
 
     logger.info(f"开始运行一致性检查，模型: {args.model_name}, 数据集: {args.docx_data}")
 
-    consistency = check_consistency(args, logger=logger)
+    # 文档只读取一次，两个阶段共用
+    text = extract_text_from_docx(args.docx_data)
+    consistency, entity_store = check_consistency_with_store(args, logger=logger, text=text)
     logger.info(f"一致性检查结果: {consistency}")
 
     # # 从文件中读取一致性检查结果
     # consistency = get_consistency_from_file(args, logger=logger)
+    # entity_store = None
 
-    corrected_chunks = correct_based_on_consistency(args, consistency_results=consistency, logger=logger)
+    corrected_chunks = correct_based_on_consistency(args, consistency_results=consistency, entity_store=entity_store, logger=logger, text=text)
     logger.info(f"修正后的chunk结果: {corrected_chunks}")
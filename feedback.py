@@ -1,7 +1,12 @@
 from llm.model import get_feedback_summary_chain
+from llm.scheduler import llm_slot
+import asyncio
 import json
 import os
 import logging
+import threading
+import time
+import uuid
 
 def logging_config(args):
     # 日志文件路径
@@ -32,15 +37,148 @@ def logging_config(args):
     logger.addHandler(console_handler)
     logger.addHandler(file_handler)
     return logger
+# pipeline类型 -> 反馈总结prompt中对模型输出的称呼
+RESULT_TYPES = {
+    "consistency": "一致性分析结果",
+    "grammar": "语法检查结果",
+}
+
+class FeedbackStore:
+    """
+    只追加的反馈存储：每条记录一行JSON写入 user_feedback.jsonl，
+    索引文件 user_feedback.index.jsonl 记录每条记录的id、偏移、长度、pipeline与时间，
+    按id读取或列出记录时无需解析整个文件
+    """
+    def __init__(self, save_dir: str):
+        os.makedirs(save_dir, exist_ok=True)
+        self.path = os.path.join(save_dir, "user_feedback.jsonl")
+        self.index_path = os.path.join(save_dir, "user_feedback.index.jsonl")
+        self.index = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.index[entry["id"]] = entry
+        # 旧版 user_feedback.txt（以逗号分隔的JSON）只导入一次
+        legacy = os.path.join(save_dir, "user_feedback.txt")
+        if not self.index and os.path.exists(legacy):
+            self._import_legacy(legacy)
+
+    def _import_legacy(self, legacy: str):
+        with open(legacy, "r", encoding="utf-8") as f:
+            content = f.read().strip().rstrip(",")
+        if not content:
+            return
+        for record in json.loads(f"[{content}]"):
+            pipeline = "consistency" if "consistency_results" in record else "grammar"
+            self.append({
+                "pipeline": pipeline,
+                "user_feedback": record.get("user_feedback"),
+                "feedback_summary": record.get("feedback_summary"),
+                "results": record.get("consistency_results", record.get("grammar_results")),
+            })
+
+    def append(self, record: dict) -> str:
+        """追加一条记录，返回记录id"""
+        record = {"id": uuid.uuid4().hex, "created_at": time.time(), **record}
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(line)
+            entry = {
+                "id": record["id"],
+                "offset": offset,
+                "length": len(line),
+                "pipeline": record.get("pipeline"),
+                "created_at": record["created_at"],
+            }
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.index[record["id"]] = entry
+        return record["id"]
+
+    def get(self, feedback_id: str):
+        entry = self.index.get(feedback_id)
+        if entry is None:
+            return None
+        with open(self.path, "rb") as f:
+            f.seek(entry["offset"])
+            return json.loads(f.read(entry["length"]))
+
+    def list(self, pipeline: str | None = None, limit: int = 20):
+        """按时间倒序列出索引条目"""
+        entries = [e for e in self.index.values() if pipeline is None or e["pipeline"] == pipeline]
+        return sorted(entries, key=lambda e: e["created_at"], reverse=True)[:limit]
+
+
+_stores = {}
+
+def get_feedback_store(save_dir: str) -> FeedbackStore:
+    if save_dir not in _stores:
+        _stores[save_dir] = FeedbackStore(save_dir)
+    return _stores[save_dir]
+
+def _summary_inputs(pipeline: str, results, user_feedback: str) -> dict:
+    return {
+        "result_type": RESULT_TYPES[pipeline],
+        "results": str(results),
+        "user_feedback": user_feedback,
+    }
+
+async def submit_feedback(pipeline: str, results, user_feedback: str, save_dir: str, args, logger=None):
+    """
+    总结并保存用户反馈，总结调用异步进行，写入在线程池中进行，不阻塞事件循环
+    :param pipeline: consistency / grammar
+    :param results: 用户反馈所针对的模型输出
+    :param user_feedback: 用户反馈文本
+    :return: (记录id, 反馈总结)
+    """
+    if logger is None:
+        logger = logging.getLogger()
+    if pipeline not in RESULT_TYPES:
+        raise ValueError(f"未知的pipeline类型：{pipeline}")
+    logger.info("调用LLM总结用户反馈")
+    feedback_chain = get_feedback_summary_chain(args.model_name, args.base_url)
+    async with llm_slot():
+        summary_result = (await feedback_chain.ainvoke(_summary_inputs(pipeline, results, user_feedback))).content
+    store = get_feedback_store(save_dir)
+    feedback_id = await asyncio.to_thread(store.append, {
+        "pipeline": pipeline,
+        "user_feedback": user_feedback,
+        "feedback_summary": summary_result,
+        "results": results,
+    })
+    logger.info(f"用户反馈和总结已保存到: {store.path} (id={feedback_id})")
+    return feedback_id, summary_result
+
+def record_feedback(pipeline: str, results, user_feedback: str, save_dir: str, args, logger=None):
+    """submit_feedback 的同步版本，供命令行使用"""
+    if logger is None:
+        logger = logging.getLogger()
+    logger.info("调用LLM总结用户反馈")
+    feedback_chain = get_feedback_summary_chain(args.model_name, args.base_url)
+    summary_result = feedback_chain.invoke(_summary_inputs(pipeline, results, user_feedback)).content
+    store = get_feedback_store(save_dir)
+    feedback_id = store.append({
+        "pipeline": pipeline,
+        "user_feedback": user_feedback,
+        "feedback_summary": summary_result,
+        "results": results,
+    })
+    logger.info(f"用户反馈和总结已保存到: {store.path} (id={feedback_id})")
+    return summary_result
+
 def collect_consistency_feedback(consistency_results, save_dir, args, logger=None):
     """
-    收集用户对一致性标注结果的反馈
+    命令行收集用户对一致性标注结果的反馈
     """
+    if logger is None:
+        logger = logging.getLogger()
     if not consistency_results:
         logger.info("未收到一致性标注结果，跳过反馈收集")
         return None
-    if logger is None:
-        logger = logging.getLogger()
     logger.info("开始收集用户反馈")
     for i, result in enumerate(consistency_results):
         logger.info(f"\nChunk {i+1}:")
@@ -51,39 +189,12 @@ def collect_consistency_feedback(consistency_results, save_dir, args, logger=Non
     if not user_feedback.strip():
         logger.info("未收到用户反馈，跳过反馈总结")
         return None
-    
-    # 调用LLM总结反馈
-    logger.info("调用LLM总结用户反馈")
-    feedback_chain = get_feedback_summary_chain(args.model_name, args.base_url)
-    
-    # 准备输入
-    input_data = {
-        "consistency_results": str(consistency_results),
-        "user_feedback": user_feedback
-    }
-    
-    # 获取总结结果
-    summary_result = feedback_chain.invoke(input_data).content
-    
-    # 保存反馈和总结
-    feedback_data = {
-        "user_feedback": user_feedback,
-        "feedback_summary": summary_result,
-        "consistency_results": consistency_results
-    }
-    
-    feedback_file = os.path.join(save_dir, "user_feedback.txt")
-    # 追加写入
-    with open(feedback_file, "a", encoding="utf-8") as f:
-        f.write(json.dumps(feedback_data, ensure_ascii=False, indent=4) + ",\n")
-    logger.info(f"用户反馈和总结已保存到: {feedback_file}")
-
-    return summary_result
+    return record_feedback("consistency", consistency_results, user_feedback, save_dir, args, logger)
 
 
 def collect_grammar_feedback(grammar_results, save_dir, args, logger=None):
     """
-    收集用户对语法检查结果的反馈
+    命令行收集用户对语法检查结果的反馈
     
     参数：
     grammar_results: 语法检查结果列表
@@ -115,33 +226,8 @@ def collect_grammar_feedback(grammar_results, save_dir, args, logger=None):
         logger.info("未收到用户反馈，跳过反馈总结")
         return None
     
-    # 调用LLM总结反馈
-    logger.info("调用LLM总结用户反馈")
-    feedback_chain = get_feedback_summary_chain(args.model_name, args.base_url)
-    
-    # 准备输入
-    input_data = {
-        "grammar_results": str(grammar_results),
-        "user_feedback": user_feedback
-    }
-    
-    # 获取总结结果
-    summary_result = feedback_chain.invoke(input_data).content
-    
-    # 保存反馈和总结
-    feedback_data = {
-        "user_feedback": user_feedback,
-        "feedback_summary": summary_result,
-        "grammar_results": grammar_results
-    }
-    
-    feedback_file = os.path.join(save_dir, "user_feedback.txt")
-    with open(feedback_file, "a", encoding="utf-8") as f:
-        f.write(json.dumps(feedback_data, ensure_ascii=False, indent=4) + ",\n")
-    
-    logger.info(f"用户反馈已保存到 {feedback_file}")
+    summary_result = record_feedback("grammar", grammar_results, user_feedback, save_dir, args, logger)
     logger.info(f"反馈总结: {summary_result}")
-    
     return summary_result
 
 if __name__ == "__main__":
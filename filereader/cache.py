@@ -0,0 +1,191 @@
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+
+from monitor.metrics import CACHE_HITS, CACHE_MISSES, DOC_CACHE_DISK_BYTES
+
+logger = logging.getLogger(__name__)
+
+# 解析逻辑变化导致提取结果不同时递增，旧的磁盘缓存自然失效
+PARSER_VERSION = 1
+
+
+class DocumentCache:
+    """
+    解析结果缓存，两级：内存LRU与磁盘目录，均按字节数（JSON序列化后的长度）限制大小。
+    磁盘上每条一个JSON文件，按修改时间淘汰最久未使用的文件，命中时更新修改时间
+    :param memory_bytes: 内存上限，0表示不使用内存缓存
+    :param directory: 磁盘缓存目录
+    :param disk_bytes: 磁盘上限，0表示不使用磁盘缓存
+    """
+    def __init__(self, memory_bytes: int = 64 * 1024 * 1024, directory: str | None = None, disk_bytes: int = 0):
+        self.memory_bytes = memory_bytes
+        self.directory = directory
+        self.disk_bytes = disk_bytes if directory else 0
+        self._memory = OrderedDict()  # key -> (value, bytes)
+        self._memory_used = 0
+        self._disk_used = None  # 第一次写入时扫描目录
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _remember(self, key: str, value, size: int):
+        if size > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_used -= self._memory.pop(key)[1]
+        self._memory[key] = (value, size)
+        self._memory_used += size
+        while self._memory_used > self.memory_bytes:
+            self._memory_used -= self._memory.popitem(last=False)[1][1]
+
+    def get(self, key: str, cache: str = "document"):
+        """
+        读取缓存，依次查找内存与磁盘，磁盘命中的条目放回内存
+        :param cache: 指标中的缓存名，磁盘命中记为 {cache}_disk
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                CACHE_HITS.inc(cache=cache)
+                return self._memory[key][0]
+        if self.disk_bytes > 0:
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    raw = f.read()
+                os.utime(path)
+                value = json.loads(raw)
+            except (OSError, ValueError):
+                value = None
+            if value is not None:
+                with self._lock:
+                    self._remember(key, value, len(raw.encode("utf-8")))
+                CACHE_HITS.inc(cache=f"{cache}_disk")
+                return value
+        CACHE_MISSES.inc(cache=cache)
+        return None
+
+    def put(self, key: str, value):
+        raw = json.dumps(value, ensure_ascii=False)
+        size = len(raw.encode("utf-8"))
+        with self._lock:
+            self._remember(key, value, size)
+        if self.disk_bytes <= 0 or size > self.disk_bytes:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            # 先写临时文件再改名，并发读取不会读到写了一半的文件
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(raw)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"解析结果写入磁盘缓存失败: {e}")
+            return
+        with self._lock:
+            if self._disk_used is None:
+                self._disk_used = self._scan()
+            else:
+                self._disk_used += size
+            if self._disk_used > self.disk_bytes:
+                self._evict()
+            DOC_CACHE_DISK_BYTES.set(self._disk_used)
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+    def _scan(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        """删除最久未使用的文件，直到磁盘占用不超过上限"""
+        entries = sorted(self._entries())
+        self._disk_used = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if self._disk_used <= self.disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            self._disk_used -= size
+
+
+DOC_CACHE = DocumentCache()
+
+
+def configure_doc_cache(memory_mb: float, directory: str | None, disk_mb: float):
+    """
+    设置解析结果缓存，内存中已缓存的结果会被清空
+    :param memory_mb: 内存上限(MB)，0表示不使用内存缓存
+    :param directory: 磁盘缓存目录
+    :param disk_mb: 磁盘上限(MB)，0表示不使用磁盘缓存
+    """
+    with DOC_CACHE._lock:
+        DOC_CACHE.memory_bytes = int(memory_mb * 1024 * 1024)
+        DOC_CACHE.directory = directory
+        DOC_CACHE.disk_bytes = int(disk_mb * 1024 * 1024) if directory else 0
+        DOC_CACHE._memory.clear()
+        DOC_CACHE._memory_used = 0
+        DOC_CACHE._disk_used = None
+    if DOC_CACHE.disk_bytes > 0:
+        logger.info(f"解析结果磁盘缓存 {disk_mb}MB: {directory}")
+
+
+def configure_doc_cache_from_args(args):
+    configure_doc_cache(getattr(args, "doc_cache_mb", 64.0),
+                        getattr(args, "doc_cache_dir", None) or os.path.join(args.log_dir, "doc_cache"),
+                        getattr(args, "doc_cache_disk_mb", 0.0))
+
+
+def cached_parse(kind: str, data: bytes, parse) -> str:
+    """
+    按文件内容的哈希读取解析出的文本，未命中时调用 parse(data) 并缓存。
+    只缓存完整提取的非空文本，中途失败时返回的部分文本不缓存，下次重新解析
+    :param kind: 文件格式，pdf / docx
+    :param parse: parse(data) -> (文本, 是否完整提取)
+    """
+    key = f"{kind}-v{PARSER_VERSION}-{hashlib.sha256(data).hexdigest()}"
+    text = DOC_CACHE.get(key)
+    if text is not None:
+        return text
+    text, complete = parse(data)
+    if complete and text:
+        DOC_CACHE.put(key, text)
+    return text
+
+
+def cached_chunking(text: str, chunk_size: int, split):
+    """
+    按文本哈希与chunk大小缓存chunk边界 [[start, end], ...]，命中时直接按边界切分，不再查找标点
+    :param split: split(text, chunk_size) -> 连续的chunk列表
+    """
+    if len(text) <= chunk_size:
+        return split(text, chunk_size)
+    key = f"chunks{chunk_size}-{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
+    bounds = DOC_CACHE.get(key, cache="chunks")
+    if bounds is not None:
+        return [text[start:end] for start, end in bounds]
+    chunks = split(text, chunk_size)
+    bounds, pos = [], 0
+    for chunk in chunks:
+        bounds.append([pos, pos + len(chunk)])
+        pos += len(chunk)
+    DOC_CACHE.put(key, bounds)
+    return chunks
@@ -1,43 +1,61 @@
-from docx import Document
-from pypdf import PdfReader
+from __future__ import annotations
 from io import BytesIO
-from fastapi import UploadFile
+from typing import TYPE_CHECKING
 
 import logging
+
+from .cache import cached_parse
+
+# pypdf / python-docx / fastapi 只在解析对应格式时导入，chunking等轻量功能无需等待
+if TYPE_CHECKING:
+    from fastapi import UploadFile
+
 logger = logging.getLogger(__name__)
 
-def extract_text_from_pdf(file_obj):
+def _read_bytes(file_obj) -> bytes:
     # 判断是否是文件路径
     if isinstance(file_obj, str):
-        reader = PdfReader(file_obj)
-    else:
-        file_obj.seek(0)
-        bio = BytesIO(file_obj.read())
-        reader = PdfReader(bio)
+        with open(file_obj, "rb") as f:
+            return f.read()
+    file_obj.seek(0)
+    return file_obj.read()
+
+def _parse_pdf(data: bytes) -> tuple[str, bool]:
+    """返回 (提取出的文本, 是否完整提取)，中途失败时返回已提取的部分"""
+    from pypdf import PdfReader
+    reader = PdfReader(BytesIO(data))
     text = ""
     try:
         for page in reader.pages:
             text += page.extract_text() + "\n"
     except Exception as e:
         logger.error(f"PDF 文本提取失败: {e}")
-        logger.debug("pdf_file:", file_obj)
-    return text
+        return text, False
+    return text, True
 
-def extract_text_from_docx(file_obj):
-    # 判断是否是路径
-    if isinstance(file_obj, str):
-        doc = Document(file_obj)
-    else:
-        file_obj.seek(0)
-        bio = BytesIO(file_obj.read())
-        doc = Document(bio)
+def _parse_docx(data: bytes) -> tuple[str, bool]:
+    from docx import Document
+    doc = Document(BytesIO(data))
     try:
         text = "\n".join(p.text for p in doc.paragraphs)
     except Exception as e:
         logger.error(f"DOCX 文本提取失败: {e}")
-        logger.debug("docx_file:", file_obj)
-        text = ""
-    return text
+        return "", False
+    return text, True
+
+def extract_text_from_pdf(file_obj):
+    """提取PDF文本，相同内容的文件直接返回缓存的解析结果"""
+    return cached_parse("pdf", _read_bytes(file_obj), _parse_pdf)
+
+def extract_text_from_docx(file_obj):
+    """提取DOCX文本，相同内容的文件直接返回缓存的解析结果"""
+    return cached_parse("docx", _read_bytes(file_obj), _parse_docx)
+
+def extract_text_from_path(path: str):
+    # 按扩展名选择解析方式，默认为docx
+    if path.lower().endswith(".pdf"):
+        return extract_text_from_pdf(path)
+    return extract_text_from_docx(path)
 
 def chunking(text, chunk_size=1024):
     """
@@ -2,6 +2,7 @@ let ws;
 let isConnected = false;
 let currentFullscreenId = null;
 let currentResults = { consistency: null, grammar: null };
+let currentJobId = null;
 
 // 确保DOM加载完成后再执行DOM操作
 document.addEventListener('DOMContentLoaded', function() {
@@ -116,6 +117,8 @@ function sendMessage(pipelineType) {
         ws.onopen = () => {
             isConnected = true;
             addLog("已连接到服务器...", "info");
+            clearStream(pipelineType);
+            currentResults[pipelineType] = [];
             console.log('WebSocket连接已打开');
             
             const reader = new FileReader();
@@ -137,25 +140,46 @@ function sendMessage(pipelineType) {
             console.log('收到WebSocket消息:', event.data);
             try {
                 const data = JSON.parse(event.data);
-                if (data.log) {
+                if (data.job_id && data.pipeline && data.result === undefined && !data.done) {
+                    // 任务开始，记录job_id用于终止
+                    currentJobId = data.job_id;
+                } else if (data.cancel_result !== undefined) {
+                    addLog(data.cancel_result ? "已终止pipeline执行" : "任务不存在或已结束", "warning");
+                } else if (data.delta !== undefined) {
+                    appendDelta(data.pipeline, data.chunk_index, data.delta);
+                } else if (data.progress) {
+                    const p = data.progress;
+                    const status = p.status === 'start' ? '开始' : `完成 (${p.seconds}s)`;
+                    addLog(`[${data.pipeline}] 阶段 ${p.stage} ${status}`, "info");
+                } else if (data.log) {
                     addLog(data.log, "log");
-                } else if (data.results) {
-                    addLog("\n=== 任务完成 ===", "success");
+                } else if (data.result !== undefined) {
+                    // 单个chunk的最终结果，按序号保存
+                    if (!currentResults[data.pipeline]) {
+                        currentResults[data.pipeline] = [];
+                    }
+                    currentResults[data.pipeline][data.index] = data.result;
+                } else if (data.done) {
+                    currentJobId = null;
+                    if (data.status === 'cancelled') {
+                        addLog(`\n=== 任务已终止（${data.count} 条结果）===`, "warning");
+                    } else {
+                        addLog(`\n=== 任务完成（${data.count} 条结果）===`, "success");
+                    }
+                    const results = currentResults[data.pipeline] || [];
                     
                     // 根据pipeline类型显示结果
                     if (data.pipeline === 'consistency') {
-                        currentResults.consistency = data.results;
-                        displayResult('consistency', data.results);
+                        displayResult('consistency', results);
                         consistencyBtn.disabled = false;
                         consistencyBtn.innerHTML = '一致性检测';
                     } else {
-                        currentResults.grammar = data.results;
-                        displayResult('grammar', data.results);
+                        displayResult('grammar', results);
                         grammarBtn.disabled = false;
                         grammarBtn.innerHTML = '语法纠错';
                     }
                     
-                    console.log('处理结果:', data.results);
+                    console.log('处理结果:', results);
                 } else if (data.feedback_result) {
                     addLog(`\n=== 反馈已提交 ===\n${data.feedback_result}`, "success");
                     closeFeedbackModal();
@@ -315,10 +339,45 @@ function displayResult(pipelineType, results) {
     }
 }
 
+// 清空流式输出区域
+function clearStream(pipelineType) {
+    const resultElement = safeGetElementById(`${pipelineType}-result`);
+    if (resultElement) {
+        resultElement.innerHTML = '';
+    }
+}
+
+// 追加流式增量输出，按chunk序号分块显示
+function appendDelta(pipelineType, chunkIndex, delta) {
+    const resultElement = safeGetElementById(`${pipelineType}-result`);
+    if (!resultElement) {
+        return;
+    }
+    const itemId = `stream-${pipelineType}-${chunkIndex}`;
+    let item = document.getElementById(itemId);
+    if (!item) {
+        item = document.createElement('div');
+        item.id = itemId;
+        item.className = 'grammar-result-item';
+        const title = document.createElement('p');
+        title.innerHTML = `<strong>片段 ${chunkIndex + 1}（生成中）:</strong>`;
+        const body = document.createElement('p');
+        body.className = 'stream-text';
+        item.appendChild(title);
+        item.appendChild(body);
+        resultElement.appendChild(item);
+    }
+    item.querySelector('.stream-text').textContent += delta;
+    resultElement.scrollTop = resultElement.scrollHeight;
+}
+
 // 终止pipeline函数
 function stopPipeline() {
     console.log('终止pipeline函数被调用');
-    if (ws && isConnected) {
+    if (ws && isConnected && currentJobId) {
+        // 只取消当前任务，连接保留用于提交反馈
+        ws.send(JSON.stringify({action: 'cancel', job_id: currentJobId}));
+    } else if (ws && isConnected) {
         ws.close();
         addLog("已终止pipeline执行", "warning");
     }
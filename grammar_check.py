@@ -1,10 +1,10 @@
-from llm.model import get_grammar_check_chain
-from filereader.reader import extract_text_from_pdf, extract_text_from_docx, chunking
+from pipeline.engine import PipelineContext, run_sync
+from pipeline.stages import GRAMMAR_PIPELINE
+from pipeline.spill import dump_json
 
 import argparse
 import os
 import logging
-import json
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Consistency Check Model")
@@ -12,6 +12,9 @@ def parse_args():
     parser.add_argument("--base_url", type=str, default="https://dashscope.aliyuncs.com/compatible-mode/v1", help="Base URL")
     parser.add_argument("--docx_data", type=str, default="./dataset/test.docx", help="Docs Dataset path")
     #parser.add_argument("--pdf_data", type=str, default="./dataset/test.pdf", help="PDF Dataset path")
+    parser.add_argument("--prescreen_threshold", type=float, default=0.0, help="Only grammar chunks whose local pre-screen score reaches this value are sent to the LLM, 0 disables the pre-screen")
+    parser.add_argument("--prescreen_lm", type=str, default=None, help="Optional character bigram model for the pre-screen, built with prescreen.py --build_lm")
+    parser.add_argument("--grammar_output", type=str, default="full", choices=["full", "edits"], help="Grammar check output: the full corrected text, or only edit operations applied locally")
     parser.add_argument("--log_dir", type=str, default="./logs", help="Output path")
     args = parser.parse_args()
     return args
@@ -53,31 +56,17 @@ def check_grammar(args, **kwargs):
     '''
     logger = kwargs.get("logger")
 
-    # chain获取
-    grammar_check_chain = get_grammar_check_chain(args.model_name, args.base_url)
+    # 文档读取、chunking与逐chunk检查由pipeline完成
+    ctx = PipelineContext(args, logger=logger)
+    values = run_sync(GRAMMAR_PIPELINE.run(ctx, source={"path": args.docx_data}))
+    grammar_results = values["grammar_results"]
 
-    # 文档读取与chunking
-    logger.info(f"读取文档 {args.docx_data} ")
-    text = extract_text_from_docx(args.docx_data)
-    chunks = chunking(text, chunk_size=128)
-
-    # 对每个chunk进行语法检查
-    logger.info(f"开始对 {len(chunks)} 个chunk进行语法检查")
-    grammar_results = []
-    for chunk in chunks:
-        result = grammar_check_chain.invoke({"new_message": chunk}).content
-        result_dict = json.loads(result)
-        result_dict["original_text"] = chunk
-        grammar_results.append(result_dict)
-        logger.info(f"语法检查结果: {result_dict}")
-    
-    logger.info(f"语法检查完成，共检查 {len(chunks)} 个chunk")
     # 保存语法检查结果
     save_dir = os.path.join(args.log_dir, os.path.basename(args.docx_data).split(".")[0])
     os.makedirs(save_dir, exist_ok=True)
     logger.info(f"保存语法检查结果到 {save_dir}")
     with open(os.path.join(save_dir, "grammar_check_results.json"), "w", encoding="utf-8") as f:
-        json.dump(grammar_results, f, ensure_ascii=False, indent=4)
+        dump_json(grammar_results, f)
     return grammar_results
 
 if __name__ == "__main__":
@@ -0,0 +1,137 @@
+from langchain_core.callbacks import BaseCallbackHandler
+import asyncio
+import logging
+import time
+
+from monitor.metrics import LLM_DURATION, LLM_REQUESTS, LLM_IN_FLIGHT, LLM_RETRIES, current_stage, record_llm_usage
+from monitor.tracing import current_span, SPAN_KIND_CLIENT
+
+
+def get_token_usage(response):
+    """
+    从LLMResult中读取token用量，兼容流式与非流式调用。
+    :return: (prompt_tokens, completion_tokens)
+    """
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            usage = getattr(message, "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+
+
+def get_cached_tokens(response) -> int:
+    """读取prompt中命中前缀缓存的token数，模型服务未返回时为0"""
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            usage = getattr(message, "usage_metadata", None)
+            if usage:
+                return (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    return (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """记录每次LLM调用的耗时、token用量与并发数，存在活动trace时记录为子span"""
+    run_inline = True
+
+    def __init__(self, stage: str, model_name: str):
+        self.stage = stage
+        self.model_name = model_name
+        self._start_times = {}
+        self._spans = {}
+        self._watchers = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start_times[run_id] = time.perf_counter()
+        LLM_IN_FLIGHT.inc(stage=self.stage)
+        self._watch_cancellation(run_id)
+        parent = current_span.get()
+        if parent is not None:
+            self._spans[run_id] = parent.tracer.start_span(
+                f"llm.{self.stage}", parent, SPAN_KIND_CLIENT, {"llm.model": self.model_name}
+            )
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id, "ok")
+        prompt_tokens, completion_tokens = get_token_usage(response)
+        cached_tokens = get_cached_tokens(response)
+        record_llm_usage(self.stage, self.model_name, prompt_tokens, completion_tokens, cached_tokens)
+        llm_span = self._spans.pop(run_id, None)
+        if llm_span is not None:
+            llm_span.set_attribute("llm.prompt_tokens", prompt_tokens)
+            llm_span.set_attribute("llm.cached_prompt_tokens", cached_tokens)
+            llm_span.set_attribute("llm.completion_tokens", completion_tokens)
+            llm_span.end()
+            # token用量同时累加到所属阶段span
+            parent = current_span.get()
+            if parent is not None:
+                parent.add("llm.prompt_tokens", prompt_tokens)
+                parent.add("llm.cached_prompt_tokens", cached_tokens)
+                parent.add("llm.completion_tokens", completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, "cancelled" if isinstance(error, asyncio.CancelledError) else "error")
+        llm_span = self._spans.pop(run_id, None)
+        if llm_span is not None:
+            llm_span.end(error)
+
+    def _watch_cancellation(self, run_id):
+        """
+        ainvoke 被取消时LangChain不会回调on_llm_error，
+        在发起调用的任务结束时补记为cancelled，避免并发数指标泄漏
+        """
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            return
+        if task is None:
+            return
+        def on_done(_task, run_id=run_id):
+            self._watchers.pop(run_id, None)
+            # 流式调用的开始回调可能运行在LangChain内部的辅助任务中，该任务正常结束时调用仍在进行
+            if run_id in self._start_times and _task.cancelled():
+                self.on_llm_error(asyncio.CancelledError(), run_id=run_id)
+        task.add_done_callback(on_done)
+        self._watchers[run_id] = (task, on_done)
+
+    def _finish(self, run_id, status):
+        watcher = self._watchers.pop(run_id, None)
+        if watcher is not None:
+            watcher[0].remove_done_callback(watcher[1])
+        start = self._start_times.pop(run_id, None)
+        if start is None:
+            return
+        LLM_IN_FLIGHT.dec(stage=self.stage)
+        LLM_DURATION.observe(time.perf_counter() - start, stage=self.stage, model=self.model_name)
+        LLM_REQUESTS.inc(stage=self.stage, model=self.model_name, status=status)
+
+
+class _RetryCounter(logging.Filter):
+    """
+    openai客户端的内部重试只体现在INFO日志中，借此统计重试次数。
+    为收到这条记录需要把logger放开到INFO，其余记录仍按放开前的生效级别过滤，openai日志的输出保持不变
+    """
+    def __init__(self, logger):
+        super().__init__()
+        self.logger = logger
+        self.original_level = logger.level
+
+    def filter(self, record):
+        if str(record.msg).startswith("Retrying request"):
+            LLM_RETRIES.inc(stage=current_stage.get())
+            parent = current_span.get()
+            if parent is not None:
+                parent.add("llm.retries", 1)
+        # 原本未单独设置级别时，跟随父logger当前的生效级别
+        threshold = self.original_level or self.logger.parent.getEffectiveLevel()
+        return record.levelno >= threshold
+
+
+_openai_logger = logging.getLogger("openai._base_client")
+_openai_logger.addFilter(_RetryCounter(_openai_logger))
+if not _openai_logger.level or _openai_logger.level > logging.INFO:
+    _openai_logger.setLevel(logging.INFO)
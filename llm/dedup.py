@@ -0,0 +1,110 @@
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import logging
+import re
+
+from monitor.metrics import CACHE_HITS, CACHE_MISSES
+
+logger = logging.getLogger(__name__)
+
+# 句子切分：保留句末标点
+SENTENCE_PATTERN = re.compile(r"[^。！？!?；;\n]+[。！？!?；;]*")
+
+
+def normalize(text: str) -> str:
+    """去掉首尾空白、合并连续空白、统一全角空格，作为去重key"""
+    return re.sub(r"\s+", " ", text.replace("　", " ")).strip()
+
+
+def split_sentences(text: str):
+    return [s for s in (normalize(m) for m in SENTENCE_PATTERN.findall(text)) if s]
+
+
+def context_key(*parts) -> str:
+    """模型名、冲突结果等影响输出的上下文，计算为namespace的一部分"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class DedupCache:
+    """
+    进程内的LLM结果去重：相同namespace下相同的文本只调用一次。
+    已完成的结果按LRU保存；仍在进行中的相同请求（同一任务或并发任务）等待同一个future。
+    :param max_entries: 最多保存的结果数，0表示关闭去重
+    """
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._inflight = {}
+
+    def _get(self, key):
+        if key not in self._results:
+            return None
+        self._results.move_to_end(key)
+        return self._results[key]
+
+    def _put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self._results[key] = value
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    def get(self, namespace: str, text: str):
+        """按规范化后的文本读取，用于与原文位置无关的结果（如句子是否正确）"""
+        return self._get((namespace, normalize(text)))
+
+    def put(self, namespace: str, text: str, value):
+        self._put((namespace, normalize(text)), value)
+
+    async def run(self, namespace: str, text: str, call):
+        """
+        获取text的结果，没有缓存时执行 call()。
+        结果中包含原文内容与位置（修正文本、编辑偏移），因此按原文精确匹配，仅空白不同的文本不复用
+        :param call: 无参数的协程函数，返回可缓存的结果
+        :return: (结果, 是否复用了其他调用的结果)
+        """
+        if self.max_entries <= 0:
+            return await call(), False
+        cache = namespace.split(":")[0]
+        key = (namespace, text)
+        loop = asyncio.get_running_loop()
+        while True:
+            value = self._get(key)
+            if value is not None:
+                CACHE_HITS.inc(cache=cache)
+                return value, True
+            future = self._inflight.get(key)
+            if future is None or future.get_loop() is not loop:
+                break
+            # 合并到进行中的相同请求；对方失败或被取消时由本请求重新调用
+            await asyncio.wait([future])
+            if not future.cancelled():
+                CACHE_HITS.inc(cache=cache)
+                return future.result(), True
+
+        CACHE_MISSES.inc(cache=cache)
+        future = loop.create_future()
+        self._inflight[key] = future
+        try:
+            value = await call()
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        self._put(key, value)
+        future.set_result(value)
+        return value, False
+
+
+DEDUP = DedupCache()
+
+
+def configure_dedup(max_entries: int):
+    """设置去重缓存大小，0表示关闭，已缓存的结果会被清空"""
+    DEDUP.max_entries = max_entries
+    DEDUP._results.clear()
@@ -0,0 +1,113 @@
+import json
+import logging
+
+from monitor.metrics import GRAMMAR_EDITS
+from .model import astream_content
+
+logger = logging.getLogger(__name__)
+
+
+class EditError(ValueError):
+    """编辑操作无法在原文上应用"""
+
+
+def _locate(text: str, original: str, start) -> int:
+    """
+    找到编辑片段在原文中的位置：模型给出的 start 处正好是该片段时直接使用，
+    否则取原文中离 start 最近的一处出现（模型给出的偏移量经常有少量偏差）
+    """
+    if isinstance(start, int) and 0 <= start <= len(text) and text[start:start + len(original)] == original:
+        return start
+    if not original:
+        raise EditError("插入操作缺少有效的start")
+    positions = []
+    pos = text.find(original)
+    while pos != -1:
+        positions.append(pos)
+        pos = text.find(original, pos + 1)
+    if not positions:
+        raise EditError(f"原文中不存在片段: {original}")
+    if not isinstance(start, int):
+        if len(positions) > 1:
+            raise EditError(f"片段在原文中出现多次且没有start: {original}")
+        return positions[0]
+    return min(positions, key=lambda p: abs(p - start))
+
+
+def apply_edits(text: str, edits):
+    """
+    在原文上应用编辑操作
+    :param text: 原文
+    :param edits: [{"start": 偏移量, "original": 原片段, "replacement": 替换内容, "type": 错误类型, "reason": 原因}]
+    :return: (修正后的文本, 带有确定位置 start/end 的编辑操作列表)
+    """
+    if not isinstance(edits, list):
+        raise EditError("edits不是列表")
+    located = []
+    for edit in edits:
+        if not isinstance(edit, dict) or not isinstance(edit.get("original"), str) or not isinstance(edit.get("replacement"), str):
+            raise EditError(f"编辑操作格式错误: {edit}")
+        if edit["original"] == edit["replacement"]:
+            continue
+        start = _locate(text, edit["original"], edit.get("start"))
+        located.append({**edit, "start": start, "end": start + len(edit["original"])})
+    located.sort(key=lambda e: (e["start"], e["end"]))
+    for prev, cur in zip(located, located[1:]):
+        if cur["start"] < prev["end"]:
+            raise EditError(f"编辑操作重叠: {prev['original']} / {cur['original']}")
+    pieces, pos = [], 0
+    for edit in located:
+        pieces.append(text[pos:edit["start"]])
+        pieces.append(edit["replacement"])
+        pos = edit["end"]
+    pieces.append(text[pos:])
+    return "".join(pieces), located
+
+
+def edits_to_result(text: str, output: str) -> dict:
+    """
+    将编辑操作格式的模型输出还原为与完整输出格式相同的结果
+    :param text: 原文
+    :param output: 模型输出 {"correct": bool, "edits": [...]}
+    :return: {"correct", "content", "reason", "edits"}
+    """
+    try:
+        data = json.loads(output)
+    except ValueError as e:
+        raise EditError(f"输出不是JSON: {e}")
+    if not isinstance(data, dict):
+        raise EditError("输出不是JSON对象")
+    content, edits = apply_edits(text, data.get("edits") or [])
+    if data.get("correct") is False and not edits:
+        raise EditError("判定有错但没有编辑操作")
+    reason = "；".join(
+        f"{e.get('type') or '错误'}：{e['original']}→{e['replacement']}" + (f"（{e['reason']}）" if e.get("reason") else "")
+        for e in edits
+    )
+    return {"correct": not edits, "content": content, "reason": reason, "edits": edits}
+
+
+async def acheck_grammar_edits(edit_chain, text: str, on_delta=None, fallback_chain=None) -> str:
+    """
+    以编辑操作格式检查语法，在本地应用并校验编辑操作，返回完整输出格式的JSON文本。
+    编辑操作无法应用时，改用 fallback_chain（完整输出格式）重新检查
+    :param edit_chain: 编辑操作格式的语法检查链
+    :param text: 待检查文本
+    :param on_delta: 流式增量回调。编辑操作不是前端展示的格式，应用后作为一次完整的增量发送；
+                     改用完整输出时，完整输出照常流式发送
+    :param fallback_chain: 完整输出格式的语法检查链，为None时直接抛出EditError
+    """
+    output = await astream_content(edit_chain, {"new_message": text})
+    try:
+        result = edits_to_result(text, output)
+    except EditError as e:
+        GRAMMAR_EDITS.inc(result="fallback")
+        if fallback_chain is None:
+            raise
+        logger.warning(f"编辑操作无法应用，改用完整输出重新检查: {e}")
+        return await astream_content(fallback_chain, {"new_message": text}, on_delta)
+    GRAMMAR_EDITS.inc(result="applied" if result["edits"] else "unchanged")
+    output = json.dumps(result, ensure_ascii=False)
+    if on_delta:
+        await on_delta(output)
+    return output
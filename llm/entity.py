@@ -3,6 +3,9 @@ from typing import Dict, Any, List, Optional
 import json
 import uuid
 import logging
+
+from .scheduler import llm_slot
+
 logger = logging.getLogger(__name__)
 
 
@@ -30,13 +33,21 @@ class UIEntity(BaseModel):
         description="实体间关系，例如：{'关系':'隶属于', '目标实体':'某集团'}"
     )
 
+    # 跨分片合并时由系统填写，attributes 中保留首次出现的取值
+    alternatives: Dict[str, List[Any]] = Field(
+        default_factory=dict,
+        description="同一属性在文档不同部分的全部不同取值，只记录取值不一致的属性。例如：{'产地':['泰国', '越南']}"
+    )
+
 # 实体储存与检索
 class EntityStore:
     def __init__(self):
         self.entities = {}  # entity_id -> UIEntity
         self.name_index = {}  # name -> entity_id
+        self.occurrences = {}  # entity_id -> 抽取出该实体的chunk序号集合
+        self.shards = {}  # entity_id -> 出现该实体的分片序号集合，分片模式下由absorb记录
 
-    def add_entity(self, entity: UIEntity):
+    def add_entity(self, entity: UIEntity, chunk_index: Optional[int] = None):
         if entity.name not in self.name_index:
             # 新实体
             self.entities[entity.entity_id] = entity
@@ -47,6 +58,8 @@ class EntityStore:
             old_ent = self.entities[old_id]
             merged = self.merge(old_ent, entity)
             self.entities[old_id] = merged
+        if chunk_index is not None:
+            self.occurrences.setdefault(self.name_index[entity.name], set()).add(chunk_index)
 
     def merge(self, old: UIEntity, new: UIEntity) -> UIEntity:
         # 更新属性
@@ -65,20 +78,66 @@ class EntityStore:
 
         return old
 
+    def absorb(self, other: "EntityStore", shard_index: Optional[int] = None):
+        """
+        将一个分片的EntityStore合并进来，同名实体合并为一个。
+        与分片内的merge不同，不同分片中同一属性的取值不一致时，attributes保留先出现的取值，
+        全部不同取值记录在alternatives中，供跨分片一致性检查发现冲突。
+        :param other: 分片的实体存储，chunk序号应为全文中的序号
+        :param shard_index: 分片序号
+        """
+        for entity_id, entity in other.entities.items():
+            if entity.name not in self.name_index:
+                self.entities[entity_id] = entity
+                self.name_index[entity.name] = entity_id
+            else:
+                old = self.entities[self.name_index[entity.name]]
+                attributes = {**entity.attributes, **old.attributes}
+                for k, v in entity.attributes.items():
+                    for value in entity.alternatives.get(k) or [v]:
+                        if value != attributes[k]:
+                            values = old.alternatives.setdefault(k, [attributes[k]])
+                            if value not in values:
+                                values.append(value)
+                self.merge(old, entity)
+                old.attributes = attributes
+            merged_id = self.name_index[entity.name]
+            self.occurrences.setdefault(merged_id, set()).update(other.occurrences.get(entity_id, ()))
+            if shard_index is not None:
+                self.shards.setdefault(merged_id, set()).add(shard_index)
+
+    def cross_shard_ids(self):
+        """出现在多个分片中的实体ID"""
+        return {entity_id for entity_id, shards in self.shards.items() if len(shards) > 1}
+
     def all_entities(self):
         return list(self.entities.values())
 
+    def route_conflicts(self, chunks: List[str], consistency_results: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        将有冲突的检查结果分配到相关的chunk：抽取出该实体的chunk，以及原文中提到实体名称的chunk。
+        :param chunks: 文本chunk列表
+        :param consistency_results: 一致性检查结果
+        :return: 每个chunk相关的冲突结果列表
+        """
+        per_chunk = [[] for _ in chunks]
+        for res in consistency_results:
+            if res.get("has_conflict") is not True:
+                continue
+            name = res.get("entity_name", "")
+            entity_id = res.get("entity_id") or self.name_index.get(name)
+            if entity_id in self.entities:
+                name = self.entities[entity_id].name
+            indices = set(self.occurrences.get(entity_id, ()))
+            if name:
+                indices.update(i for i, chunk in enumerate(chunks) if name in chunk)
+            conflict = {k: v for k, v in res.items() if k != "entity_id"}
+            for i in sorted(indices):
+                per_chunk[i].append(conflict)
+        return per_chunk
 
-def extract_entities(chain, text: str) -> List[UIEntity]:
-    """
-    从文本中提取实体。
-    :param chain: 实体提取链
-    :param text: 输入的文本
-    :return: 提取到的实体列表
-    """
-    result = chain.invoke({"new_message": text},
-                          config={"session_id": "lzh"}
-                          ).content
+
+def _parse_entities(result: str) -> List[UIEntity]:
     try:
         raw_entities = json.loads(result)
         #logger.info(f"原始实体提取结果: {raw_entities}")
@@ -87,9 +146,32 @@ def extract_entities(chain, text: str) -> List[UIEntity]:
         entities = [UIEntity(entity_id=str(uuid.uuid4()), **entity) for entity in raw_entities]
     except Exception as e:
         logger.error(f"实体提取失败: {e}")
-        logger.debug("llm_response:", result)
+        logger.debug(f"llm_response: {result}")
         entities = []
-    return entities 
+    return entities
+
+def extract_entities(chain, text: str, session_id: str = "lzh") -> List[UIEntity]:
+    """
+    从文本中提取实体。
+    :param chain: 实体提取链
+    :param text: 输入的文本
+    :param session_id: 对话记忆的会话ID，不同文档应使用不同ID
+    :return: 提取到的实体列表
+    """
+    result = chain.invoke({"new_message": text},
+                          config={"session_id": session_id}
+                          ).content
+    return _parse_entities(result)
+
+async def aextract_entities(chain, text: str, session_id: str = "lzh") -> List[UIEntity]:
+    """
+    extract_entities 的异步版本，不阻塞事件循环。
+    """
+    async with llm_slot():
+        result = (await chain.ainvoke({"new_message": text},
+                                      config={"session_id": session_id}
+                                      )).content
+    return _parse_entities(result)
 
 def check_entity_consistency(chain, entity: UIEntity) -> Dict[str, Any]:
     """
@@ -116,4 +198,25 @@ def summarize_entity_memory(chain, chunk: str) -> str:
     :return: 总结文本
     """
     result = chain.invoke({"new_message": chunk}).content
-    return result
\ No newline at end of file
+    return result
+
+async def acheck_entity_consistency(chain, entity: UIEntity) -> Dict[str, Any]:
+    """
+    check_entity_consistency 的异步版本。
+    """
+    try:
+        input = entity.model_dump_json()
+    except Exception as e:
+        logger.error(f"实体序列化失败: {e}")
+        return {}
+    async with llm_slot():
+        result = (await chain.ainvoke({"new_message": input})).content
+    return json.loads(result)
+
+async def asummarize_entity_memory(chain, chunk: str) -> str:
+    """
+    summarize_entity_memory 的异步版本。
+    """
+    async with llm_slot():
+        result = (await chain.ainvoke({"new_message": chunk})).content
+    return result
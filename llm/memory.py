@@ -3,14 +3,21 @@ from langchain_core.chat_history import BaseChatMessageHistory
 
 # 最简单的内存实现（内存版）
 class SimpleMemory(BaseChatMessageHistory):
-    def __init__(self, max_messages=5):
+    def __init__(self, max_messages=8):
         self.messages = []
         self.max_messages = max_messages
 
     def add_message(self, message):
-        self.messages.append(message)
-        # 超过限制时触发 memory 压缩
-        self.messages = self.messages[-self.max_messages:]
+        self.add_messages([message])
+
+    def add_messages(self, messages):
+        self.messages.extend(messages)
+        # 超过限制时整段压缩，只保留最近的 max_messages-2 条（成对保留，从用户消息开始）。
+        # 两次压缩之间历史只在末尾追加，请求前缀保持不变，可以命中模型服务的前缀缓存；
+        # 历史窗口在 max_messages-2 与 max_messages 条之间，默认不少于逐条滑动时的5条
+        if len(self.messages) > self.max_messages:
+            keep = max(0, (self.max_messages - 2) // 2 * 2)
+            self.messages = self.messages[-keep:] if keep else []
 
     def clear(self):
         self.messages = []
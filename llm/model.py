@@ -1,49 +1,131 @@
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnableWithMessageHistory
+# langchain / openai 的导入耗时较长，只在第一次构建chain时导入，CLI与服务启动无需等待
+import logging
 import os
-from dotenv import load_dotenv
+import time
 
-load_dotenv()
+from .prompt import GRAMMAR_CHECK_PROMPT, GRAMMAR_EDIT_PROMPT, ENTITY_EXTRACT_PROMPT, ENTITY_CONSISTENCY_CHECK_PROMPT, MEMORY_SUMMARY_PROMPT, CONSISTENCY_CORRECT_PROMPT, CONSISTENCY_SPAN_PROMPT, FEEDBACK_SUMMARY_PROMPT
+from .replay import http_client_kwargs, replay_mode
+from .pool import pool_client_kwargs, pool_transport
+from .routing import get_route, validate_output, LowConfidenceOutput
+from .scheduler import llm_slot
 
-from .prompt import GRAMMAR_CHECK_PROMPT, ENTITY_EXTRACT_PROMPT, ENTITY_CONSISTENCY_CHECK_PROMPT, MEMORY_SUMMARY_PROMPT, CONSISTENCY_CORRECT_PROMPT, FEEDBACK_SUMMARY_PROMPT
-from .memory import SimpleMemory
+_env_loaded = False
+
+def load_env():
+    """从 .env 读取 OPENAI_API_KEY 等环境变量，只读取一次"""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
 
 memory_store = {}
+# 全局共享的限流器，所有chain共用同一个请求速率上限
+rate_limiter = None
 
-def get_memory(session_id: str) -> SimpleMemory:
+def get_memory(session_id: str):
     if session_id not in memory_store:
+        from .memory import SimpleMemory
         memory_store[session_id] = SimpleMemory()
     return memory_store[session_id]
 
+def release_memory(session_id: str):
+    memory_store.pop(session_id, None)
+
+def set_rate_limit(requests_per_second: float):
+    """
+    设置所有chain共享的LLM请求速率上限，<=0 表示不限速。
+    只对之后创建的chain生效。
+    """
+    global rate_limiter
+    if requests_per_second <= 0:
+        rate_limiter = None
+        return
+    from langchain_core.rate_limiters import InMemoryRateLimiter
+    rate_limiter = InMemoryRateLimiter(
+        requests_per_second=requests_per_second,
+        check_every_n_seconds=0.05,
+        max_bucket_size=max(1, requests_per_second),
+    )
+
+def get_chat_model(stage: str, model_name: str, base_url: str, max_tokens: int = 1024, temperature: float = 0.7):
+    """
+    构建带指标统计的ChatOpenAI模型，开启录制/回放时使用对应的http客户端，
+    配置了 --endpoints 且base_url为 --base_url 时请求由连接池分配到各端点（录制模式下录制连接池发出的请求）。
+    :param stage: chain所属阶段，用于指标标签
+    """
+    from langchain_openai import ChatOpenAI
+    from .callbacks import LLMMetricsCallback
+    load_env()
+    transport = pool_transport(base_url)
+    return ChatOpenAI(
+        model_name=model_name,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        base_url=base_url,
+        api_key=os.getenv("OPENAI_API_KEY"),
+        stream_usage=True,
+        callbacks=[LLMMetricsCallback(stage, model_name)],
+        rate_limiter=rate_limiter,
+        **(http_client_kwargs(transport) or pool_client_kwargs(base_url)),
+    )
+
+def get_stage_model(stage: str, model_name: str, base_url: str, max_tokens: int = 1024):
+    """
+    按 --model_routes 为阶段构建模型，未配置的字段使用传入的默认值。
+    配置了升级模型时，先调用该阶段的模型，输出被截断、无法解析或置信度低时改由升级模型重新生成
+    （校验需要完整输出，因此该阶段的流式增量在校验通过后一次性发送）。
+    """
+    route = get_route(stage)
+    temperature = route.temperature if route.temperature is not None else 0.7
+    model = get_chat_model(stage, route.model or model_name, route.base_url or base_url,
+                           route.max_tokens or max_tokens, temperature)
+    escalate = route.escalate_to
+    if escalate is None:
+        return model
+    from langchain_core.runnables import RunnableLambda
+
+    async def avalidate(message):
+        return validate_output(stage, message)
+
+    escalation_model = get_chat_model(
+        stage, escalate.model or model_name, escalate.base_url or base_url, escalate.max_tokens or max_tokens,
+        escalate.temperature if escalate.temperature is not None else temperature,
+    )
+    checked = model | RunnableLambda(lambda message: validate_output(stage, message), afunc=avalidate)
+    return checked.with_fallbacks([escalation_model], exceptions_to_handle=(LowConfidenceOutput,))
+
 def get_grammar_check_chain(model_name: str ="gpt-4o-mini-2024-07-18", base_url: str ="https://free.v36.cm/v1"):
+    from langchain_core.prompts import ChatPromptTemplate
     grammar_check_prompt = ChatPromptTemplate.from_messages([
         ("system", GRAMMAR_CHECK_PROMPT),
         ("human", "{new_message}"),
     ])
-    grammar_check_model = ChatOpenAI(
-        model_name=model_name,
-        temperature=0.7,
-        max_tokens=1024,
-        base_url=base_url,
-        api_key=os.getenv("OPENAI_API_KEY"),
-    )
+    grammar_check_model = get_stage_model("grammar_check", model_name, base_url)
     grammar_check_chain = grammar_check_prompt | grammar_check_model
     return grammar_check_chain
 
+def get_grammar_edit_chain(model_name: str ="gpt-4o-mini-2024-07-18", base_url: str ="https://free.v36.cm/v1"):
+    """只输出编辑操作的语法检查链，输出格式见 llm/edits.py"""
+    from langchain_core.prompts import ChatPromptTemplate
+    grammar_edit_prompt = ChatPromptTemplate.from_messages([
+        ("system", GRAMMAR_EDIT_PROMPT),
+        ("human", "{new_message}"),
+    ])
+    grammar_edit_model = get_stage_model("grammar_check", model_name, base_url)
+    grammar_edit_chain = grammar_edit_prompt | grammar_edit_model
+    return grammar_edit_chain
+
 def get_grammar_check_chain_with_memory(model_name: str ="gpt-4o-mini-2024-07-18", base_url: str ="https://free.v36.cm/v1"):
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_core.runnables import RunnableWithMessageHistory
     grammar_check_prompt_with_memory = ChatPromptTemplate.from_messages([
+        # 静态system prompt在最前，历史对话以消息形式紧随其后、只在末尾追加，保持请求前缀稳定
         ("system", GRAMMAR_CHECK_PROMPT),
-        ("system", "当前对话历史：\n{history}"),
+        MessagesPlaceholder("history"),
         ("human", "{new_message}"),
     ])
-    grammar_check_model = ChatOpenAI(
-        model_name=model_name,
-        temperature=0.7,
-        max_tokens=1024,
-        base_url=base_url,
-        api_key=os.getenv("OPENAI_API_KEY"),
-    )
+    grammar_check_model = get_stage_model("grammar_check", model_name, base_url)
     grammar_check_with_memory = RunnableWithMessageHistory(
         grammar_check_prompt_with_memory | grammar_check_model,
         get_memory,
@@ -53,18 +135,15 @@ def get_grammar_check_chain_with_memory(model_name: str ="gpt-4o-mini-2024-07-18
     return grammar_check_with_memory
 
 def get_entity_extract_chain(model_name: str ="gpt-4o-mini-2024-07-18", base_url: str ="https://free.v36.cm/v1"):
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_core.runnables import RunnableWithMessageHistory
     entity_extract_prompt = ChatPromptTemplate.from_messages([
+        # 静态system prompt在最前，历史对话以消息形式紧随其后、只在末尾追加，保持请求前缀稳定
         ("system", ENTITY_EXTRACT_PROMPT),
-        ("system", "当前对话历史:\n{history}"),
+        MessagesPlaceholder("history"),
         ("human", "{new_message}"),
     ])
-    entity_extract_model = ChatOpenAI(
-        model_name=model_name,
-        temperature=0.7,
-        max_tokens=1024,
-        base_url=base_url,
-        api_key=os.getenv("OPENAI_API_KEY"),
-    )
+    entity_extract_model = get_stage_model("entity_extract", model_name, base_url)
 
     entity_extract_chain = RunnableWithMessageHistory(
         entity_extract_prompt | entity_extract_model,
@@ -75,63 +154,95 @@ def get_entity_extract_chain(model_name: str ="gpt-4o-mini-2024-07-18", base_url
     return entity_extract_chain
 
 def get_entity_consistency_check_chain(model_name: str ="gpt-4o-mini-2024-07-18", base_url: str ="https://free.v36.cm/v1"):
+    from langchain_core.prompts import ChatPromptTemplate
     entity_consistency_check_prompt = ChatPromptTemplate.from_messages([
         ("system", ENTITY_CONSISTENCY_CHECK_PROMPT),
         ("human", "{new_message}"),
     ])
-    entity_consistency_check_model = ChatOpenAI(
-        model_name=model_name,
-        temperature=0.7,
-        max_tokens=1024,
-        base_url=base_url,
-        api_key=os.getenv("OPENAI_API_KEY"),
-    )
+    entity_consistency_check_model = get_stage_model("consistency_check", model_name, base_url)
     entity_consistency_check_chain = entity_consistency_check_prompt | entity_consistency_check_model
     return entity_consistency_check_chain
 
 def get_memory_summary_chain(model_name: str ="gpt-4o-mini-2024-07-18", base_url: str ="https://free.v36.cm/v1"):
+    from langchain_core.prompts import ChatPromptTemplate
     memory_summary_prompt = ChatPromptTemplate.from_messages([
         ("system", MEMORY_SUMMARY_PROMPT),
         ("human", "{new_message}"),
     ])
-    memory_summary_model = ChatOpenAI(
-        model_name=model_name,
-        temperature=0.7,
-        max_tokens=1024,
-        base_url=base_url,
-        api_key=os.getenv("OPENAI_API_KEY"),
-    )
+    memory_summary_model = get_stage_model("memory_summary", model_name, base_url)
     memory_summary_chain = memory_summary_prompt | memory_summary_model
     return memory_summary_chain
 
 def get_consistency_correct_chain(model_name: str ="gpt-4o-mini-2024-07-18", base_url: str ="https://free.v36.cm/v1"):
+    from langchain_core.prompts import ChatPromptTemplate
     consistency_correct_prompt = ChatPromptTemplate.from_messages([
         ("system", CONSISTENCY_CORRECT_PROMPT),
         ("human", "{new_message}"),
     ])
-    consistency_correct_model = ChatOpenAI(
-        model_name=model_name,
-        temperature=0.7,
-        max_tokens=1024,
-        base_url=base_url,
-        api_key=os.getenv("OPENAI_API_KEY"),
-    )
+    consistency_correct_model = get_stage_model("consistency_correct", model_name, base_url)
     consistency_correct_chain = consistency_correct_prompt | consistency_correct_model
     return consistency_correct_chain
 
+def get_consistency_span_chain(model_name: str ="gpt-4o-mini-2024-07-18", base_url: str ="https://free.v36.cm/v1"):
+    """只输出需要标记的原文片段的一致性修正链，输出格式见 llm/spans.py"""
+    from langchain_core.prompts import ChatPromptTemplate
+    consistency_span_prompt = ChatPromptTemplate.from_messages([
+        ("system", CONSISTENCY_SPAN_PROMPT),
+        ("human", "{new_message}"),
+    ])
+    consistency_span_model = get_stage_model("consistency_correct", model_name, base_url)
+    consistency_span_chain = consistency_span_prompt | consistency_span_model
+    return consistency_span_chain
+
 # 在文件末尾添加以下内容
 def get_feedback_summary_chain(model_name: str ="gpt-4o-mini-2024-07-18", base_url: str ="https://free.v36.cm/v1"):
-    
+    from langchain_core.prompts import ChatPromptTemplate
     feedback_summary_prompt = ChatPromptTemplate.from_messages([
         ("system", FEEDBACK_SUMMARY_PROMPT),
-        ("human", "语法检查结果：{grammar_results}\n用户反馈：{user_feedback}"),
+        ("human", "{result_type}：{results}\n用户反馈：{user_feedback}"),
     ])
-    feedback_summary_model = ChatOpenAI(
-        model_name=model_name,
-        temperature=0.7,
-        max_tokens=512,
-        base_url=base_url,
-        api_key=os.getenv("OPENAI_API_KEY"),
-    )
+    feedback_summary_model = get_stage_model("feedback_summary", model_name, base_url, max_tokens=512)
     feedback_summary_chain = feedback_summary_prompt | feedback_summary_model
-    return feedback_summary_chain
\ No newline at end of file
+    return feedback_summary_chain
+
+async def astream_content(chain, inputs, on_delta=None, config=None) -> str:
+    """
+    以流式方式调用chain，逐个token回调增量内容，返回完整输出。
+    调用前在调度器中排队，占用一个LLM调用槽位直到输出结束。
+    :param chain: 待调用的chain
+    :param inputs: chain输入
+    :param on_delta: 异步回调，参数为本次增量文本
+    :param config: chain调用配置
+    :return: 完整输出文本
+    """
+    content = ""
+    async with llm_slot():
+        async for piece in chain.astream(inputs, config=config):
+            delta = piece.content
+            if not delta:
+                continue
+            content += delta
+            if on_delta is not None:
+                await on_delta(delta)
+    return content
+
+async def warmup(model_name: str, base_url: str, logger=None):
+    """
+    服务启动时预热：导入langchain/openai并构建各chain，
+    再向模型服务发起一次轻量请求，让第一个检测请求复用已建立的连接。
+    """
+    logger = logger or logging.getLogger(__name__)
+    start = time.perf_counter()
+    for build in (get_grammar_check_chain, get_grammar_edit_chain, get_entity_extract_chain, get_entity_consistency_check_chain,
+                  get_memory_summary_chain, get_consistency_correct_chain, get_consistency_span_chain, get_feedback_summary_chain):
+        build(model_name, base_url)
+    logger.info(f"chain预热完成，耗时 {time.perf_counter() - start:.2f}s")
+    if replay_mode() == "replay":
+        return
+    start = time.perf_counter()
+    try:
+        # 共用langchain的默认连接池，建立的连接在之后的请求中复用
+        await get_chat_model("warmup", model_name, base_url).root_async_client.models.list()
+        logger.info(f"模型服务连接预热完成，耗时 {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        logger.warning(f"模型服务连接预热失败: {e}")
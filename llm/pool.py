@@ -0,0 +1,228 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+from monitor.metrics import LLM_ENDPOINT_REQUESTS, LLM_ENDPOINT_OUTSTANDING, LLM_ENDPOINT_CIRCUIT
+
+logger = logging.getLogger(__name__)
+
+# 熔断器状态，与指标 textguard_llm_endpoint_circuit 的取值一致
+CLOSED = 0
+OPEN = 1
+HALF_OPEN = 2
+
+
+class Endpoint:
+    """
+    连接池中的一个模型服务地址与key
+    :param weight: 权重，按 未完成请求数/权重 最小的端点分配请求
+    :param rate_limit: 该端点每秒请求数上限，<=0 表示不限速
+    """
+    def __init__(self, base_url: str, api_key: str, weight: float = 1.0, rate_limit: float = 0.0, name: str | None = None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.weight = weight if weight > 0 else 1.0
+        self.rate_limit = rate_limit
+        self.name = name or urlsplit(self.base_url).netloc
+        self.outstanding = 0
+        self.failures = 0  # 连续失败次数
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self._tokens = max(1.0, rate_limit)
+        self._refilled = time.monotonic()
+
+    @classmethod
+    def from_dict(cls, data: dict, index: int):
+        api_key = data.get("api_key")
+        if api_key is None and data.get("api_key_env"):
+            api_key = os.getenv(data["api_key_env"])
+        if not data.get("base_url") or not api_key:
+            raise ValueError(f"第 {index + 1} 个端点缺少base_url或api_key/api_key_env")
+        return cls(data["base_url"], api_key, float(data.get("weight", 1.0)), float(data.get("rate_limit", 0.0)), data.get("name"))
+
+    def rate_delay(self, now: float) -> float:
+        """距离下一个可用请求配额的秒数，0表示可以立即发送"""
+        if self.rate_limit <= 0:
+            return 0.0
+        self._tokens = min(max(1.0, self.rate_limit), self._tokens + (now - self._refilled) * self.rate_limit)
+        self._refilled = now
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate_limit
+
+    def take(self):
+        if self.rate_limit > 0:
+            self._tokens -= 1
+        self.outstanding += 1
+        LLM_ENDPOINT_OUTSTANDING.inc(endpoint=self.name)
+
+    def _set_state(self, state: int):
+        self.state = state
+        LLM_ENDPOINT_CIRCUIT.set(state, endpoint=self.name)
+
+
+class EndpointPool:
+    """
+    多个模型服务端点/key组成的连接池：请求分配给 未完成请求数/权重 最小的健康端点，
+    按响应被动检查健康状况，连续失败达到阈值时熔断该端点，失败的请求立即改发到其他端点
+    :param default_base_url: 发往该地址的请求由连接池分配，单独配置了base_url的阶段不经过连接池
+    :param failure_threshold: 连续失败多少次后熔断
+    :param cooldown: 熔断后多少秒放行一个试探请求，成功则恢复
+    """
+    def __init__(self, endpoints, default_base_url: str, failure_threshold: int = 3, cooldown: float = 30.0):
+        self.endpoints = endpoints
+        self.default_base_url = (default_base_url or "").rstrip("/")
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._sync = None
+        self._async = None
+        # 所有使用连接池的客户端共用，首次使用时创建；客户端按base_url缓存
+        self._transport = None
+        self.clients = {}
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            from .transports import PoolTransport
+            self._transport = PoolTransport(self)
+        return self._transport
+
+    def sync_transport(self):
+        # 所有客户端共用底层连接
+        if self._sync is None:
+            import httpx
+            self._sync = httpx.HTTPTransport()
+        return self._sync
+
+    def async_transport(self):
+        if self._async is None:
+            import httpx
+            self._async = httpx.AsyncHTTPTransport()
+        return self._async
+
+    def _available(self, endpoint: Endpoint, now: float) -> bool:
+        if endpoint.state == CLOSED:
+            return True
+        if endpoint.state == OPEN and now - endpoint.opened_at >= self.cooldown:
+            endpoint._set_state(HALF_OPEN)
+        # 半开状态同一时间只放行一个试探请求
+        return endpoint.state == HALF_OPEN and not endpoint.probing
+
+    def acquire(self, exclude=()):
+        """
+        选择一个端点并占用：返回 (端点, 0)；所选端点都在限速时返回 (None, 需要等待的秒数)；
+        除exclude外没有端点时返回 (None, None)
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [e for e in self.endpoints if e not in exclude]
+            if not candidates:
+                return None, None
+            healthy = [e for e in candidates if self._available(e, now)]
+            if not healthy:
+                # 全部熔断时不直接失败，试探最早熔断的端点
+                healthy = [min(candidates, key=lambda e: e.opened_at)]
+            delays = [e.rate_delay(now) for e in healthy]
+            ready = [e for e, delay in zip(healthy, delays) if delay == 0]
+            if not ready:
+                return None, min(delays)
+            endpoint = min(ready, key=lambda e: (e.outstanding + 1) / e.weight)
+            if endpoint.state != CLOSED:
+                endpoint.probing = True
+            endpoint.take()
+            return endpoint, 0
+
+    def release(self, endpoint: Endpoint, ok: bool | None, status: str):
+        """
+        请求结束（流式响应读取完毕）后调用，更新未完成请求数与熔断状态
+        :param ok: 请求是否成功，None表示请求被取消，不影响熔断状态
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            LLM_ENDPOINT_OUTSTANDING.dec(endpoint=endpoint.name)
+            LLM_ENDPOINT_REQUESTS.inc(endpoint=endpoint.name, status=status)
+            endpoint.probing = False
+            if ok is None:
+                return
+            if ok:
+                endpoint.failures = 0
+                if endpoint.state != CLOSED:
+                    logger.info(f"端点 {endpoint.name} 已恢复")
+                    endpoint._set_state(CLOSED)
+                return
+            endpoint.failures += 1
+            if endpoint.state == HALF_OPEN or (endpoint.state == CLOSED and endpoint.failures >= self.failure_threshold):
+                logger.warning(f"端点 {endpoint.name} 连续失败 {endpoint.failures} 次，熔断 {self.cooldown}s")
+                endpoint.opened_at = time.monotonic()
+                endpoint._set_state(OPEN)
+
+    def rewrite(self, request, endpoint: Endpoint):
+        """把发往 default_base_url 的请求改写为发往endpoint，并换用该端点的key"""
+        import httpx
+        url = endpoint.base_url + str(request.url)[len(self.default_base_url):]
+        headers = [(k, v) for k, v in request.headers.items() if k.lower() not in ("host", "authorization")]
+        headers.append(("authorization", f"Bearer {endpoint.api_key}"))
+        return httpx.Request(request.method, url, headers=headers, content=request.content, extensions=request.extensions)
+
+
+_pool = None
+
+
+def configure_pool(spec: str | None, default_base_url: str, failure_threshold: int = 3, cooldown: float = 30.0):
+    """
+    设置模型服务连接池，之后创建的chain都会生效
+    :param spec: JSON文件路径或JSON字符串，[{"base_url", "api_key" 或 "api_key_env", "weight", "rate_limit", "name"}]，
+                 为空时所有请求直接发往 --base_url
+    :param default_base_url: --base_url，发往该地址的请求由连接池分配
+    """
+    global _pool
+    _pool = None
+    if not spec:
+        return
+    from .model import load_env
+    load_env()
+    if os.path.exists(spec):
+        with open(spec, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    else:
+        data = json.loads(spec)
+    endpoints = [Endpoint.from_dict(e, i) for i, e in enumerate(data)]
+    if not endpoints:
+        raise ValueError("连接池中没有端点")
+    for endpoint in endpoints:
+        LLM_ENDPOINT_CIRCUIT.set(CLOSED, endpoint=endpoint.name)
+    _pool = EndpointPool(endpoints, default_base_url, failure_threshold, cooldown)
+    # 客户端初始化要求存在api key，实际请求使用各端点的key
+    os.environ.setdefault("OPENAI_API_KEY", endpoints[0].api_key)
+    logger.info(f"模型服务连接池: {', '.join(f'{e.name}(权重{e.weight:g})' for e in endpoints)}")
+
+
+def configure_pool_from_args(args):
+    configure_pool(getattr(args, "endpoints", None), args.base_url,
+                   getattr(args, "endpoint_failure_threshold", 3), getattr(args, "endpoint_cooldown", 30.0))
+
+
+def pool_transport(base_url: str):
+    """发往base_url的请求使用的连接池transport，未配置连接池或base_url不是 --base_url 时为None"""
+    if _pool is None or (base_url or "").rstrip("/") != _pool.default_base_url:
+        return None
+    return _pool.transport
+
+
+def pool_client_kwargs(base_url: str) -> dict:
+    """返回ChatOpenAI的http_client参数，未配置连接池或base_url不是 --base_url 时为空。同一base_url返回同一组客户端"""
+    transport = pool_transport(base_url)
+    if transport is None:
+        return {}
+    key = (base_url or "").rstrip("/")
+    if key not in _pool.clients:
+        import httpx
+        _pool.clients[key] = {
+            "http_client": httpx.Client(transport=transport),
+            "http_async_client": httpx.AsyncClient(transport=transport),
+        }
+    return _pool.clients[key]
@@ -80,6 +80,67 @@ GRAMMAR_CHECK_PROMPT ="""
 }}
 """
 
+GRAMMAR_EDIT_PROMPT ="""
+## 角色
+你是一名严谨的中文语法和拼写纠错专家，必须按照正式的语法规则判断用户输入文本中是否存在病句、主语残缺、搭配不当、成分残缺、词语误用、语序不当、重复啰嗦、成分赘余、介宾结构误用、错别字等错误。
+
+判断标准必须严格，不允许因为“能理解”就判为正确。
+
+## 你的任务
+判断用户输入文本是否符合中文语法规则，只输出需要修改之处的编辑操作，不要输出修改后的全文。
+
+- 如果输入完全正确：  
+  - correct = true  
+  - edits = []  
+
+- 如果输入存在错误：  
+  - correct = false  
+  - edits = 每处错误一个编辑操作，按在原文中出现的顺序排列：  
+    - start：original 在原文中的起始字符位置（从0开始计数）  
+    - original：原文中需要修改的最短片段，必须与原文完全一致  
+    - replacement：替换后的内容，删除时为空字符串  
+    - type：错误类型，例如“错别字”“搭配不当”“成分残缺”“标点错误”  
+    - reason：简要说明  
+
+## 输出要求
+- 必须返回严格 JSON 格式，不允许添加任何额外文本、解释或注释：
+
+{{
+  "correct": true 或 false,
+  "edits": [{{"start": 0, "original": "原片段", "replacement": "替换内容", "type": "错误类型", "reason": "原因"}}]
+}}
+
+## 注意事项
+- 只做最小幅度的修改，禁止扩写、改写、润色
+- original 尽量短，但必须在原文中能唯一定位；插入内容时 original 为插入位置前的一个字，replacement 为该字加插入的内容
+- 各编辑操作的 original 不能重叠
+- 严禁输出 JSON 外的其他内容
+
+## 示例
+### 示例1
+输入：
+我今天吃了萍果后去学校
+
+输出：
+{{
+  "correct": false,
+  "edits": [
+    {{"start": 5, "original": "萍果", "replacement": "苹果", "type": "错别字", "reason": "形近字"}},
+    {{"start": 10, "original": "校", "replacement": "校。", "type": "标点错误", "reason": "句末缺少句号"}}
+  ]
+}}
+
+### 示例2
+输入：
+明天我会准时到达。
+
+输出：
+{{
+  "correct": true,
+  "edits": []
+}}
+"""
+
 ENTITY_EXTRACT_PROMPT = """
 你是一个通用信息抽取模型（Universal Entity Extractor）。
 你的任务是从任意类型文档中抽取“实体”（Entity）。
@@ -124,6 +185,8 @@ ENTITY_CONSISTENCY_CHECK_PROMPT = """
 - 事件描述矛盾
 - 与其他实体的关系冲突
 
+alternatives 中列出的是同一属性在文档不同部分出现的全部不同取值，需判断这些取值之间是否矛盾。
+
 请输出：
 {{
   "entity_name": "",
@@ -161,19 +224,19 @@ CONSISTENCY_CORRECT_PROMPT = """
 
 # 输入描述
 你将得到：
-1）一段原始文档文本（chunk）
-2）一个实体的冲突分析结果（JSON列表），其中：
+1）与该段文本相关的实体冲突分析结果（JSON列表），其中：
    - entity_name 表示冲突所属实体
    - conflicts 是该实体下已经确认的矛盾描述（自然语言）
-3）每个冲突项都有一个 type 字段，用于指定标注类型（如：数值冲突、描述冲突等）。
+2）每个冲突项都有一个 type 字段，用于指定标注类型（如：数值冲突、描述冲突等）。
+3）一段原始文档文本（chunk）
 
 输入示例：
-原始文本：
-{{chunk_text}}
-
 实体冲突分析结果：
 {{entity_conflict_json}}
 
+原始文本：
+{{chunk_text}}
+
 # 任务
 对于每一条 conflict：
 1. 将该 conflict 在语义上拆解为多个“冲突事实原子”
@@ -201,6 +264,47 @@ CONSISTENCY_CORRECT_PROMPT = """
 - 不允许合并或新增冲突
 - 如果原文中没有与冲突描述相关的内容，不输出标记，直接输出原始文本
 """
+
+CONSISTENCY_SPAN_PROMPT = """
+# 角色
+你是一个“文档一致性矛盾片段定位器”。
+
+你不会发现新矛盾，也不会判断对错。
+所有矛盾已经由上游系统确认，你只负责在原文中找出构成矛盾的具体事实陈述。
+
+# 输入描述
+你将得到：
+1）与该段文本相关的冲突列表（JSON列表），每一项包含：
+   - id：冲突编号
+   - entity_name：冲突所属实体
+   - type：冲突类型
+   - description：已经确认的矛盾描述
+2）一段原始文档文本
+
+# 任务
+对于每一条冲突：
+1. 将该冲突在语义上拆解为多个“冲突事实原子”（例如：两个不同时间、两个不同数值、两个相反状态）
+2. 在原文中找到每一个事实原子对应的最小文本片段
+3. 逐字引用该片段作为 anchor，并给出它对应的冲突编号
+
+# 要求
+- anchor 必须逐字复制原文，不允许修改、省略或补写任何字符
+- anchor 优先取最小可独立成立的子句，而不是整句或整段
+- anchor 在原文中出现多次时，扩展引用范围直到在原文中唯一；无法扩展时用 occurrence 给出它是原文中第几次出现（从1开始）
+- 一个片段同时对应多条冲突时，conflict_ids 中列出全部编号
+- 不允许输出原文全文，不允许解释矛盾原因
+- 如果原文中没有与冲突相关的内容，spans 为空列表
+
+# 输出格式
+必须返回严格 JSON 格式，不允许添加任何额外文本：
+
+{{
+  "spans": [
+    {{"anchor": "原文中的片段", "conflict_ids": ["1"]}},
+    {{"anchor": "重复出现的片段", "conflict_ids": ["2"], "occurrence": 2}}
+  ]
+}}
+"""
 # 在文件末尾添加以下内容
 FEEDBACK_SUMMARY_PROMPT = """
 ## 角色
@@ -0,0 +1,129 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 实体ID等每次运行都会变化的UUID，在计算请求key时统一替换
+UUID_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+_config = {"mode": None, "path": None, "latency": "original", "cassette": None, "clients": {}}
+
+
+def request_key(request) -> str:
+    """按请求方法、路径与规范化后的请求体计算匹配key"""
+    body = request.content.decode("utf-8", errors="replace")
+    try:
+        body = json.dumps(json.loads(body), ensure_ascii=False, sort_keys=True)
+    except ValueError:
+        pass
+    body = UUID_PATTERN.sub("<uuid>", body)
+    raw = f"{request.method} {request.url.path}\n{body}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    一次运行的全部请求/响应记录，gzip压缩的JSONL文件，每行一次交互
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}  # key -> [entry, ...]，相同请求按记录顺序依次返回
+        self._lock = threading.Lock()
+
+    def load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                self.entries.setdefault(entry["key"], []).append(entry)
+        logger.info(f"已加载 {sum(len(v) for v in self.entries.values())} 条LLM调用记录: {self.path}")
+        return self
+
+    def truncate(self):
+        """清空记录文件，重新录制时旧的记录不会与新的混在一起"""
+        if os.path.exists(self.path):
+            logger.warning(f"覆盖已有的LLM调用记录: {self.path}")
+        with gzip.open(self.path, "wt", encoding="utf-8"):
+            pass
+        return self
+
+    def append(self, entry: dict):
+        with self._lock:
+            # gzip 支持多member追加写入，读取时自动拼接
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def pop(self, key: str):
+        with self._lock:
+            entries = self.entries.get(key)
+            if not entries:
+                return None
+            # 最后一条保留，重复请求多于记录次数时复用
+            return entries.pop(0) if len(entries) > 1 else entries[0]
+
+
+def configure(mode: str | None, path: str | None = None, latency: str = "original"):
+    """
+    设置全局的录制/回放模式，之后创建的chain都会生效。
+    :param mode: None / "record" / "replay"
+    :param path: 记录文件路径 (.jsonl.gz)
+    :param latency: 回放延迟，original 按录制时耗时返回，zero 立即返回
+    """
+    cassette = None
+    if mode == "record":
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        cassette = Cassette(path).truncate()
+    elif mode == "replay":
+        cassette = Cassette(path).load()
+        # 回放不访问真实服务，但客户端初始化要求存在api key
+        os.environ.setdefault("OPENAI_API_KEY", "replay")
+    # transport与客户端在每次设置时创建一次，所有chain共用，避免每个chain各自创建连接池
+    _config.update(mode=mode, path=path, latency=latency, cassette=cassette, clients={})
+
+
+def configure_from_args(args):
+    """根据 --record / --replay / --replay_latency 参数设置模式"""
+    if getattr(args, "replay", None):
+        configure("replay", args.replay, getattr(args, "replay_latency", "original"))
+        if getattr(args, "endpoints", None):
+            logger.warning("回放模式不访问模型服务，--endpoints 不生效")
+    elif getattr(args, "record", None):
+        configure("record", args.record)
+
+
+def replay_mode() -> str | None:
+    """当前的录制/回放模式：record / replay / None"""
+    return _config["mode"]
+
+
+def http_client_kwargs(inner=None) -> dict:
+    """
+    返回ChatOpenAI的http_client参数，未开启录制/回放时为空。同一个inner返回同一组客户端
+    :param inner: 录制模式下实际发送请求的transport（如连接池），回放模式不发送请求，忽略该参数
+    """
+    mode = _config["mode"]
+    if mode is None:
+        return {}
+    if mode == "replay":
+        inner = None
+    # 以id为key时同时保存inner本身，保证id不会被其他对象复用
+    cached = _config["clients"].get(id(inner))
+    if cached is None:
+        import httpx
+        from .transports import RecordingTransport, ReplayTransport
+        if mode == "record":
+            transport = RecordingTransport(_config["cassette"], inner)
+        else:
+            transport = ReplayTransport(_config["cassette"], _config["latency"])
+        cached = (inner, {
+            "http_client": httpx.Client(transport=transport),
+            "http_async_client": httpx.AsyncClient(transport=transport),
+        })
+        _config["clients"][id(inner)] = cached
+    return cached[1]
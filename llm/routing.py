@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+
+from monitor.metrics import LLM_ESCALATIONS, set_model_price
+
+logger = logging.getLogger(__name__)
+
+# 可以单独配置模型的阶段，与LLM调用指标的stage标签一致
+STAGES = ("grammar_check", "entity_extract", "consistency_check", "memory_summary", "consistency_correct", "feedback_summary")
+
+
+class Route:
+    """
+    一个阶段的模型配置，未设置的字段沿用全局的 --model_name / --base_url 与chain的默认值。
+    :param escalate_to: 升级模型的Route，设置后先调用本模型，输出无法解析或置信度低时改用升级模型
+    :param prompt_price: 该模型每千prompt token单价，用于费用指标
+    """
+    def __init__(self, model=None, base_url=None, max_tokens=None, temperature=None, escalate_to=None,
+                 prompt_price=None, completion_price=None):
+        self.model = model
+        self.base_url = base_url
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.escalate_to = escalate_to
+        self.prompt_price = prompt_price
+        self.completion_price = completion_price
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        escalate_to = data.get("escalate_to")
+        if isinstance(escalate_to, str):
+            escalate_to = {"model": escalate_to}
+        return cls(
+            model=data.get("model"),
+            base_url=data.get("base_url"),
+            max_tokens=data.get("max_tokens"),
+            temperature=data.get("temperature"),
+            escalate_to=cls.from_dict(escalate_to) if escalate_to else None,
+            prompt_price=data.get("prompt_price"),
+            completion_price=data.get("completion_price"),
+        )
+
+
+_routes = {}
+
+
+def configure_routes(spec: str | None):
+    """
+    设置各阶段的模型配置
+    :param spec: JSON文件路径或JSON字符串，{stage: {"model", "max_tokens", "temperature", "base_url", "escalate_to", ...}}，
+                 为空时所有阶段使用全局配置
+    """
+    _routes.clear()
+    if not spec:
+        return
+    if os.path.exists(spec):
+        with open(spec, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    else:
+        data = json.loads(spec)
+    for stage, config in data.items():
+        if stage not in STAGES:
+            raise ValueError(f"未知的阶段: {stage}，可选: {', '.join(STAGES)}")
+        route = Route.from_dict(config)
+        _routes[stage] = route
+        for r in (route, route.escalate_to):
+            if r is not None and r.model and (r.prompt_price is not None or r.completion_price is not None):
+                set_model_price(r.model, r.prompt_price or 0.0, r.completion_price or 0.0)
+        logger.info(f"阶段 {stage} 使用模型 {route.model or '默认'}" + (f"，升级模型 {route.escalate_to.model}" if route.escalate_to else ""))
+
+
+def configure_routes_from_args(args):
+    configure_routes(getattr(args, "model_routes", None))
+
+
+def get_route(stage: str) -> Route:
+    return _routes.get(stage) or Route()
+
+
+def route_models(stage: str, model_name: str) -> tuple:
+    """阶段实际使用的模型与升级模型，作为结果缓存key的一部分，不同模型的结果不会互相复用"""
+    route = get_route(stage)
+    escalate = route.escalate_to
+    return (route.model or model_name, route.temperature, escalate and (escalate.model or model_name))
+
+
+class LowConfidenceOutput(ValueError):
+    """小模型的输出无法解析或置信度低，需要由升级模型重新生成"""
+    def __init__(self, reason: str, detail: str = ""):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+
+
+def _load_json(text: str):
+    try:
+        return json.loads(text)
+    except ValueError as e:
+        raise LowConfidenceOutput("parse", str(e))
+
+
+def _check_grammar(text: str):
+    data = _load_json(text)
+    if not isinstance(data, dict) or not isinstance(data.get("correct"), bool):
+        raise LowConfidenceOutput("parse", "缺少correct字段")
+    if "edits" in data:
+        # 编辑操作格式（--grammar_output edits）
+        edits = data["edits"]
+        if not isinstance(edits, list) or not all(isinstance(e, dict) and isinstance(e.get("original"), str) and isinstance(e.get("replacement"), str) for e in edits):
+            raise LowConfidenceOutput("parse", "编辑操作缺少original/replacement字段")
+        if data["correct"] is False and not edits:
+            raise LowConfidenceOutput("low_confidence", "判定有错但没有编辑操作")
+        return
+    if not isinstance(data.get("content"), str):
+        raise LowConfidenceOutput("parse", "缺少content字段")
+    # 判定有错却给不出原因，多为小模型的误判
+    if data["correct"] is False and not data.get("reason"):
+        raise LowConfidenceOutput("low_confidence", "判定有错但没有原因")
+
+
+def _check_entities(text: str):
+    data = _load_json(text)
+    if not isinstance(data, list) or not all(isinstance(e, dict) and isinstance(e.get("name"), str) and isinstance(e.get("type"), str) for e in data):
+        raise LowConfidenceOutput("parse", "实体缺少name/type字段")
+
+
+def _check_consistency(text: str):
+    data = _load_json(text)
+    if not isinstance(data, dict) or not isinstance(data.get("has_conflict"), bool):
+        raise LowConfidenceOutput("parse", "缺少has_conflict字段")
+    # 判定有冲突却列不出冲突内容
+    if data["has_conflict"] and not data.get("conflicts"):
+        raise LowConfidenceOutput("low_confidence", "判定有冲突但没有冲突内容")
+
+
+# 各阶段输出的检查，未列出的阶段只检查是否被截断
+VALIDATORS = {
+    "grammar_check": _check_grammar,
+    "entity_extract": _check_entities,
+    "consistency_check": _check_consistency,
+}
+
+
+def validate_output(stage: str, message):
+    """
+    检查小模型的输出，可用时原样返回，否则抛出LowConfidenceOutput触发升级
+    :param message: 模型返回的AIMessage
+    """
+    try:
+        if (message.response_metadata or {}).get("finish_reason") == "length":
+            raise LowConfidenceOutput("truncated", "输出达到max_tokens被截断")
+        validator = VALIDATORS.get(stage)
+        if validator is not None:
+            validator(message.content)
+    except LowConfidenceOutput as e:
+        LLM_ESCALATIONS.inc(stage=stage, reason=e.reason)
+        logger.info(f"阶段 {stage} 升级到大模型: {e}")
+        raise
+    return message
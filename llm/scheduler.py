@@ -0,0 +1,226 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from monitor.metrics import SCHEDULER_QUEUE_WAIT, SCHEDULER_QUEUED, SCHEDULER_ACTIVE
+from monitor.tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+# 优先级，数值小的先调度
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = ("interactive", "batch")
+
+# 两种优先级都有等待者时，交互任务连续出队这么多次后让批处理任务出队一次，避免批处理任务饿死
+INTERACTIVE_BURST = 4
+
+
+class Job:
+    """
+    一个检测任务在调度器中的身份与排队统计
+    :param client_id: 客户端标识，同一优先级内LLM调用在客户端之间轮转
+    :param priority: INTERACTIVE 或 BATCH
+    """
+    def __init__(self, job_id, client_id: str = "local", priority: int = BATCH):
+        self.job_id = job_id
+        self.client_id = client_id
+        self.priority = priority
+        self.admission_wait = 0.0
+        self.llm_wait = 0.0
+        self.llm_calls = 0
+
+    @property
+    def priority_name(self) -> str:
+        return PRIORITY_NAMES[self.priority]
+
+    def report(self) -> dict:
+        """任务的排队时间统计，附在完成消息与汇总中"""
+        return {
+            "priority": self.priority_name,
+            "admission_wait": round(self.admission_wait, 3),
+            "llm_wait": round(self.llm_wait, 3),
+            "llm_calls": self.llm_calls,
+        }
+
+
+# 当前上下文所属的任务，pipeline内创建的子任务会继承
+current_job = contextvars.ContextVar("current_job", default=None)
+# 不属于任何任务的调用（反馈总结、单文档命令行脚本）按交互请求调度
+_DEFAULT_JOB = Job(None, "local", INTERACTIVE)
+
+
+class _FairQueue:
+    """
+    等待者队列：先按优先级，同一优先级内在客户端之间轮转，每个客户端内部先进先出
+    """
+    def __init__(self):
+        self._clients = [OrderedDict() for _ in PRIORITY_NAMES]  # priority -> {client_id: deque}
+        self._burst = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def push(self, priority: int, client_id: str, item):
+        self._clients[priority].setdefault(client_id, deque()).append(item)
+        self._size += 1
+
+    def remove(self, priority: int, client_id: str, item) -> bool:
+        queue = self._clients[priority].get(client_id)
+        if queue is None or item not in queue:
+            return False
+        queue.remove(item)
+        if not queue:
+            del self._clients[priority][client_id]
+        self._size -= 1
+        return True
+
+    def pop(self):
+        waiting = [p for p, clients in enumerate(self._clients) if clients]
+        if not waiting:
+            return None
+        priority = waiting[0]
+        if len(waiting) > 1:
+            if self._burst >= INTERACTIVE_BURST:
+                priority = waiting[1]
+                self._burst = 0
+            else:
+                self._burst += 1
+        clients = self._clients[priority]
+        # 取出队首客户端的第一个等待者，该客户端仍有等待者时移到队尾
+        client_id, queue = next(iter(clients.items()))
+        item = queue.popleft()
+        del clients[client_id]
+        if queue:
+            clients[client_id] = queue
+        self._size -= 1
+        return item
+
+
+class _Slots:
+    """
+    数量有限的槽位（同时运行的任务数或LLM调用数），没有空闲槽位时按 _FairQueue 的顺序分配
+    :param limit: 槽位数，<=0 表示不限制
+    """
+    def __init__(self, name: str, limit: int = 0):
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self._queue = _FairQueue()
+
+    def available(self) -> bool:
+        """当前是否有空闲槽位，新的请求无需排队"""
+        return self.limit <= 0 or (self.active < self.limit and not len(self._queue))
+
+    def _occupy(self):
+        self.active += 1
+        SCHEDULER_ACTIVE.inc(queue=self.name)
+
+    async def acquire(self, job: Job) -> float:
+        """等待一个槽位，返回排队时间（秒）"""
+        if self.available():
+            self._occupy()
+            return 0.0
+        future = asyncio.get_running_loop().create_future()
+        self._queue.push(job.priority, job.client_id, future)
+        SCHEDULER_QUEUED.inc(queue=self.name, priority=job.priority_name)
+        start = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not self._queue.remove(job.priority, job.client_id, future) and future.done() and not future.cancelled():
+                # 已分配到槽位但任务在恢复前被取消，交还槽位
+                self.release()
+            raise
+        finally:
+            SCHEDULER_QUEUED.dec(queue=self.name, priority=job.priority_name)
+        return time.perf_counter() - start
+
+    def release(self):
+        self.active -= 1
+        SCHEDULER_ACTIVE.dec(queue=self.name)
+        while self.limit <= 0 or self.active < self.limit:
+            future = self._queue.pop()
+            if future is None:
+                break
+            if future.done():
+                continue
+            # 槽位直接转交给等待者，新来的调用不会插队
+            self._occupy()
+            future.set_result(None)
+
+
+class Scheduler:
+    """
+    进程内所有pipeline共用的调度器，位于pipeline与LLM客户端之间：
+    限制同时运行的任务数（超出时排队），限制同时进行的LLM调用数，并在排队时
+    优先调度短小的交互任务、在同一优先级的客户端之间公平轮转
+    """
+    def __init__(self):
+        self.jobs = _Slots("job")
+        self.llm = _Slots("llm")
+        self.short_job_chars = 20000
+
+    def configure(self, max_jobs: int = 0, llm_concurrency: int = 0, short_job_chars: int = 20000):
+        """
+        :param max_jobs: 同时运行的检测任务数，0表示不限制
+        :param llm_concurrency: 所有任务同时进行的LLM调用数，0表示不限制
+        :param short_job_chars: 不超过该长度的交互任务按交互优先级调度，更长的按批处理调度
+        """
+        self.jobs.limit = max_jobs
+        self.llm.limit = llm_concurrency
+        self.short_job_chars = short_job_chars
+        if max_jobs > 0 or llm_concurrency > 0:
+            logger.info(f"调度器: 最多 {max_jobs or '不限'} 个任务，{llm_concurrency or '不限'} 个并发LLM调用")
+
+    def new_job(self, job_id, client_id: str = "local", interactive: bool = False, size: int = 0) -> Job:
+        """
+        :param interactive: 是否为交互请求（websocket），批处理任务为False
+        :param size: 任务文本长度，超过 short_job_chars 的交互任务按批处理调度
+        """
+        return Job(job_id, client_id, INTERACTIVE if interactive and size <= self.short_job_chars else BATCH)
+
+    @asynccontextmanager
+    async def admit(self, job: Job):
+        """
+        以任务的身份运行with代码块：先等待任务槽位，代码块内的LLM调用按该任务的客户端与优先级排队
+        """
+        job.admission_wait = await self.jobs.acquire(job)
+        SCHEDULER_QUEUE_WAIT.observe(job.admission_wait, queue="job", priority=job.priority_name)
+        token = current_job.set(job)
+        try:
+            yield job
+        finally:
+            current_job.reset(token)
+            self.jobs.release()
+
+    @asynccontextmanager
+    async def llm_slot(self):
+        """占用一个LLM调用槽位，排队时间累加到当前任务与当前span"""
+        job = current_job.get() or _DEFAULT_JOB
+        wait = await self.llm.acquire(job)
+        job.llm_wait += wait
+        job.llm_calls += 1
+        SCHEDULER_QUEUE_WAIT.observe(wait, queue="llm", priority=job.priority_name)
+        parent = current_span.get()
+        if parent is not None and wait:
+            parent.add("scheduler.llm_wait", wait)
+        try:
+            yield
+        finally:
+            self.llm.release()
+
+
+SCHEDULER = Scheduler()
+
+
+def llm_slot():
+    return SCHEDULER.llm_slot()
+
+
+def configure_scheduler_from_args(args):
+    SCHEDULER.configure(getattr(args, "max_jobs", 0), getattr(args, "llm_concurrency", 0), getattr(args, "short_job_chars", 20000))
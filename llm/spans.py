@@ -0,0 +1,183 @@
+import json
+import logging
+import re
+
+from monitor.metrics import CORRECT_SPANS
+from .model import astream_content
+
+logger = logging.getLogger(__name__)
+
+
+class SpanError(ValueError):
+    """标注片段无法在原文中定位"""
+
+
+def number_conflicts(conflicts):
+    """
+    将chunk相关的冲突结果展开为逐条编号的冲突，供模型按编号引用
+    :param conflicts: 一致性检查结果列表 [{"entity_name", "conflicts": [{"type", "description"}]}]
+    :return: [{"id": "1", "entity_name", "type", "description"}]
+    """
+    numbered = []
+    for res in conflicts:
+        for conflict in res.get("conflicts") or []:
+            numbered.append({
+                "id": str(len(numbered) + 1),
+                "entity_name": res.get("entity_name", ""),
+                "type": conflict.get("type", ""),
+                "description": conflict.get("description", ""),
+            })
+    return numbered
+
+
+_SPACE = re.compile(r"\s+")
+
+
+def _occurrences(text: str, target: str):
+    """target 在 text 中每一次出现的起点（允许重叠）"""
+    pos = text.find(target)
+    while pos != -1:
+        yield pos
+        pos = text.find(target, pos + 1)
+
+
+def _nth(positions, occurrence: int):
+    for i, pos in enumerate(positions, 1):
+        if i == occurrence:
+            return pos
+    return -1
+
+
+def _locate(text: str, anchor: str, occurrence: int = 1):
+    """
+    找到引用片段在原文中第 occurrence 次出现的位置，返回 (start, end)。
+    先精确匹配，找不到时忽略空白再匹配（模型引用时常丢失或多出空格、换行）
+    """
+    target = _SPACE.sub("", anchor)
+    if not target:
+        raise SpanError("引用片段为空")
+    pos = _nth(_occurrences(text, anchor), occurrence)
+    if pos != -1:
+        return pos, pos + len(anchor)
+    # 去掉空白后的文本，以及其中每个字符在原文中的位置
+    positions = [i for i, ch in enumerate(text) if not ch.isspace()]
+    stripped = "".join(text[i] for i in positions)
+    pos = _nth(_occurrences(stripped, target), occurrence)
+    if pos == -1:
+        raise SpanError(f"原文中不存在第{occurrence}处片段: {anchor}")
+    return positions[pos], positions[pos + len(target) - 1] + 1
+
+
+def _locate_span(text: str, span, by_id):
+    """
+    校验一条标注片段并在原文中定位
+    :return: (start, end, 冲突编号列表)
+    """
+    if not isinstance(span, dict) or not isinstance(span.get("anchor"), str):
+        raise SpanError(f"标注格式错误: {span}")
+    ids = [str(i) for i in span.get("conflict_ids") or []]
+    if not ids or any(i not in by_id for i in ids):
+        raise SpanError(f"未知的冲突编号: {ids}")
+    occurrence = span.get("occurrence")
+    if occurrence is None:
+        occurrence = 1
+    if isinstance(occurrence, bool) or not isinstance(occurrence, int) or occurrence < 1:
+        raise SpanError(f"片段出现序号错误: {occurrence}")
+    start, end = _locate(text, span["anchor"], occurrence)
+    return start, end, ids
+
+
+def apply_spans(text: str, spans, conflicts):
+    """
+    按引用片段在原文中插入矛盾标记，标记格式与完整输出相同：【矛盾::实体::类型1/类型2】原文片段【/矛盾】。
+    无法定位的片段单独丢弃并记录日志，其余片段照常标记；全部片段都无法定位时抛出SpanError
+    :param text: 原文
+    :param spans: [{"anchor": 原文片段, "conflict_ids": [冲突编号], "occurrence": 片段在原文中第几次出现，默认1}]
+    :param conflicts: number_conflicts 的返回值
+    :return: (标注后的文本, 插入的标记数, 丢弃的片段数)
+    """
+    if not isinstance(spans, list):
+        raise SpanError("spans不是列表")
+    by_id = {c["id"]: c for c in conflicts}
+    marks = []
+    dropped = 0
+    for span in spans:
+        try:
+            start, end, ids = _locate_span(text, span, by_id)
+        except SpanError as e:
+            logger.warning(f"丢弃无法定位的标注片段: {e}")
+            dropped += 1
+            continue
+        # 同一片段对应不同实体的冲突时分别标记
+        for entity_name in dict.fromkeys(by_id[i]["entity_name"] for i in ids):
+            types = "/".join(dict.fromkeys(by_id[i]["type"] for i in ids if by_id[i]["entity_name"] == entity_name))
+            marks.append((start, end, f"【矛盾::{entity_name}::{types}】"))
+    if spans and dropped == len(spans):
+        raise SpanError(f"{dropped}个标注片段均无法定位")
+    # 部分重叠的标记无法嵌套，保留先出现的
+    marks.sort(key=lambda m: (m[0], -m[1]))
+    kept = []
+    for mark in marks:
+        if any(k[0] < mark[0] < k[1] < mark[1] or mark[0] < k[0] < mark[1] < k[1] for k in kept):
+            logger.debug(f"跳过部分重叠的标记: {text[mark[0]:mark[1]]}")
+            continue
+        kept.append(mark)
+    # 同一位置先闭合内层标记，再打开外层较长的标记
+    events = [(end, 0, -start, "【/矛盾】") for start, end, _ in kept] + [(start, 1, -end, tag) for start, end, tag in kept]
+    events.sort(key=lambda e: e[:3])
+    pieces, pos = [], 0
+    for at, _, _, tag in events:
+        pieces.append(text[pos:at])
+        pieces.append(tag)
+        pos = at
+    pieces.append(text[pos:])
+    return "".join(pieces), len(kept), dropped
+
+
+def spans_to_text(text: str, output: str, conflicts) -> str:
+    """
+    将片段标注格式的模型输出应用到原文
+    :param output: 模型输出 {"spans": [...]}
+    :return: (标注后的文本, 丢弃的片段数)
+    """
+    try:
+        data = json.loads(output)
+    except ValueError as e:
+        raise SpanError(f"输出不是JSON: {e}")
+    if not isinstance(data, dict):
+        raise SpanError("输出不是JSON对象")
+    marked, _, dropped = apply_spans(text, data.get("spans") or [], conflicts)
+    return marked, dropped
+
+
+async def acorrect_spans(span_chain, text: str, chunk_conflicts, on_delta=None, fallback_chain=None) -> str:
+    """
+    以片段标注格式修正一致性：模型只返回需要标记的原文片段与冲突编号，在本地插入标记。
+    个别片段无法定位时只丢弃这些片段；输出不是JSON或全部片段都无法定位时，改用 fallback_chain（完整输出格式）重新标注
+    :param span_chain: 片段标注格式的一致性修正链
+    :param text: 原始chunk
+    :param chunk_conflicts: 与该chunk相关的冲突结果
+    :param on_delta: 流式增量回调。标注片段不是前端展示的格式，标注后的文本作为一次完整的增量发送；
+                     改用完整输出时，完整输出照常流式发送
+    :param fallback_chain: 完整输出格式的一致性修正链，为None时直接抛出SpanError
+    :return: 标注后的文本
+    """
+    conflicts = number_conflicts(chunk_conflicts)
+    # 冲突列表在前、原文在后，相邻chunk的冲突相同时共享请求前缀
+    span_input = f"冲突列表:{json.dumps(conflicts, ensure_ascii=False)}\n原始文本:{text}"
+    output = await astream_content(span_chain, {"new_message": span_input})
+    try:
+        marked, dropped = spans_to_text(text, output, conflicts)
+    except SpanError as e:
+        CORRECT_SPANS.inc(result="fallback")
+        if fallback_chain is None:
+            raise
+        logger.warning(f"标注片段无法定位，改用完整输出重新标注: {e}")
+        return await astream_content(fallback_chain, {"new_message": f"实体冲突分析结果:{chunk_conflicts}\n原始文本:{text}"}, on_delta)
+    if dropped:
+        CORRECT_SPANS.inc(result="partial")
+    else:
+        CORRECT_SPANS.inc(result="applied" if marked != text else "unchanged")
+    if on_delta:
+        await on_delta(marked)
+    return marked
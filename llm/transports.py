@@ -0,0 +1,208 @@
+# 录制/回放与连接池使用的httpx transport。只在创建transport时导入本模块，导入 llm.model / llm.replay / llm.pool 不会加载httpx
+import asyncio
+import logging
+import time
+
+import httpx
+
+from monitor.metrics import LLM_ENDPOINT_FAILOVERS
+from .replay import Cassette, request_key
+
+logger = logging.getLogger(__name__)
+
+
+def _make_entry(key, response: httpx.Response, body: bytes, elapsed: float):
+    return {
+        "key": key,
+        "status": response.status_code,
+        "content_type": response.headers.get("content-type", "application/json"),
+        "body": body.decode("utf-8"),
+        "elapsed": round(elapsed, 4),
+    }
+
+
+def _make_response(request, entry):
+    return httpx.Response(
+        entry["status"],
+        headers={"content-type": entry["content_type"]},
+        content=entry["body"].encode("utf-8"),
+        request=request,
+    )
+
+
+class RecordingTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    转发真实请求，并把每次请求/响应写入cassette
+    :param inner: 实际发送请求的transport（同时支持同步与异步），为空时直接发往请求地址
+    """
+    def __init__(self, cassette: Cassette, inner=None):
+        self.cassette = cassette
+        self._sync = inner or httpx.HTTPTransport()
+        self._async = inner or httpx.AsyncHTTPTransport()
+
+    def handle_request(self, request):
+        start = time.perf_counter()
+        response = self._sync.handle_request(request)
+        body = response.read()
+        entry = _make_entry(request_key(request), response, body, time.perf_counter() - start)
+        self.cassette.append(entry)
+        return _make_response(request, entry)
+
+    async def handle_async_request(self, request):
+        start = time.perf_counter()
+        response = await self._async.handle_async_request(request)
+        body = await response.aread()
+        entry = _make_entry(request_key(request), response, body, time.perf_counter() - start)
+        # gzip压缩与文件写入在线程中进行，不阻塞事件循环
+        await asyncio.to_thread(self.cassette.append, entry)
+        return _make_response(request, entry)
+
+
+class ReplayTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """离线返回cassette中记录的响应，可按原始延迟或零延迟返回"""
+    def __init__(self, cassette: Cassette, latency: str = "original"):
+        self.cassette = cassette
+        self.latency = latency
+
+    def _lookup(self, request):
+        entry = self.cassette.pop(request_key(request))
+        if entry is None:
+            raise httpx.ConnectError(f"replay文件中没有匹配的请求: {request.url}", request=request)
+        return entry
+
+    def handle_request(self, request):
+        entry = self._lookup(request)
+        if self.latency == "original":
+            time.sleep(entry["elapsed"])
+        return _make_response(request, entry)
+
+    async def handle_async_request(self, request):
+        entry = self._lookup(request)
+        if self.latency == "original":
+            await asyncio.sleep(entry["elapsed"])
+        return _make_response(request, entry)
+
+
+def _failed(response: httpx.Response) -> bool:
+    """限流与服务端错误视为端点故障，其他状态码是请求本身的问题"""
+    return response.status_code == 429 or response.status_code >= 500
+
+
+class _TrackedStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """响应体读取完毕或关闭时释放端点，流式响应在输出结束前都计入未完成请求"""
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self._error = None
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        except Exception as e:
+            self._error = e
+            raise
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        except (Exception, asyncio.CancelledError) as e:
+            self._error = e
+            raise
+
+    def _close(self):
+        if self._on_close is not None:
+            self._on_close(self._error)
+            self._on_close = None
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._close()
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._close()
+
+
+class PoolTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    按连接池分配请求的httpx transport。请求失败（连接错误、429、5xx）时立即改发到尚未尝试过的端点，
+    所有端点都失败后把最后一次的结果交给openai客户端，由其按自身的重试策略处理
+    """
+    def __init__(self, pool):
+        self.pool = pool
+
+    def _track(self, endpoint, request, response):
+        def on_close(error):
+            if isinstance(error, asyncio.CancelledError):
+                self.pool.release(endpoint, None, "cancelled")
+            elif error is not None:
+                self.pool.release(endpoint, False, "error")
+            else:
+                self.pool.release(endpoint, not _failed(response), str(response.status_code))
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_TrackedStream(response.stream, on_close),
+            extensions=response.extensions,
+            request=request,
+        )
+
+    def handle_request(self, request):
+        tried = []
+        while True:
+            endpoint, delay = self.pool.acquire(tried)
+            if endpoint is None and delay is not None:
+                time.sleep(delay)
+                continue
+            if endpoint is None:
+                raise last_error
+            if tried:
+                LLM_ENDPOINT_FAILOVERS.inc(endpoint=endpoint.name)
+            tried.append(endpoint)
+            try:
+                response = self.pool.sync_transport().handle_request(self.pool.rewrite(request, endpoint))
+            except httpx.TransportError as e:
+                self.pool.release(endpoint, False, "error")
+                last_error = e
+                logger.warning(f"端点 {endpoint.name} 请求失败: {e!r}")
+                continue
+            if _failed(response) and len(tried) < len(self.pool.endpoints):
+                response.close()
+                self.pool.release(endpoint, False, str(response.status_code))
+                logger.warning(f"端点 {endpoint.name} 返回 {response.status_code}，改发到其他端点")
+                continue
+            return self._track(endpoint, request, response)
+
+    async def handle_async_request(self, request):
+        tried = []
+        while True:
+            endpoint, delay = self.pool.acquire(tried)
+            if endpoint is None and delay is not None:
+                await asyncio.sleep(delay)
+                continue
+            if endpoint is None:
+                raise last_error
+            if tried:
+                LLM_ENDPOINT_FAILOVERS.inc(endpoint=endpoint.name)
+            tried.append(endpoint)
+            try:
+                response = await self.pool.async_transport().handle_async_request(self.pool.rewrite(request, endpoint))
+            except asyncio.CancelledError:
+                self.pool.release(endpoint, None, "cancelled")
+                raise
+            except httpx.TransportError as e:
+                self.pool.release(endpoint, False, "error")
+                last_error = e
+                logger.warning(f"端点 {endpoint.name} 请求失败: {e!r}")
+                continue
+            if _failed(response) and len(tried) < len(self.pool.endpoints):
+                await response.aclose()
+                self.pool.release(endpoint, False, str(response.status_code))
+                logger.warning(f"端点 {endpoint.name} 返回 {response.status_code}，改发到其他端点")
+                continue
+            return self._track(endpoint, request, response)
@@ -2,58 +2,108 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse
 
-from web import router as chat_router
+from web import router as chat_router, prune_job_outputs
+from monitor.logs import setup_logging
+from monitor.metrics import render_metrics, set_model_price
+from llm.replay import configure_from_args
+from llm.dedup import configure_dedup
+from llm.routing import configure_routes_from_args
+from llm.pool import configure_pool_from_args
+from llm.scheduler import configure_scheduler_from_args
+from filereader.cache import configure_doc_cache_from_args
+from pipeline.spill import configure_spill_from_args
+from pipeline.results import configure_retention_from_args
+from contextlib import asynccontextmanager
 import argparse
 import os
-import logging
+import shlex
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description="WebUI for Text Error Correction")
     parser.add_argument("--model_name", type=str, default="qwen-plus", help="Model name")
     parser.add_argument("--base_url", type=str, default="https://dashscope.aliyuncs.com/compatible-mode/v1", help="Base URL")
+    parser.add_argument("--endpoints", type=str, default=None, help="Pool of model endpoints and keys replacing --base_url, a JSON file or JSON string, see README")
+    parser.add_argument("--endpoint_failure_threshold", type=int, default=3, help="Consecutive failures after which a pooled endpoint is taken out of rotation")
+    parser.add_argument("--endpoint_cooldown", type=float, default=30.0, help="Seconds before a tripped endpoint receives a probe request")
     parser.add_argument("--log_dir", type=str, default="./logs", help="Output path")
-    args = parser.parse_args()
+    parser.add_argument("--log_level", type=str, default="INFO", help="Log level of the main log file")
+    parser.add_argument("--log_max_length", type=int, default=512, help="Max characters per log message, longer messages are truncated")
+    parser.add_argument("--log_sample_rate", type=float, default=1.0, help="Sampling rate of per-chunk/per-entity logs")
+    parser.add_argument("--log_trace", action="store_true", help="Write full payloads to a rotating trace.log")
+    parser.add_argument("--log_trace_max_mb", type=int, default=50, help="Rotation size of trace.log in MB")
+    parser.add_argument("--prescreen_threshold", type=float, default=0.0, help="Only grammar chunks whose local pre-screen score reaches this value are sent to the LLM, 0 disables the pre-screen")
+    parser.add_argument("--prescreen_lm", type=str, default=None, help="Optional character bigram model for the pre-screen, built with prescreen.py --build_lm")
+    parser.add_argument("--grammar_output", type=str, default="full", choices=["full", "edits"], help="Grammar check output: the full corrected text, or only edit operations applied locally")
+    parser.add_argument("--correct_output", type=str, default="full", choices=["full", "spans"], help="Consistency correction output: the full marked chunk, or only the spans to mark applied locally")
+    parser.add_argument("--dedup_cache_size", type=int, default=4096, help="Grammar/correction results kept for deduplicating repeated chunks and sentences, 0 disables deduplication")
+    parser.add_argument("--shard_chunks", type=int, default=0, help="Split documents into shards of this many 1024-char chunks, extracted concurrently and reconciled, 0 disables sharding")
+    parser.add_argument("--shard_concurrency", type=int, default=4, help="Shards processed at the same time in sharded mode")
+    parser.add_argument("--doc_cache_mb", type=float, default=64.0, help="Memory for parsed documents and chunk boundaries keyed by content hash, 0 disables the memory tier")
+    parser.add_argument("--doc_cache_disk_mb", type=float, default=0.0, help="Disk space for parsed documents, least recently used files are evicted beyond it, 0 disables the disk tier")
+    parser.add_argument("--doc_cache_dir", type=str, default=None, help="Directory of the parsed document disk cache, defaults to {log_dir}/doc_cache")
+    parser.add_argument("--spill_budget_mb", type=float, default=0.0, help="Memory budget in MB for intermediate results, beyond which they are written to disk, 0 keeps everything in memory")
+    parser.add_argument("--spill_dir", type=str, default=None, help="Directory for spilled intermediate results, defaults to {log_dir}/spill")
+    parser.add_argument("--job_retention_hours", type=float, default=168.0, help="Hours that result and trace files of finished jobs are kept, 0 keeps them regardless of age")
+    parser.add_argument("--job_retention_count", type=int, default=1000, help="Finished jobs whose result and trace files are kept, older ones are deleted, 0 means unlimited")
+    parser.add_argument("--model_routes", type=str, default=None, help="Per-stage model routing, a JSON file or JSON string, see README")
+    parser.add_argument("--max_jobs", type=int, default=0, help="Detection jobs run at the same time, later jobs wait in a queue, 0 means unlimited")
+    parser.add_argument("--llm_concurrency", type=int, default=0, help="LLM calls in flight across all jobs, queued fairly per client, 0 means unlimited")
+    parser.add_argument("--short_job_chars", type=int, default=20000, help="Interactive jobs up to this size are scheduled ahead of longer ones")
+    parser.add_argument("--ws_queue_size", type=int, default=256, help="Outbound websocket frames queued per connection before log/progress frames are dropped")
+    parser.add_argument("--prompt_price", type=float, default=0.0, help="Price per 1k prompt tokens, used for cost metrics")
+    parser.add_argument("--completion_price", type=float, default=0.0, help="Price per 1k completion tokens, used for cost metrics")
+    parser.add_argument("--record", type=str, default=None, help="Record every LLM request/response to this .jsonl.gz file")
+    parser.add_argument("--replay", type=str, default=None, help="Serve LLM responses offline from a recorded .jsonl.gz file")
+    parser.add_argument("--replay_latency", type=str, default="original", choices=["original", "zero"], help="Replay with the recorded latency or immediately")
+    parser.add_argument("--warmup", action="store_true", help="Build all chains and open a connection to the model server before serving requests")
+    args = parser.parse_args(argv)
     return args
 
 def logging_config(args):
-    # 日志文件路径
-    log_dir = args.log_dir
-    os.makedirs(log_dir, exist_ok=True)
-    log_file = os.path.join(log_dir, "consistency_check.log")
-
-    # 配置 logging
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)  # 可设置为 DEBUG/INFO 等
-
-    # 控制台 Handler
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_formatter = logging.Formatter("[%(levelname)s] %(message)s")
-    console_handler.setFormatter(console_formatter)
-
-    # 文件 Handler
-    file_handler = logging.FileHandler(log_file, encoding="utf-8")
-    file_handler.setLevel(logging.DEBUG)
-    file_formatter = logging.Formatter(
-        "%(asctime)s [%(levelname)s] %(filename)s:%(lineno)d - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S"
+    # 异步日志：主日志截断+采样，完整载荷按需写入滚动trace文件
+    logger = setup_logging(
+        args.log_dir,
+        "consistency_check.log",
+        level=args.log_level,
+        max_length=args.log_max_length,
+        sample_rate=args.log_sample_rate,
+        trace=args.log_trace,
+        trace_max_bytes=args.log_trace_max_mb * 1024 * 1024,
     )
-    file_handler.setFormatter(file_formatter)
-
-    # 添加 Handler
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
     return logger
 
-def create_app() -> FastAPI:
-    args = parse_args()
+def create_app(args=None) -> FastAPI:
+    """
+    应用工厂，导入本模块不会解析命令行或创建应用。
+    :param args: 启动参数，为None时从环境变量 TEXTGUARD_ARGS 解析（供 uvicorn --factory 使用）
+    """
+    if args is None:
+        args = parse_args(shlex.split(os.getenv("TEXTGUARD_ARGS", "")))
     logger = logging_config(args)
 
     logger.info("启动一致性检测服务")
     logger.info(f"模型配置加载完成: model={args.model_name}")
+    configure_from_args(args)
+    configure_dedup(args.dedup_cache_size)
+    configure_routes_from_args(args)
+    configure_pool_from_args(args)
+    configure_spill_from_args(args)
+    configure_doc_cache_from_args(args)
+    configure_scheduler_from_args(args)
+    configure_retention_from_args(args)
+    # 清理上次运行遗留的过期任务文件
+    prune_job_outputs(args.log_dir)
 
-    app = FastAPI(title="文本一致性检测系统", version="0.1.0")
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if args.warmup:
+            from llm.model import warmup
+            await warmup(args.model_name, args.base_url, logger)
+        yield
+
+    app = FastAPI(title="文本一致性检测系统", version="0.1.0", lifespan=lifespan)
 
     # 全局状态挂载
     app.state.logger = logger
@@ -69,9 +119,23 @@ def create_app() -> FastAPI:
     )
 
     app.include_router(chat_router)
+
+    # Prometheus 指标
+    set_model_price(args.model_name, args.prompt_price, args.completion_price)
+
+    async def metrics():
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+    app.add_api_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
     # 挂载静态文件目录
     app.mount("/", StaticFiles(directory="frontend/static", html=True), name="static")
     logger.info("FastAPI 初始化完成")
     return app
 
-app = create_app()
+def __getattr__(name):
+    # 兼容 `uvicorn main:app`：首次访问时才创建应用
+    global app
+    if name == "app":
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,5 @@
+__all__ = [
+    "logs",
+    "metrics",
+    "tracing",
+]
@@ -0,0 +1,211 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import reprlib
+
+# 完整载荷日志（opt-in），与主日志分开写入独立的滚动文件
+TRACE_LOGGER_NAME = "textguard.trace"
+
+_listeners = []
+
+# 热点载荷在主日志中的格式化方式，由 setup_logging 按 max_length 设置
+_payload_repr = reprlib.Repr()
+_payload_repr.maxlevel = 4
+_payload_repr.maxlist = _payload_repr.maxtuple = _payload_repr.maxset = _payload_repr.maxdict = 16
+_payload_repr.maxstring = _payload_repr.maxother = 512
+
+
+def truncate(text, max_length: int = 512) -> str:
+    """
+    截断过长的日志内容，保留长度信息。
+    :param text: 日志内容
+    :param max_length: 最大保留字符数
+    :return: 截断后的文本
+    """
+    text = str(text)
+    if max_length <= 0 or len(text) <= max_length:
+        return text
+    return f"{text[:max_length]}...(共{len(text)}字符)"
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化JSON日志，每条记录一行，message超长时截断"""
+    def __init__(self, max_length: int = 512):
+        super().__init__(datefmt="%Y-%m-%d %H:%M:%S")
+        self.max_length = max_length
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "location": f"{record.filename}:{record.lineno}",
+            "message": truncate(record.getMessage(), self.max_length),
+        }
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            data["payload"] = payload
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TruncatingFormatter(logging.Formatter):
+    """普通文本日志，message超长时截断"""
+    def __init__(self, fmt=None, datefmt=None, max_length: int = 512):
+        super().__init__(fmt, datefmt)
+        self.max_length = max_length
+
+    def formatMessage(self, record):
+        record.message = truncate(record.message, self.max_length)
+        return super().formatMessage(record)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    对标记了 sample 的热点日志按比例采样，WARNING及以上级别始终保留
+    """
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not getattr(record, "sample", False):
+            return True
+        return self.rate >= 1.0 or random.random() < self.rate
+
+
+class _BoundedPayload:
+    """
+    主日志中的载荷参数：只在记录通过采样、真正格式化时才转为字符串，
+    并且只展开有限的层级、条目与字符数，不构造完整的 str(payload)
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        if _payload_repr.maxstring <= 0:
+            return str(self.value)
+        if isinstance(self.value, str):
+            return truncate(self.value, _payload_repr.maxstring)
+        return _payload_repr.repr(self.value)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """入队前只合并message参数，异常堆栈单独保留，不在调用线程做格式化"""
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _start_listener(logger, handlers, sample_rate=1.0):
+    """在logger上安装QueueHandler，由后台线程完成实际的格式化与文件写入"""
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    if sample_rate < 1.0:
+        queue_handler.addFilter(SamplingFilter(sample_rate))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    logger.addHandler(queue_handler)
+    _listeners.append(listener)
+    return listener
+
+
+def stop_logging():
+    """停止后台日志线程，并把队列中剩余的日志写完"""
+    while _listeners:
+        _listeners.pop().stop()
+
+
+atexit.register(stop_logging)
+
+
+def setup_logging(log_dir: str, log_file: str = "consistency_check.log", **kwargs):
+    """
+    配置异步日志：调用线程只负责入队，控制台与文件输出在后台线程完成。
+    :param log_dir: 日志目录
+    :param log_file: 主日志文件名
+    :param level: 主日志级别，默认 INFO
+    :param max_length: 单条日志 message 最大字符数，超出截断
+    :param sample_rate: 热点日志采样率 (0, 1]
+    :param trace: 是否额外写入完整载荷的trace文件
+    :param trace_max_bytes: trace文件滚动大小
+    :param trace_backup_count: trace文件保留份数
+    :return: root logger
+    """
+    level = kwargs.get("level", "INFO")
+    max_length = kwargs.get("max_length", 512)
+    sample_rate = kwargs.get("sample_rate", 1.0)
+
+    os.makedirs(log_dir, exist_ok=True)
+    stop_logging()
+    # max_length 为0时不截断，载荷完整输出
+    _payload_repr.maxstring = _payload_repr.maxother = max_length
+
+    # 配置 logging
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+
+    # 控制台 Handler
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(TruncatingFormatter("[%(levelname)s] %(message)s", max_length=max_length))
+
+    # 文件 Handler，结构化JSON
+    file_handler = logging.FileHandler(os.path.join(log_dir, log_file), encoding="utf-8")
+    file_handler.setLevel(level)
+    file_handler.setFormatter(JsonFormatter(max_length=max_length))
+    _start_listener(logger, [console_handler, file_handler], sample_rate)
+
+    # 完整载荷 trace 文件，按大小滚动
+    trace_logger = logging.getLogger(TRACE_LOGGER_NAME)
+    trace_logger.propagate = False
+    for handler in list(trace_logger.handlers):
+        trace_logger.removeHandler(handler)
+    if kwargs.get("trace", False):
+        trace_logger.setLevel(logging.DEBUG)
+        trace_handler = logging.handlers.RotatingFileHandler(
+            os.path.join(log_dir, "trace.log"),
+            maxBytes=kwargs.get("trace_max_bytes", 50 * 1024 * 1024),
+            backupCount=kwargs.get("trace_backup_count", 3),
+            encoding="utf-8",
+        )
+        trace_handler.setFormatter(JsonFormatter(max_length=0))
+        _start_listener(trace_logger, [trace_handler])
+    else:
+        trace_logger.setLevel(logging.CRITICAL + 1)
+    return logger
+
+
+def log_payload(logger, message: str, payload, level=logging.INFO):
+    """
+    热点路径日志：主日志只记录截断后的内容并参与采样，载荷在采样之后按有限长度格式化，
+    被采样丢弃的记录不会格式化载荷；开启trace时完整内容写入trace文件。
+    :param logger: 主日志logger
+    :param message: 日志说明
+    :param payload: 日志载荷（实体列表、修正文本、检查结果等）
+    :param level: 主日志级别
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, "%s: %s", message, _BoundedPayload(payload), extra={"sample": True}, stacklevel=2)
+    trace_logger = logging.getLogger(TRACE_LOGGER_NAME)
+    if trace_logger.isEnabledFor(logging.DEBUG):
+        trace_logger.debug(message, extra={"payload": payload}, stacklevel=2)
@@ -0,0 +1,246 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from .tracing import span
+
+# 当前正在执行的pipeline阶段，供LLM回调/重试计数等无法直接传参的位置打标签
+current_stage = contextvars.ContextVar("current_stage", default="unknown")
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float("inf"))
+
+
+def _label_str(labels) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels:
+        v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((k, labels.get(k, "")) for k in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_str(key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, c in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_label_str(key + (('le', _format_value(bound)),))} {c}")
+                lines.append(f"{self.name}_sum{_label_str(key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_label_str(key)} {count}")
+        return lines
+
+
+REGISTRY = []
+
+
+def _register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+# pipeline 阶段
+STAGE_DURATION = _register(Histogram(
+    "textguard_stage_duration_seconds", "Duration of pipeline stage steps", ("pipeline", "stage")))
+STAGE_IN_PROGRESS = _register(Gauge(
+    "textguard_stage_in_progress", "Pipeline stage steps currently running", ("pipeline", "stage")))
+
+# LLM 调用
+LLM_DURATION = _register(Histogram(
+    "textguard_llm_request_duration_seconds", "Latency of LLM calls", ("stage", "model")))
+LLM_REQUESTS = _register(Counter(
+    "textguard_llm_requests_total", "LLM calls by final status", ("stage", "model", "status")))
+LLM_IN_FLIGHT = _register(Gauge(
+    "textguard_llm_in_flight", "LLM calls currently in flight", ("stage",)))
+LLM_PROMPT_TOKENS = _register(Counter(
+    "textguard_llm_prompt_tokens_total", "Prompt tokens consumed", ("stage", "model")))
+LLM_CACHED_PROMPT_TOKENS = _register(Counter(
+    "textguard_llm_cached_prompt_tokens_total", "Prompt tokens served from the provider prefix cache", ("stage", "model")))
+LLM_COMPLETION_TOKENS = _register(Counter(
+    "textguard_llm_completion_tokens_total", "Completion tokens generated", ("stage", "model")))
+LLM_COST = _register(Counter(
+    "textguard_llm_cost_total", "Estimated LLM cost from the configured price table", ("stage", "model")))
+LLM_RETRIES = _register(Counter(
+    "textguard_llm_retries_total", "LLM HTTP retries performed by the client", ("stage",)))
+LLM_ESCALATIONS = _register(Counter(
+    "textguard_llm_escalations_total", "Calls re-run on the escalation model after unusable small-model output", ("stage", "reason")))
+
+# 模型服务连接池
+LLM_ENDPOINT_REQUESTS = _register(Counter(
+    "textguard_llm_endpoint_requests_total", "HTTP requests sent to each pooled endpoint by status", ("endpoint", "status")))
+LLM_ENDPOINT_OUTSTANDING = _register(Gauge(
+    "textguard_llm_endpoint_outstanding", "Requests in flight on each pooled endpoint", ("endpoint",)))
+LLM_ENDPOINT_CIRCUIT = _register(Gauge(
+    "textguard_llm_endpoint_circuit", "Circuit breaker state of each pooled endpoint, 0 closed, 1 open, 2 half-open", ("endpoint",)))
+LLM_ENDPOINT_FAILOVERS = _register(Counter(
+    "textguard_llm_endpoint_failovers_total", "Failed requests re-sent to another pooled endpoint, by the endpoint that took over", ("endpoint",)))
+
+# 语法预筛
+PRESCREEN_CHUNKS = _register(Counter(
+    "textguard_prescreen_chunks_total", "Grammar chunks by local pre-screen decision", ("result",)))
+GRAMMAR_EDITS = _register(Counter(
+    "textguard_grammar_edits_total", "Grammar chunks checked in edit-operation mode by outcome", ("result",)))
+CORRECT_SPANS = _register(Counter(
+    "textguard_correct_spans_total", "Chunks corrected in span-annotation mode by outcome", ("result",)))
+
+# 缓存
+CACHE_HITS = _register(Counter(
+    "textguard_cache_hits_total", "Cache hits", ("cache",)))
+CACHE_MISSES = _register(Counter(
+    "textguard_cache_misses_total", "Cache misses", ("cache",)))
+DOC_CACHE_DISK_BYTES = _register(Gauge(
+    "textguard_doc_cache_disk_bytes", "Bytes of parsed documents in the on-disk cache"))
+
+# websocket 发送队列
+WS_QUEUE_DEPTH = _register(Gauge(
+    "textguard_ws_queue_depth", "Frames waiting in websocket outbound queues"))
+WS_DROPPED_FRAMES = _register(Counter(
+    "textguard_ws_dropped_frames_total", "Low-priority websocket frames dropped under backpressure", ("kind",)))
+WS_COALESCED_FRAMES = _register(Counter(
+    "textguard_ws_coalesced_frames_total", "Websocket frames merged into a queued frame", ("kind",)))
+
+# 中间结果落盘
+SPILL_BYTES = _register(Counter(
+    "textguard_spill_bytes_total", "Bytes of intermediate results written to disk under the memory budget"))
+SPILLED_ITEMS = _register(Counter(
+    "textguard_spilled_items_total", "Intermediate results written to disk under the memory budget"))
+SPILL_MEMORY_BYTES = _register(Gauge(
+    "textguard_spill_memory_bytes", "Estimated bytes of intermediate results held in memory"))
+
+# 调度器
+SCHEDULER_QUEUE_WAIT = _register(Histogram(
+    "textguard_scheduler_queue_wait_seconds", "Time jobs and LLM calls waited for a scheduler slot", ("queue", "priority")))
+SCHEDULER_QUEUED = _register(Gauge(
+    "textguard_scheduler_queued", "Jobs and LLM calls waiting for a scheduler slot", ("queue", "priority")))
+SCHEDULER_ACTIVE = _register(Gauge(
+    "textguard_scheduler_active", "Scheduler slots currently held", ("queue",)))
+
+# 模型单价表：model -> (每千prompt token价格, 每千completion token价格)
+PRICES = {}
+
+
+def set_model_price(model: str, prompt_per_1k: float, completion_per_1k: float):
+    PRICES[model] = (prompt_per_1k, completion_per_1k)
+
+
+def record_llm_usage(stage: str, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0):
+    """
+    记录一次LLM调用的token用量与估算费用
+    :param cached_tokens: prompt_tokens中命中前缀缓存的部分
+    """
+    LLM_PROMPT_TOKENS.inc(prompt_tokens, stage=stage, model=model)
+    LLM_CACHED_PROMPT_TOKENS.inc(cached_tokens, stage=stage, model=model)
+    LLM_COMPLETION_TOKENS.inc(completion_tokens, stage=stage, model=model)
+    if model in PRICES:
+        LLM_COST.inc(estimate_cost(model, prompt_tokens, completion_tokens), stage=stage, model=model)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """按单价表估算费用，未配置单价的模型为0"""
+    prompt_price, completion_price = PRICES.get(model, (0.0, 0.0))
+    return prompt_tokens / 1000 * prompt_price + completion_tokens / 1000 * completion_price
+
+
+@contextmanager
+def stage_timer(pipeline: str, stage: str, **attributes):
+    """
+    记录一个pipeline阶段步骤的耗时与并发数，存在活动trace时同时记录为span。
+    :param pipeline: pipeline名称，consistency/grammar
+    :param stage: 阶段名称，例如 parse/chunk/extract/summary/check/correct
+    :param attributes: span属性，例如 chunk.index、entity.id
+    """
+    token = current_stage.set(stage)
+    STAGE_IN_PROGRESS.inc(pipeline=pipeline, stage=stage)
+    start = time.perf_counter()
+    try:
+        with span(stage, pipeline=pipeline, **attributes) as s:
+            yield s
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, pipeline=pipeline, stage=stage)
+        STAGE_IN_PROGRESS.dec(pipeline=pipeline, stage=stage)
+        current_stage.reset(token)
+
+
+def render_metrics() -> str:
+    """以Prometheus文本格式输出所有指标"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
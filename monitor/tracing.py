@@ -0,0 +1,152 @@
+import contextvars
+import json
+import os
+import secrets
+import time
+from contextlib import contextmanager
+
+# 当前上下文中的span，子span以其为父节点
+current_span = contextvars.ContextVar("current_span", default=None)
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items()]
+
+
+class Span:
+    def __init__(self, tracer, name: str, parent=None, kind=SPAN_KIND_INTERNAL, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else ""
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = (STATUS_OK, "")
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def add(self, key: str, amount):
+        """累加数值型属性，例如token用量、重试次数"""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def end(self, error: BaseException | None = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.status = (STATUS_ERROR, f"{type(error).__name__}: {error}")
+
+    def to_otlp(self):
+        data = {
+            "traceId": self.tracer.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": self.status[0], "message": self.status[1]},
+        }
+        if self.parent_id:
+            data["parentSpanId"] = self.parent_id
+        return data
+
+
+class Tracer:
+    """
+    单个任务的trace，记录span树并导出为OpenTelemetry (OTLP JSON) 格式
+    """
+    def __init__(self, job_id: str, service_name: str = "textguard"):
+        self.job_id = job_id
+        self.service_name = service_name
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+
+    def start_span(self, name: str, parent=None, kind=SPAN_KIND_INTERNAL, attributes=None) -> Span:
+        span = Span(self, name, parent, kind, attributes)
+        self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = self.start_span(name, current_span.get(), attributes=attributes)
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(e)
+            raise
+        finally:
+            span.end()
+            current_span.reset(token)
+
+    def to_otlp(self):
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes({
+                    "service.name": self.service_name,
+                    "job.id": self.job_id,
+                })},
+                "scopeSpans": [{
+                    "scope": {"name": "textguard"},
+                    "spans": [span.to_otlp() for span in self.spans],
+                }],
+            }]
+        }
+
+    def export(self, log_dir: str) -> str:
+        """写入 {log_dir}/traces/{job_id}.json，返回文件路径"""
+        path = trace_path(log_dir, self.job_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_otlp(), f, ensure_ascii=False)
+        return path
+
+
+def trace_path(log_dir: str, job_id: str) -> str:
+    return os.path.join(log_dir, "traces", f"{job_id}.json")
+
+
+@contextmanager
+def start_trace(job_id: str, name: str, **attributes):
+    """
+    开启一个任务的trace，根span覆盖整个with代码块。
+    :param job_id: 任务ID
+    :param name: 根span名称
+    """
+    tracer = Tracer(job_id)
+    token = current_span.set(None)
+    try:
+        with tracer.span(name, **{"job.id": job_id, **attributes}):
+            yield tracer
+    finally:
+        current_span.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """在当前trace下开启子span，没有活动trace时不做记录"""
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    with parent.tracer.span(name, **attributes) as s:
+        yield s
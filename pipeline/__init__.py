@@ -0,0 +1,6 @@
+__all__ = [
+    "engine",
+    "results",
+    "spill",
+    "stages",
+]
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+
+from monitor.logs import log_payload
+from monitor.metrics import stage_timer
+
+
+class Stage:
+    """
+    pipeline中的一个阶段，声明其输入与输出的名称。
+    :param name: 阶段名称，同时用作指标与trace的标签
+    :param func: async def func(ctx, **inputs)，单输出时直接返回值，多输出时返回dict
+    :param inputs: 依赖的值名称
+    :param outputs: 产出的值名称
+    """
+    def __init__(self, name: str, func, inputs=(), outputs=()):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+
+    def __repr__(self):
+        return f"Stage({self.name}: {self.inputs} -> {self.outputs})"
+
+
+_sync_loop = None
+
+
+def run_sync(coro):
+    """
+    供同步的CLI入口运行pipeline。多次调用共用同一个事件循环，
+    HTTP连接池绑定在事件循环上，asyncio.run 每次新建循环会导致复用的连接失效。
+    """
+    global _sync_loop
+    if _sync_loop is None or _sync_loop.is_closed():
+        _sync_loop = asyncio.new_event_loop()
+    return _sync_loop.run_until_complete(coro)
+
+
+class PipelineContext:
+    """
+    一次pipeline运行的上下文：参数、日志/增量/进度/结果回调与取消令牌。
+    CLI与websocket只需提供不同的回调。
+    """
+    def __init__(self, args, log_callback=None, **kwargs):
+        self.args = args
+        self.log_callback = log_callback
+        self.logger = kwargs.get("logger") or logging.getLogger(__name__)
+        self.cancellation_token = kwargs.get("cancellation_token", None)
+        self.delta_callback = kwargs.get("delta_callback", None)
+        self.progress_callback = kwargs.get("progress_callback", None)
+        self.result_callback = kwargs.get("result_callback", None)
+        self.pipeline = ""
+
+    async def log(self, msg: str, msg_type: str = "log"):
+        if self.log_callback:
+            await self.log_callback(msg, msg_type)
+        self.logger.info(msg)
+
+    async def log_payload(self, msg: str, payload):
+        """逐chunk/逐实体的结果：完整内容发给前端，日志中截断"""
+        if self.log_callback:
+            await self.log_callback(f"{msg}: {payload}")
+        log_payload(self.logger, msg, payload)
+
+    async def check_cancelled(self):
+        if self.cancellation_token and self.cancellation_token.is_set():
+            await self.log("pipeline已终止", "error")
+            raise asyncio.CancelledError("Pipeline terminated by user")
+
+    def on_delta(self, chunk_index: int):
+        """返回第 chunk_index 个chunk的流式增量回调，未设置时为None"""
+        if not self.delta_callback:
+            return None
+        return lambda delta: self.delta_callback(delta, chunk_index)
+
+    async def progress(self, stage: str, status: str, **info):
+        if self.progress_callback:
+            await self.progress_callback(stage, status, **info)
+
+    async def emit_result(self, index: int, result):
+        """最终结果中第 index 条完成时调用，供前端增量显示与保存"""
+        if self.result_callback:
+            await self.result_callback(index, result)
+
+
+class Pipeline:
+    """
+    由Stage组成的DAG。运行时按依赖调度，输入就绪的阶段并发执行，
+    已提供的值不会重复计算，只执行得到targets所需的阶段。
+    """
+    def __init__(self, name: str, stages, targets=(), title: str = ""):
+        self.name = name
+        self.title = title or name
+        self.stages = list(stages)
+        self.targets = tuple(targets)
+        self.producers = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(f"输出 {output} 被多个阶段产出")
+                self.producers[output] = stage
+
+    def plan(self, targets, available):
+        """返回得到targets所需执行的阶段，按声明顺序排列"""
+        needed = set()
+        missing = [t for t in targets if t not in available]
+        while missing:
+            name = missing.pop()
+            stage = self.producers.get(name)
+            if stage is None:
+                raise ValueError(f"缺少输入: {name}")
+            if stage in needed:
+                continue
+            needed.add(stage)
+            missing.extend(i for i in stage.inputs if i not in available)
+        return [s for s in self.stages if s in needed]
+
+    async def run(self, ctx: PipelineContext, targets=None, **inputs):
+        """
+        运行pipeline。
+        :param ctx: 运行上下文
+        :param targets: 需要的输出名称，默认为pipeline声明的targets
+        :param inputs: 初始值，例如 source / text / consistency_results
+        :return: 初始值与targets的dict，其余中间值在不再被需要时释放
+        """
+        ctx.pipeline = self.name
+        values = dict(inputs)
+        targets = targets or self.targets
+        todo = self.plan(targets, values)
+        running = {}
+        await ctx.log(f"开始运行{self.title}pipeline，模型: {ctx.args.model_name}")
+        try:
+            while todo or running:
+                await ctx.check_cancelled()
+                for stage in [s for s in todo if all(i in values for i in s.inputs)]:
+                    todo.remove(stage)
+                    running[asyncio.ensure_future(self._run_stage(ctx, stage, values))] = stage
+                if not running:
+                    raise RuntimeError(f"阶段依赖无法满足: {todo}")
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    running.pop(task)
+                    values.update(task.result())
+                # 释放后续阶段都不再需要的中间值（如全文、逐chunk前文总结），长文档下不必保留到结束
+                needed = set(targets) | set(inputs) | {i for stage in [*todo, *running.values()] for i in stage.inputs}
+                for name in [name for name in values if name not in needed]:
+                    del values[name]
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+        await ctx.log(f"{self.title}pipeline完成")
+        return values
+
+    async def _run_stage(self, ctx: PipelineContext, stage: Stage, values):
+        kwargs = {name: values[name] for name in stage.inputs}
+        await ctx.progress(stage.name, "start")
+        start = time.perf_counter()
+        with stage_timer(self.name, stage.name):
+            result = await stage.func(ctx, **kwargs)
+        if len(stage.outputs) == 1:
+            result = {stage.outputs[0]: result}
+        await ctx.progress(stage.name, "done", seconds=round(time.perf_counter() - start, 3))
+        return result
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def result_path(log_dir: str, job_id: str) -> str:
+    return os.path.join(log_dir, "results", f"{job_id}.jsonl")
+
+
+class JobRetention:
+    """
+    已结束任务的结果文件与trace的保留策略
+    :param max_age_hours: 最长保存时间(小时)，0表示不按时间删除
+    :param max_jobs: 最多保留的任务数，超出时删除最旧的，0表示不按数量删除
+    """
+    def __init__(self, max_age_hours: float = 168.0, max_jobs: int = 1000):
+        self.max_age_hours = max_age_hours
+        self.max_jobs = max_jobs
+
+
+RETENTION = JobRetention()
+
+
+def configure_retention(max_age_hours: float, max_jobs: int):
+    RETENTION.max_age_hours = max_age_hours
+    RETENTION.max_jobs = max_jobs
+
+
+def configure_retention_from_args(args):
+    configure_retention(getattr(args, "job_retention_hours", 168.0), getattr(args, "job_retention_count", 1000))
+
+
+def prune_job_files(directory: str, active=()) -> int:
+    """
+    按保留策略删除目录中已结束任务的文件（文件名以job_id开头）：
+    超过保存时间的全部删除，其余按修改时间只保留最新的 max_jobs 份
+    :param active: 运行中任务的job_id，其文件不删除
+    :return: 删除的文件数
+    """
+    try:
+        entries = [(entry.stat().st_mtime, entry.path) for entry in os.scandir(directory)
+                   if entry.is_file() and entry.name.split(".")[0] not in active]
+    except OSError:
+        return 0
+    entries.sort(reverse=True)
+    expired = []
+    if RETENTION.max_age_hours > 0:
+        deadline = time.time() - RETENTION.max_age_hours * 3600
+        expired = [path for mtime, path in entries if mtime < deadline]
+        entries = [(mtime, path) for mtime, path in entries if mtime >= deadline]
+    if RETENTION.max_jobs > 0:
+        expired += [path for _, path in entries[RETENTION.max_jobs:]]
+    removed = 0
+    for path in expired:
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            continue
+    if removed:
+        logger.info(f"删除 {removed} 个过期的任务文件: {directory}")
+    return removed
+
+
+class ResultLog:
+    """
+    任务结果的追加写日志 {log_dir}/results/{job_id}.jsonl：
+    每个chunk完成时写入一行 {"index": i, "result": ...}，结束时写入一行 {"done": true, "status": ..., "count": n}。
+    任务运行中即可跟随读取，不需要把全部结果序列化成一条消息。
+    """
+    def __init__(self, log_dir: str, job_id: str, pipeline: str):
+        self.job_id = job_id
+        self.pipeline = pipeline
+        self.path = result_path(log_dir, job_id)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._changed = asyncio.Event()
+        self.count = 0
+        self.done = False
+
+    def append(self, index: int, result):
+        self._write({"index": index, "result": result})
+        self.count += 1
+
+    def close(self, status: str = "completed", error: str | None = None):
+        """
+        写入结束行，status 为 completed / cancelled / error
+        :param error: 任务出错时的错误信息，写入结束行的 error 字段
+        """
+        if self.done:
+            return
+        self.done = True
+        record = {"done": True, "status": status, "count": self.count, "pipeline": self.pipeline, "job_id": self.job_id}
+        if error is not None:
+            record["error"] = error
+        try:
+            self._write(record)
+        finally:
+            self._file.close()
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        # 唤醒正在跟随读取的请求
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self):
+        await self._changed.wait()
+
+
+async def follow_results(path: str, result_log: ResultLog | None = None):
+    """
+    逐行产出结果文件的NDJSON，任务仍在运行时等待新的结果
+    :param result_log: 运行中任务的ResultLog，已结束的任务为None
+    """
+    with open(path, "rb") as f:
+        while True:
+            line = f.readline()
+            if line.endswith(b"\n"):
+                yield line
+                continue
+            if result_log is None or result_log.done:
+                break
+            # 读到文件末尾（或写了一半的行），等待下一条结果
+            f.seek(-len(line), os.SEEK_CUR)
+            await result_log.wait()
@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import uuid
+import weakref
+
+from monitor.metrics import SPILL_BYTES, SPILLED_ITEMS, SPILL_MEMORY_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+class SpillBudget:
+    """
+    进程内所有SpillList驻留内存的字节数（按JSON序列化后的长度估算）。
+    超出预算时，新增结果的SpillList把自己驻留内存的条目写入磁盘
+    :param max_bytes: 内存预算，0表示不落盘
+    """
+    def __init__(self, max_bytes: int = 0, directory: str = "./logs/spill"):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.used = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def add(self, size: int):
+        self.used += size
+        SPILL_MEMORY_BYTES.set(self.used)
+
+
+BUDGET = SpillBudget()
+
+
+def configure_spill(budget_mb: float, directory: str):
+    """
+    设置中间结果的内存预算
+    :param budget_mb: 预算(MB)，0表示所有中间结果保留在内存中
+    :param directory: 落盘文件目录，每个SpillList一个JSONL文件，对象释放或进程退出时删除
+    """
+    BUDGET.max_bytes = int(budget_mb * 1024 * 1024)
+    BUDGET.directory = directory
+    if BUDGET.enabled:
+        logger.info(f"中间结果内存预算 {budget_mb}MB，超出时写入 {directory}")
+
+
+def configure_spill_from_args(args):
+    configure_spill(getattr(args, "spill_budget_mb", 0.0), getattr(args, "spill_dir", None) or os.path.join(args.log_dir, "spill"))
+
+
+def _remove(file, path):
+    file.close()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class SpillList:
+    """
+    按序号存取的结果列表，条目先保留在内存中，超出内存预算时追加写入JSONL文件，读取时按偏移量逐条读回。
+    只支持pipeline需要的操作：append / extend / 按序号读写 / 迭代 / len
+    :param size: 初始长度，未写入的位置为None
+    :param name: 文件名前缀，便于排查
+    """
+    def __init__(self, size: int = 0, name: str = "spill"):
+        self.name = name
+        self._size = size
+        self._memory = {}  # index -> (value, bytes)
+        self._offsets = {}  # index -> 在文件中的偏移量
+        self._file = None
+        self.path = None
+
+    def __len__(self):
+        return self._size
+
+    def append(self, value):
+        self._size += 1
+        self[self._size - 1] = value
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def __setitem__(self, index: int, value):
+        index = self._index(index)
+        line = json.dumps(value, ensure_ascii=False)
+        self._discard(index)
+        self._memory[index] = (value, len(line.encode("utf-8")))
+        BUDGET.add(self._memory[index][1])
+        if BUDGET.enabled and BUDGET.used > BUDGET.max_bytes:
+            self.spill()
+
+    def __getitem__(self, index: int):
+        index = self._index(index)
+        if index in self._memory:
+            return self._memory[index][0]
+        if index in self._offsets:
+            self._file.flush()
+            self._file.seek(self._offsets[index])
+            return json.loads(self._file.readline())
+        return None
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield self[i]
+
+    def _index(self, index: int) -> int:
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError(f"{self.name} 序号越界: {index}")
+        return index
+
+    def _discard(self, index: int):
+        if index in self._memory:
+            BUDGET.add(-self._memory.pop(index)[1])
+        self._offsets.pop(index, None)
+
+    def spill(self):
+        """将驻留内存的条目全部写入文件"""
+        if not self._memory:
+            return
+        if self._file is None:
+            os.makedirs(BUDGET.directory, exist_ok=True)
+            self.path = os.path.join(BUDGET.directory, f"{self.name}-{uuid.uuid4().hex}.jsonl")
+            # 追加模式下写入总在文件末尾，读取时可以任意seek
+            self._file = open(self.path, "a+b")
+            weakref.finalize(self, _remove, self._file, self.path)
+        self._file.seek(0, os.SEEK_END)
+        written = 0
+        for index, (value, size) in sorted(self._memory.items()):
+            self._offsets[index] = self._file.tell()
+            self._file.write(json.dumps(value, ensure_ascii=False).encode("utf-8") + b"\n")
+            written += size
+        BUDGET.add(-written)
+        SPILL_BYTES.inc(written)
+        SPILLED_ITEMS.inc(len(self._memory))
+        self._memory.clear()
+
+    def __del__(self):
+        BUDGET.add(-sum(size for _, size in self._memory.values()))
+
+
+def result_list(size: int = 0, name: str = "spill"):
+    """未设置内存预算时返回普通list，否则返回SpillList"""
+    if not BUDGET.enabled:
+        return [None] * size
+    return SpillList(size, name)
+
+
+def dump_json(items, f):
+    """
+    逐条写出结果列表，格式与 json.dump(items, f, ensure_ascii=False, indent=4) 相同，
+    SpillList不需要整体读回内存
+    """
+    first = True
+    for item in items:
+        f.write("[\n    " if first else ",\n    ")
+        f.write(json.dumps(item, ensure_ascii=False, indent=4).replace("\n", "\n    "))
+        first = False
+    f.write("[]" if first else "\n]")
@@ -0,0 +1,351 @@
+from llm.model import get_grammar_check_chain, get_grammar_edit_chain, get_entity_extract_chain, get_entity_consistency_check_chain, get_memory_summary_chain, get_consistency_correct_chain, get_consistency_span_chain, astream_content, release_memory
+from llm.dedup import DEDUP, context_key, split_sentences
+from llm.routing import route_models
+from llm.entity import EntityStore, aextract_entities, asummarize_entity_memory, acheck_entity_consistency
+from llm.edits import acheck_grammar_edits
+from llm.spans import acorrect_spans
+from filereader.reader import chunking, get_text_from_input, extract_text_from_path
+from filereader.cache import cached_chunking
+from monitor.metrics import PRESCREEN_CHUNKS, CACHE_HITS
+from monitor.tracing import span
+from prescreen import get_prescreener
+from .engine import Stage, Pipeline, PipelineContext
+from .spill import result_list
+
+import asyncio
+import json
+import uuid
+
+
+class EmptyDocumentError(ValueError):
+    """输入中没有可检测的文本"""
+
+
+async def parse_document(ctx, source: dict):
+    """
+    解析输入文档，解析在线程池中进行，不阻塞其他任务
+    :param source: {"path": 文档路径} 或 {"message": 文本, "file": UploadFile}
+    """
+    if source.get("path"):
+        ctx.logger.info(f"读取文档: {source['path']}")
+        text = await asyncio.to_thread(extract_text_from_path, source["path"])
+    else:
+        text = await asyncio.to_thread(get_text_from_input, source.get("message"), source.get("file"))
+    if not text.strip():
+        raise EmptyDocumentError("未提供消息或文件")
+    await ctx.log(f"文本长度: {len(text)}")
+    return text
+
+
+def chunk_stage(chunk_size: int):
+    async def chunk_text(ctx, text: str):
+        # chunk边界按文本哈希缓存，重复上传的文档无需重新切分
+        return cached_chunking(text, chunk_size, lambda text, size: chunking(text, chunk_size=size))
+    return chunk_text
+
+
+async def plan_shards(ctx, chunks):
+    """
+    将文档按 --shard_chunks 个chunk一组划分为分片，返回每个分片的 (起始chunk, 结束chunk)。
+    未开启分片或文档不超过一个分片时，整篇文档为一个分片。
+    """
+    shard_chunks = getattr(ctx.args, "shard_chunks", 0)
+    if shard_chunks <= 0 or len(chunks) <= shard_chunks:
+        return [(0, len(chunks))]
+    shards = [(start, min(start + shard_chunks, len(chunks))) for start in range(0, len(chunks), shard_chunks)]
+    await ctx.log(f"文档共 {len(chunks)} 个chunk，分为 {len(shards)} 个分片")
+    return shards
+
+
+async def gather_shards(ctx, func, items):
+    """
+    并发处理各分片，同时运行的数量不超过 --shard_concurrency
+    :param func: async def func(index, item)
+    :param items: 分片列表
+    :return: 各分片的返回值，按分片顺序
+    """
+    semaphore = asyncio.Semaphore(max(1, getattr(ctx.args, "shard_concurrency", 4)))
+
+    async def run(index, item):
+        async with semaphore:
+            return await func(index, item)
+
+    tasks = [asyncio.ensure_future(run(i, item)) for i, item in enumerate(items)]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        # 某个分片失败或任务被取消时，不留下仍在运行的分片
+        for task in tasks:
+            task.cancel()
+
+
+async def summarize_chunks(ctx, chunks, shards):
+    """
+    滚动总结前文要点，memories[i] 为第 i 个chunk之前的前文总结。
+    分片之间互不依赖，每个分片从空的前文总结开始
+    """
+    memory_summary_chain = get_memory_summary_chain(ctx.args.model_name, ctx.args.base_url)
+    memories = result_list(max(1, len(chunks)), "memories")
+
+    async def summarize_shard(shard_index, shard):
+        start, end = shard
+        memory = memories[start] = ""
+        for i in range(start, end - 1):
+            await ctx.check_cancelled()
+            chunk_input = f"前文要点总结:{memory}\n当前输入文本:{chunks[i]}" if memory else chunks[i]
+            with span("summary", chunk_index=i):
+                memory = memories[i + 1] = await asummarize_entity_memory(memory_summary_chain, chunk_input)
+
+    await gather_shards(ctx, summarize_shard, shards)
+    return memories
+
+
+async def extract_chunks(ctx, chunks, memories, shards):
+    """
+    保留上下文逐chunk提取实体，返回EntityStore。
+    多个分片时各分片使用独立的对话记忆与EntityStore并发提取，完成后合并为全文的EntityStore
+    """
+    entity_extract_chain = get_entity_extract_chain(ctx.args.model_name, ctx.args.base_url)
+
+    async def extract_shard(shard_index, shard):
+        start, end = shard
+        ent_store = EntityStore()
+        # 每次运行使用独立的对话记忆，避免并发任务互相污染
+        session_id = str(uuid.uuid4())
+        try:
+            for i in range(start, end):
+                await ctx.check_cancelled()
+
+                chunk_input = f"前文要点总结:{memories[i]}\n当前输入文本:{chunks[i]}" if memories[i] else chunks[i]
+                with span("extract", chunk_index=i):
+                    ents = await aextract_entities(entity_extract_chain, chunk_input, session_id)
+                for ent in ents:
+                    ent_store.add_entity(ent, chunk_index=i)
+                await ctx.log_payload(f"第 {i+1} 个 chunk 提取实体", ents)
+        finally:
+            release_memory(session_id)
+        return ent_store
+
+    shard_stores = await gather_shards(ctx, extract_shard, shards)
+    if len(shard_stores) == 1:
+        ent_store = shard_stores[0]
+    else:
+        ent_store = EntityStore()
+        for shard_index, shard_store in enumerate(shard_stores):
+            ent_store.absorb(shard_store, shard_index)
+        await ctx.log(f"跨分片实体数: {len(ent_store.cross_shard_ids())}")
+    await ctx.log(f"实体总数: {len(ent_store.all_entities())}")
+    return ent_store
+
+
+async def check_entities(ctx, entity_store: EntityStore):
+    """
+    逐实体检查一致性。分片模式下只出现在一个分片中的实体按分片分组，
+    出现在多个分片中的实体合并后单独作为一组做跨分片检查，各组并发执行
+    """
+    entity_consistency_check_chain = get_entity_consistency_check_chain(ctx.args.model_name, ctx.args.base_url)
+    await ctx.log("开始检查实体一致性")
+    entities = entity_store.all_entities()
+    groups = {}
+    cross_shard = entity_store.cross_shard_ids()
+    for ent in entities:
+        shards = entity_store.shards.get(ent.entity_id) or {0}
+        groups.setdefault("cross" if ent.entity_id in cross_shard else min(shards), []).append(ent)
+    positions = {ent.entity_id: i for i, ent in enumerate(entities)}
+    results = result_list(len(entities), "consistency_results")
+
+    async def check_group(group_index, group):
+        for ent in group:
+            await ctx.check_cancelled()
+
+            with span("check", entity_id=ent.entity_id, entity_name=ent.name, cross_shard=ent.entity_id in cross_shard):
+                res = await acheck_entity_consistency(entity_consistency_check_chain, ent)
+            # 记录实体ID，修正阶段据此找到实体出现的chunk
+            res["entity_id"] = ent.entity_id
+            results[positions[ent.entity_id]] = res
+            await ctx.log_payload(f"检查实体 {ent.entity_id} 一致性", res)
+
+    await gather_shards(ctx, check_group, list(groups.values()))
+    await ctx.log("完成检查实体一致性")
+    return results
+
+
+async def route_conflicts(ctx, chunks, entity_store: EntityStore, consistency_results):
+    """按实体出现位置，将冲突结果分配到相关的chunk"""
+    chunk_conflicts = entity_store.route_conflicts(chunks, consistency_results)
+    conflict_count = sum(res.get("has_conflict") is True for res in consistency_results)
+    affected = sum(bool(c) for c in chunk_conflicts)
+    await ctx.log(f"冲突实体数: {conflict_count}，需要修正的chunk数: {affected}/{len(chunks)}")
+    return chunk_conflicts
+
+
+async def correct_chunks(ctx, chunks, chunk_conflicts, shards):
+    """逐chunk修正，多个分片时各分片并发修正，结果按chunk序号发送与返回"""
+    await ctx.log("开始修正实体一致性")
+    consistency_correct_chain = get_consistency_correct_chain(ctx.args.model_name, ctx.args.base_url)
+    res_list = result_list(len(chunks), "corrected")
+    spans_mode = getattr(ctx.args, "correct_output", "full") == "spans"
+    correct_models = route_models("consistency_correct", ctx.args.model_name)
+    if spans_mode:
+        # 模型只返回需要标记的原文片段，在本地插入标记，无法定位时改用完整输出
+        consistency_span_chain = get_consistency_span_chain(ctx.args.model_name, ctx.args.base_url)
+
+    # 对每个chunk进行修正，流式转发增量输出
+    async def correct_shard(shard_index, shard):
+        start, end = shard
+        for i in range(start, end):
+            chunk = chunks[i]
+            await ctx.check_cancelled()
+            on_delta = ctx.on_delta(i)
+            if not chunk_conflicts[i]:
+                # 没有与本chunk相关的冲突，原文即为结果
+                res_list[i] = {
+                    "original_text": chunk,
+                    "corrected_text": chunk
+                }
+                if on_delta:
+                    await on_delta(chunk)
+                await ctx.emit_result(i, res_list[i])
+                continue
+            # 相同冲突下，重复出现的段落（本任务内或并发任务间）只修正一次
+            namespace = f"correct:{context_key(correct_models, chunk_conflicts[i], *(['spans'] if spans_mode else []))}"
+            if spans_mode:
+                call = lambda: acorrect_spans(consistency_span_chain, chunk, chunk_conflicts[i], on_delta, fallback_chain=consistency_correct_chain)
+            else:
+                # 冲突结果在前、原文在后：相邻chunk的冲突往往相同，可共享更长的请求前缀
+                chunk_input = f"实体冲突分析结果:{chunk_conflicts[i]}\n原始文本:{chunk}"
+                call = lambda: astream_content(consistency_correct_chain, {"new_message": chunk_input}, on_delta)
+            with span("correct", chunk_index=i, conflicts=len(chunk_conflicts[i])):
+                res, reused = await DEDUP.run(namespace, chunk, call)
+            if reused and on_delta:
+                await on_delta(res)
+            res_list[i] = {
+                "original_text": chunk,
+                "corrected_text": res
+            }
+            await ctx.emit_result(i, res_list[i])
+            await ctx.log_payload(f"第 {i+1} 个 chunk 段落修正结果", res)
+
+    await gather_shards(ctx, correct_shard, shards)
+    return res_list
+
+
+async def prescreen_chunks(ctx, grammar_chunks):
+    """
+    本地规则预筛，返回每个chunk的 (分数, 命中原因)
+    --prescreen_threshold 为0时所有chunk都送往LLM
+    """
+    threshold = getattr(ctx.args, "prescreen_threshold", 0.0)
+    if threshold <= 0:
+        return [(None, []) for _ in grammar_chunks]
+    screener = get_prescreener(getattr(ctx.args, "prescreen_lm", None))
+    scores = [screener.score(chunk) for chunk in grammar_chunks]
+    suspicious = sum(score >= threshold for score, _ in scores)
+    await ctx.log(f"预筛完成: {suspicious}/{len(grammar_chunks)} 个chunk需要LLM检查")
+    return scores
+
+
+async def check_grammar_chunks(ctx, grammar_chunks, prescreen):
+    grammar_check_chain = get_grammar_check_chain(ctx.args.model_name, ctx.args.base_url)
+    threshold = getattr(ctx.args, "prescreen_threshold", 0.0)
+    # 按阶段路由后实际使用的模型区分结果，--model_routes 改变模型后不会复用其他模型的结果
+    grammar_models = route_models("grammar_check", ctx.args.model_name)
+    namespace = f"grammar:{context_key(grammar_models)}"
+    if getattr(ctx.args, "grammar_output", "full") == "edits":
+        # 模型只输出编辑操作，在本地应用到原文上还原完整结果，无法应用时改用完整输出
+        grammar_edit_chain = get_grammar_edit_chain(ctx.args.model_name, ctx.args.base_url)
+        namespace = f"grammar:{context_key(grammar_models, 'edits')}"
+
+        def check(chunk, on_delta):
+            return acheck_grammar_edits(grammar_edit_chain, chunk, on_delta, fallback_chain=grammar_check_chain)
+    else:
+        def check(chunk, on_delta):
+            return astream_content(grammar_check_chain, {"new_message": chunk}, on_delta)
+    async def checked(chunk, on_delta):
+        # 在去重缓存的调用内校验输出，无法解析的输出直接抛出，不会被缓存并复用给之后的任务
+        result = await check(chunk, on_delta)
+        try:
+            parsed = json.loads(result)
+        except ValueError as e:
+            raise ValueError(f"语法检查输出不是JSON: {e}") from e
+        if not isinstance(parsed, dict):
+            raise ValueError("语法检查输出不是JSON对象")
+        return result
+
+    # 判定为正确的chunk中的句子，再次出现时无需重新检查
+    sentence_namespace = f"grammar_sentence:{context_key(grammar_models)}"
+    # 对每个chunk进行语法检查
+    await ctx.log(f"开始对 {len(grammar_chunks)} 个chunk进行语法检查")
+    grammar_results = result_list(name="grammar_results")
+    for i, chunk in enumerate(grammar_chunks):
+        await ctx.check_cancelled()
+        score, reasons = prescreen[i]
+        if score is not None and score < threshold:
+            # 预筛未发现可疑之处，不调用LLM
+            PRESCREEN_CHUNKS.inc(result="skipped")
+            grammar_results.append({"correct": True, "content": chunk, "reason": "", "original_text": chunk, "prescreen_score": score})
+            await ctx.emit_result(i, grammar_results[-1])
+            continue
+        if score is not None:
+            PRESCREEN_CHUNKS.inc(result="suspicious")
+            ctx.logger.debug(f"第 {i+1} 个 chunk 预筛命中: {reasons}")
+        on_delta = ctx.on_delta(i)
+        sentences = split_sentences(chunk)
+        if sentences and all(DEDUP.get(sentence_namespace, s) for s in sentences):
+            CACHE_HITS.inc(cache="grammar_sentence")
+            result, reused = json.dumps({"correct": True, "content": chunk, "reason": ""}, ensure_ascii=False), True
+        else:
+            with span("grammar", chunk_index=i):
+                result, reused = await DEDUP.run(namespace, chunk, lambda: checked(chunk, on_delta))
+        if reused and on_delta:
+            await on_delta(result)
+        result_dict = json.loads(result)
+        result_dict["original_text"] = chunk
+        if result_dict.get("correct") is True:
+            for sentence in sentences:
+                DEDUP.put(sentence_namespace, sentence, True)
+        grammar_results.append(result_dict)
+        await ctx.emit_result(i, result_dict)
+        await ctx.log_payload(f"第 {i+1} 个 chunk 语法检查结果", result_dict)
+    await ctx.log(f"语法检查完成，共检查 {len(grammar_chunks)} 个chunk")
+    return grammar_results
+
+
+# 一致性检测：parse -> chunk -> shard -> summary -> extract -> check -> route -> correct
+CONSISTENCY_PIPELINE = Pipeline("consistency", [
+    Stage("parse", parse_document, inputs=["source"], outputs=["text"]),
+    Stage("chunk", chunk_stage(1024), inputs=["text"], outputs=["chunks"]),
+    Stage("shard", plan_shards, inputs=["chunks"], outputs=["shards"]),
+    Stage("summary", summarize_chunks, inputs=["chunks", "shards"], outputs=["memories"]),
+    Stage("extract", extract_chunks, inputs=["chunks", "memories", "shards"], outputs=["entity_store"]),
+    Stage("check", check_entities, inputs=["entity_store"], outputs=["consistency_results"]),
+    Stage("route", route_conflicts, inputs=["chunks", "entity_store", "consistency_results"], outputs=["chunk_conflicts"]),
+    Stage("correct", correct_chunks, inputs=["chunks", "chunk_conflicts", "shards"], outputs=["corrected"]),
+], targets=["corrected"], title="一致性检测")
+
+# 语法纠错：parse -> chunk -> prescreen -> grammar
+GRAMMAR_PIPELINE = Pipeline("grammar", [
+    Stage("parse", parse_document, inputs=["source"], outputs=["text"]),
+    Stage("chunk", chunk_stage(128), inputs=["text"], outputs=["grammar_chunks"]),
+    Stage("prescreen", prescreen_chunks, inputs=["grammar_chunks"], outputs=["prescreen"]),
+    Stage("grammar", check_grammar_chunks, inputs=["grammar_chunks", "prescreen"], outputs=["grammar_results"]),
+], targets=["grammar_results"], title="语法纠错")
+
+PIPELINES = {
+    "consistency": CONSISTENCY_PIPELINE,
+    "grammar": GRAMMAR_PIPELINE,
+}
+
+
+async def run_consistency_pipeline(text: str, args, log_callback, **kwargs):
+    """对已解析的文本运行一致性检测pipeline，返回逐chunk修正结果"""
+    ctx = PipelineContext(args, log_callback, **kwargs)
+    values = await CONSISTENCY_PIPELINE.run(ctx, text=text)
+    return values["corrected"]
+
+
+async def run_grammar_pipeline(text: str, args, log_callback, **kwargs):
+    """对已解析的文本运行语法纠错pipeline，返回逐chunk检查结果"""
+    ctx = PipelineContext(args, log_callback, **kwargs)
+    values = await GRAMMAR_PIPELINE.run(ctx, text=text)
+    return values["grammar_results"]
@@ -0,0 +1,197 @@
+from filereader.reader import extract_text_from_path, chunking
+
+import argparse
+import glob
+import json
+import os
+import re
+from collections import Counter
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rule-based grammar pre-screen")
+    parser.add_argument("--docx_data", type=str, default="./dataset/test.docx", help="Document the reference results were produced from")
+    parser.add_argument("--reference", type=str, default="./logs/test/grammar_check_results.json", help="grammar_check_results.json used as labels")
+    parser.add_argument("--thresholds", type=str, default="0,0.5,1,2,3", help="Comma separated thresholds to evaluate")
+    parser.add_argument("--prescreen_lm", type=str, default=None, help="Character bigram model built with --build_lm")
+    parser.add_argument("--build_lm", type=str, default=None, help="Directory or glob of docx/pdf/txt files to build the bigram model from")
+    args = parser.parse_args()
+    return args
+
+# 常见错别字/易混词：错误写法 -> 正确写法
+COMMON_ERRORS = {
+    "既使": "即使", "再接再励": "再接再厉", "迫不急待": "迫不及待", "一愁莫展": "一筹莫展",
+    "按步就班": "按部就班", "金榜提名": "金榜题名", "谈笑风声": "谈笑风生", "走头无路": "走投无路",
+    "悬梁刺骨": "悬梁刺股", "默守成规": "墨守成规", "甘败下风": "甘拜下风", "自抱自弃": "自暴自弃",
+    "心灰意懒": "心灰意冷", "不加思索": "不假思索", "穿流不息": "川流不息", "一股作气": "一鼓作气",
+    "声名雀起": "声名鹊起", "出奇不意": "出其不意", "针贬": "针砭", "脉博": "脉搏",
+    "安祥": "安详", "松驰": "松弛", "辨论": "辩论", "辩别": "辨别", "布署": "部署",
+    "寒喧": "寒暄", "幅射": "辐射", "渡假": "度假", "帐号": "账号", "座落": "坐落",
+    "成份": "成分", "必需要": "必须要", "象征性的": "象征性地", "做为": "作为", "即然": "既然",
+    "截止目前": "截至目前", "截止到": "截至",
+}
+
+# 常见病句搭配
+ERROR_PATTERNS = [
+    (re.compile(r"(大约|大概|约)[^，。；！？]{0,6}左右"), "成分赘余：约数重复"),
+    (re.compile(r"(通过|经过)[^，。；！？]{1,20}，使[^，。；！？]"), "缺少主语：通过……使……"),
+    (re.compile(r"(是否|能否)[^，。；！？]{1,30}(是|在于)[^否]{1,10}(关键|保证|前提)"), "两面对一面"),
+    (re.compile(r"(认真|仔细|努力|高兴|慢慢|悄悄)的(学习|工作|完成|说|走|跑|看|听|思考)"), "的/地误用"),
+    (re.compile(r"(防止|避免|禁止)[^，。；！？]{0,8}不(要|再|被)"), "否定不当"),
+]
+
+# 重复时通常为笔误的虚词
+FUNCTION_CHARS = "的了是在和与及也都就又而被把对于着过"
+PUNCTUATION_PAIRS = [("“", "”"), ("（", "）"), ("《", "》"), ("【", "】"), ("‘", "’")]
+
+CJK = r"一-鿿"
+RULES = [
+    (re.compile(rf"([{FUNCTION_CHARS}])\1"), 1.0, "虚词重复"),
+    (re.compile(rf"([{CJK}]{{2,4}})\1"), 0.5, "词语重复"),
+    (re.compile(r"[，。、；：！？]{2,}"), 1.0, "标点连用"),
+    (re.compile(rf"[{CJK}][,;:?!]|[,;:?!][{CJK}]"), 1.0, "中文中使用半角标点"),
+    (re.compile(rf"[{CJK}] +[0-9A-Za-z]|[0-9A-Za-z] +[{CJK}]"), 0.5, "中英文/数字混排空格"),
+    (re.compile(rf"[^，。；！？、\n]{{60,}}"), 0.5, "长句缺少标点"),
+]
+
+
+class BigramModel:
+    """
+    字符二元语言模型，离线从语料构建，用于发现语料中罕见的字组合（多为错别字）
+    """
+    def __init__(self, counts=None, min_count: int = 1):
+        self.counts = Counter(counts or {})
+        self.min_count = min_count
+
+    @staticmethod
+    def bigrams(text: str):
+        chars = re.findall(rf"[{CJK}]", text)
+        return [a + b for a, b in zip(chars, chars[1:])]
+
+    def update(self, text: str):
+        self.counts.update(self.bigrams(text))
+
+    def rare_ratio(self, text: str) -> float:
+        """文本中语料未见（或低于min_count）的二元组比例"""
+        grams = self.bigrams(text)
+        if not grams or not self.counts:
+            return 0.0
+        return sum(self.counts.get(g, 0) < self.min_count for g in grams) / len(grams)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"min_count": self.min_count, "counts": dict(self.counts)}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["counts"], data.get("min_count", 1))
+
+
+class PreScreener:
+    """
+    语法检查前的本地预筛：对chunk打分，分数越高越可能有错误，
+    只有分数达到阈值的chunk才需要调用LLM
+    :param lm: 可选的BigramModel
+    :param lm_weight: 罕见二元组比例的权重
+    """
+    def __init__(self, lm: BigramModel | None = None, lm_weight: float = 5.0):
+        self.lm = lm
+        self.lm_weight = lm_weight
+
+    def score(self, text: str):
+        """返回 (分数, 命中原因列表)"""
+        score = 0.0
+        reasons = []
+        for wrong, right in COMMON_ERRORS.items():
+            if wrong in text:
+                score += 1.0
+                reasons.append(f"疑似错别字: {wrong}->{right}")
+        for pattern, reason in ERROR_PATTERNS:
+            if pattern.search(text):
+                score += 1.0
+                reasons.append(reason)
+        for pattern, weight, reason in RULES:
+            if pattern.search(text):
+                score += weight
+                reasons.append(reason)
+        for left, right in PUNCTUATION_PAIRS:
+            if text.count(left) != text.count(right):
+                score += 1.0
+                reasons.append(f"{left}{right}不成对")
+        if self.lm is not None:
+            ratio = self.lm.rare_ratio(text)
+            if ratio > 0:
+                score += self.lm_weight * ratio
+                reasons.append(f"罕见字组合比例 {ratio:.2f}")
+        return round(score, 3), reasons
+
+
+_screeners = {}
+
+def get_prescreener(lm_path: str | None = None) -> PreScreener:
+    """按语言模型路径缓存PreScreener，模型只加载一次"""
+    if lm_path not in _screeners:
+        lm = BigramModel.load(lm_path) if lm_path else None
+        _screeners[lm_path] = PreScreener(lm)
+    return _screeners[lm_path]
+
+def build_lm(inputs: str, min_count: int = 1) -> BigramModel:
+    """从目录或glob下的docx/pdf/txt文件构建二元语言模型"""
+    pattern = os.path.join(inputs, "*") if os.path.isdir(inputs) else inputs
+    model = BigramModel(min_count=min_count)
+    for path in sorted(glob.glob(pattern)):
+        if path.lower().endswith(".txt"):
+            with open(path, "r", encoding="utf-8") as f:
+                model.update(f.read())
+        elif path.lower().endswith((".docx", ".pdf")):
+            model.update(extract_text_from_path(path))
+    return model
+
+def load_reference(reference: str, docx_data: str):
+    """
+    读取语法检查结果作为标注，返回 [(chunk, 是否有错)]
+    旧结果中没有original_text时，按语法pipeline的方式重新切分文档对齐
+    """
+    with open(reference, "r", encoding="utf-8") as f:
+        results = json.load(f)
+    if all("original_text" in r for r in results):
+        return [(r["original_text"], not r["correct"]) for r in results]
+    chunks = chunking(extract_text_from_path(docx_data), chunk_size=128)
+    if len(chunks) != len(results):
+        raise ValueError(f"chunk数量 {len(chunks)} 与参考结果数量 {len(results)} 不一致")
+    return [(chunk, not r["correct"]) for chunk, r in zip(chunks, results)]
+
+def evaluate(screener: PreScreener, samples, thresholds):
+    """
+    统计各阈值下的召回率（有错chunk被送往LLM的比例）与跳过的LLM调用比例
+    """
+    scores = [screener.score(chunk)[0] for chunk, _ in samples]
+    positives = sum(label for _, label in samples)
+    report = []
+    for threshold in thresholds:
+        sent = [s >= threshold for s in scores]
+        caught = sum(s and label for s, (_, label) in zip(sent, samples))
+        report.append({
+            "threshold": threshold,
+            "recall": round(caught / positives, 3) if positives else 1.0,
+            "skip_rate": round(1 - sum(sent) / len(samples), 3) if samples else 0.0,
+        })
+    return report
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.build_lm:
+        lm = build_lm(args.build_lm)
+        lm.save(args.prescreen_lm or "./logs/prescreen_lm.json")
+        print(f"二元模型已保存到: {args.prescreen_lm or './logs/prescreen_lm.json'}，共 {len(lm.counts)} 个二元组")
+    else:
+        screener = get_prescreener(args.prescreen_lm)
+        samples = load_reference(args.reference, args.docx_data)
+        for i, (chunk, label) in enumerate(samples):
+            score, reasons = screener.score(chunk)
+            print(f"chunk {i}: 有错={label} 分数={score} {reasons}")
+        thresholds = [float(t) for t in args.thresholds.split(",")]
+        for row in evaluate(screener, samples, thresholds):
+            print(f"阈值 {row['threshold']}: 召回率 {row['recall']}, 跳过LLM调用 {row['skip_rate']}")
@@ -3,7 +3,7 @@ import uvicorn
 import signal
 import sys
 import asyncio
-from main import app
+from main import create_app, parse_args
 
 # 处理信号，确保程序能被正确终止
 def handle_signal(signum, frame):
@@ -17,4 +17,4 @@ if __name__ == "__main__":
     signal.signal(signal.SIGTERM, handle_signal)
     
     # 启动服务器，建议在生产环境关闭reload
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=False)
\ No newline at end of file
+    uvicorn.run(create_app(parse_args()), host="127.0.0.1", port=8000, reload=False)
\ No newline at end of file
@@ -0,0 +1,110 @@
+import sys
+import os
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+# 添加项目根目录到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm.edits import EditError, apply_edits, edits_to_result, acheck_grammar_edits
+
+
+def edit(original, replacement, start=None):
+    return {"start": start, "original": original, "replacement": replacement}
+
+
+@pytest.mark.parametrize("text, edits, expected, starts", [
+    pytest.param("我爱吃萍果。", [edit("萍果", "苹果", 3)], "我爱吃苹果。", [3], id="exact offset"),
+    pytest.param("我爱吃萍果。", [edit("萍果", "苹果", 1)], "我爱吃苹果。", [3], id="offset drift"),
+    pytest.param("他在在家，我在在学校", [edit("在在", "在", 4)], "他在在家，我在学校", [6], id="nearest occurrence"),
+    pytest.param("他在在家，我在在学校", [edit("在在", "在", 3)], "他在家，我在在学校", [1], id="nearest occurrence before"),
+    pytest.param("今天天气很好", [edit("很好", "不错")], "今天天气不错", [4], id="unique without start"),
+    pytest.param("我们去学校", [edit("", "一起", 2)], "我们一起去学校", [2], id="insertion with start"),
+    pytest.param("萍果和香焦", [edit("香焦", "香蕉", 3), edit("萍果", "苹果", 0)], "苹果和香蕉", [0, 3], id="unordered edits"),
+    pytest.param("ABCD", [edit("AB", "x", 0), edit("CD", "y", 2)], "xy", [0, 2], id="adjacent edits"),
+    pytest.param("没有错误", [edit("错误", "错误", 2)], "没有错误", [], id="unchanged edit skipped"),
+])
+def test_apply_edits(text, edits, expected, starts):
+    content, located = apply_edits(text, edits)
+    assert content == expected
+    assert [e["start"] for e in located] == starts
+    for e in located:
+        assert text[e["start"]:e["end"]] == e["original"]
+
+
+@pytest.mark.parametrize("text, edits", [
+    pytest.param("我爱吃苹果", [edit("萍果", "苹果", 3)], id="missing fragment"),
+    pytest.param("在在家在在", [edit("在在", "在")], id="ambiguous without start"),
+    pytest.param("我们去学校", [edit("", "一起")], id="insertion without anchor"),
+    pytest.param("我们去学校", [edit("", "一起", 99)], id="insertion out of range"),
+    pytest.param("苹果树下", [edit("苹果", "梨", 0), edit("果树", "树", 1)], id="overlapping edits"),
+    pytest.param("文本", [{"original": "文"}], id="bad format"),
+    pytest.param("文本", {"original": "文", "replacement": "字"}, id="not a list"),
+])
+def test_apply_edits_errors(text, edits):
+    with pytest.raises(EditError):
+        apply_edits(text, edits)
+
+
+def test_edits_to_result():
+    result = edits_to_result("我爱吃萍果。", json.dumps({"correct": False, "edits": [
+        {"start": 3, "original": "萍果", "replacement": "苹果", "type": "错别字", "reason": "形近字"}]}))
+    assert result["correct"] is False and result["content"] == "我爱吃苹果。"
+    assert result["reason"] == "错别字：萍果→苹果（形近字）"
+
+
+def test_edits_to_result_correct():
+    assert edits_to_result("正确。", '{"correct": true, "edits": []}')["correct"] is True
+
+
+@pytest.mark.parametrize("output", ["不是JSON", "[]", '{"correct": false, "edits": []}'])
+def test_edits_to_result_errors(output):
+    with pytest.raises(EditError):
+        edits_to_result("文本", output)
+
+
+class FakeChain:
+    """按固定输出逐段流式返回的chain"""
+    def __init__(self, output: str, piece: int = 4):
+        self.output = output
+        self.piece = piece
+        self.calls = 0
+
+    async def astream(self, inputs, config=None):
+        self.calls += 1
+        for i in range(0, len(self.output), self.piece):
+            yield SimpleNamespace(content=self.output[i:i + self.piece])
+
+
+def run_check(edit_output, fallback_output, text):
+    deltas = []
+
+    async def on_delta(delta):
+        deltas.append(delta)
+
+    edit_chain, fallback_chain = FakeChain(edit_output), FakeChain(fallback_output)
+    result = asyncio.run(acheck_grammar_edits(edit_chain, text, on_delta, fallback_chain=fallback_chain))
+    return result, deltas, fallback_chain.calls
+
+
+def test_edits_deltas_not_streamed():
+    # 编辑操作的JSON不流式发送，应用后的完整结果作为一次增量发送
+    output = json.dumps({"correct": False, "edits": [{"start": 3, "original": "萍果", "replacement": "苹果"}]}, ensure_ascii=False)
+    result, deltas, fallback_calls = run_check(output, "", "我爱吃萍果。")
+    assert deltas == [result] and json.loads(result)["content"] == "我爱吃苹果。"
+    assert fallback_calls == 0
+
+
+def test_fallback_streams_only_full_output():
+    # 编辑操作无法应用时，只有完整输出被流式发送
+    fallback = json.dumps({"correct": False, "content": "我爱吃苹果。", "reason": "错别字"}, ensure_ascii=False)
+    result, deltas, fallback_calls = run_check('{"correct": false, "edits": [{"original": "不存在", "replacement": "x"}]}', fallback, "我爱吃萍果。")
+    assert result == fallback and "".join(deltas) == fallback
+    assert fallback_calls == 1
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,67 @@
+import sys
+import os
+import uuid
+
+# 添加项目根目录到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm.entity import UIEntity, EntityStore
+
+
+def entity(name, **attributes):
+    return UIEntity(entity_id=str(uuid.uuid4()), name=name, type="设备", attributes=attributes)
+
+
+def shard_store(chunk_index, *entities):
+    store = EntityStore()
+    for ent in entities:
+        store.add_entity(ent, chunk_index=chunk_index)
+    return store
+
+
+def absorb_all(*stores):
+    merged = EntityStore()
+    for shard_index, store in enumerate(stores):
+        merged.absorb(store, shard_index)
+    return merged
+
+
+def test_divergent_values_recorded_as_alternatives():
+    merged = absorb_all(shard_store(0, entity("发动机", 产地="泰国", 功率="5kW")),
+                        shard_store(3, entity("发动机", 产地="越南", 功率="5kW")),
+                        shard_store(6, entity("发动机", 产地="泰国")),
+                        shard_store(9, entity("发动机", 产地="中国")))
+    [ent] = merged.all_entities()
+    assert ent.attributes == {"产地": "泰国", "功率": "5kW"}
+    assert ent.alternatives == {"产地": ["泰国", "越南", "中国"]}
+    assert merged.occurrences[ent.entity_id] == {0, 3, 6, 9}
+    assert merged.cross_shard_ids() == {ent.entity_id}
+
+
+def test_list_values_not_confused_with_alternatives():
+    # 属性本身是列表时原样保留，不会被当作多个分片的取值
+    merged = absorb_all(shard_store(0, entity("张三", 别名=["小张", "老三"])),
+                        shard_store(1, entity("张三", 别名=["小张", "老三"], 年龄="30")))
+    [ent] = merged.all_entities()
+    assert ent.attributes == {"别名": ["小张", "老三"], "年龄": "30"}
+    assert ent.alternatives == {}
+
+    merged = absorb_all(shard_store(0, entity("张三", 别名=["小张"])),
+                        shard_store(1, entity("张三", 别名=["老三"])))
+    [ent] = merged.all_entities()
+    assert ent.attributes == {"别名": ["小张"]}
+    assert ent.alternatives == {"别名": [["小张"], ["老三"]]}
+
+
+def test_single_shard_entities_kept_apart():
+    merged = absorb_all(shard_store(0, entity("张三")), shard_store(1, entity("李四")))
+    assert sorted(e.name for e in merged.all_entities()) == ["张三", "李四"]
+    assert merged.cross_shard_ids() == set()
+    assert all(e.alternatives == {} for e in merged.all_entities())
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"{name} ok")
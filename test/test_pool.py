@@ -0,0 +1,146 @@
+import sys
+import os
+import asyncio
+import time
+
+# 添加项目根目录到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from llm.pool import Endpoint, EndpointPool, CLOSED, OPEN, HALF_OPEN
+from llm.transports import PoolTransport
+
+DEFAULT_URL = "http://pool.invalid/v1"
+
+
+def make_pool(weights=(1, 1), failure_threshold=2, cooldown=0.05, handler=None):
+    endpoints = [Endpoint(f"http://ep{i}.test/v1", f"key{i}", weight=w, name=f"ep{i}") for i, w in enumerate(weights)]
+    pool = EndpointPool(endpoints, DEFAULT_URL, failure_threshold, cooldown)
+    if handler is not None:
+        pool._sync = httpx.MockTransport(handler)
+        pool._async = httpx.MockTransport(handler)
+    return pool
+
+
+def test_weighted_least_outstanding():
+    # 按 (未完成请求数+1)/权重 选择，权重3:1时前三个请求给ep0
+    pool = make_pool(weights=(3, 1))
+    picked = [pool.acquire()[0].name for _ in range(4)]
+    assert picked == ["ep0", "ep0", "ep0", "ep1"]
+    assert [e.outstanding for e in pool.endpoints] == [3, 1]
+    # 释放后重新按未完成请求数分配
+    for _ in range(3):
+        pool.release(pool.endpoints[0], True, "200")
+    assert pool.acquire()[0].name == "ep0"
+
+
+def test_circuit_open_half_open_recovery():
+    pool = make_pool(failure_threshold=2, cooldown=0.05)
+    ep0, ep1 = pool.endpoints
+    for _ in range(2):
+        endpoint, _ = pool.acquire(exclude=[ep1])
+        pool.release(endpoint, False, "500")
+    assert ep0.state == OPEN
+    # 熔断期间请求分配给其他端点
+    endpoint, _ = pool.acquire()
+    assert endpoint is ep1
+    pool.release(endpoint, True, "200")
+
+    # 冷却后放行一个试探请求，试探期间不再分配给该端点
+    time.sleep(0.06)
+    probe, _ = pool.acquire()
+    assert probe is ep0 and ep0.state == HALF_OPEN and ep0.probing
+    other, _ = pool.acquire()
+    assert other is ep1
+    pool.release(other, True, "200")
+
+    # 试探失败重新熔断
+    pool.release(probe, False, "503")
+    assert ep0.state == OPEN
+    time.sleep(0.06)
+    probe, _ = pool.acquire()
+    assert probe is ep0 and ep0.state == HALF_OPEN
+    # 试探成功恢复
+    pool.release(probe, True, "200")
+    assert ep0.state == CLOSED and ep0.failures == 0
+
+
+def test_cancelled_does_not_affect_circuit():
+    pool = make_pool(failure_threshold=1)
+    endpoint, _ = pool.acquire()
+    pool.release(endpoint, None, "cancelled")
+    assert endpoint.state == CLOSED and endpoint.failures == 0 and endpoint.outstanding == 0
+
+
+def failing_handler(seen, fail_host="ep0.test", error=None):
+    def handler(request):
+        seen.append((request.url.host, request.headers["authorization"]))
+        if request.url.host == fail_host:
+            if error is not None:
+                raise error("connection refused", request=request)
+            return httpx.Response(500, json={"error": "boom"})
+        return httpx.Response(200, json={"ok": True})
+    return handler
+
+
+def test_failover_on_5xx_sync():
+    seen = []
+    pool = make_pool(handler=failing_handler(seen))
+    with httpx.Client(transport=PoolTransport(pool)) as client:
+        response = client.post(f"{DEFAULT_URL}/chat/completions", json={}, headers={"authorization": "Bearer default"})
+    assert response.status_code == 200 and response.json() == {"ok": True}
+    # 请求改写为各端点的地址与key
+    assert seen == [("ep0.test", "Bearer key0"), ("ep1.test", "Bearer key1")]
+    assert pool.endpoints[0].failures == 1
+    assert [e.outstanding for e in pool.endpoints] == [0, 0]
+
+
+def test_failover_on_connect_error_async():
+    seen = []
+    pool = make_pool(handler=failing_handler(seen, error=httpx.ConnectError))
+
+    async def main():
+        async with httpx.AsyncClient(transport=PoolTransport(pool)) as client:
+            return await client.post(f"{DEFAULT_URL}/chat/completions", json={})
+
+    response = asyncio.run(main())
+    assert response.status_code == 200
+    assert [host for host, _ in seen] == ["ep0.test", "ep1.test"]
+    assert pool.endpoints[0].failures == 1
+    assert [e.outstanding for e in pool.endpoints] == [0, 0]
+
+
+def test_all_endpoints_fail_returns_last_response():
+    seen = []
+
+    def handler(request):
+        seen.append(request.url.host)
+        return httpx.Response(503, json={"error": "down"})
+
+    pool = make_pool(handler=handler)
+    with httpx.Client(transport=PoolTransport(pool)) as client:
+        response = client.post(f"{DEFAULT_URL}/chat/completions", json={})
+    # 每个端点只尝试一次，最后的错误交给openai客户端的重试策略处理
+    assert response.status_code == 503
+    assert seen == ["ep0.test", "ep1.test"]
+    assert [e.failures for e in pool.endpoints] == [1, 1]
+
+
+def test_pool_clients_cached_per_base_url():
+    from llm import pool as pool_module
+    pool_module.configure_pool('[{"base_url": "http://ep0.test/v1", "api_key": "key0"}]', DEFAULT_URL)
+    try:
+        first = pool_module.pool_client_kwargs(DEFAULT_URL)
+        assert first and pool_module.pool_client_kwargs(DEFAULT_URL + "/") is first
+        # 单独配置了base_url的阶段不经过连接池
+        assert pool_module.pool_client_kwargs("http://other.test/v1") == {}
+    finally:
+        pool_module.configure_pool(None, DEFAULT_URL)
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"{name} ok")
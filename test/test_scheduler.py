@@ -0,0 +1,128 @@
+import sys
+import os
+import asyncio
+
+# 添加项目根目录到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm.scheduler import Job, Scheduler, _FairQueue, _Slots, INTERACTIVE, BATCH, INTERACTIVE_BURST
+
+
+def drain(queue):
+    items = []
+    while (item := queue.pop()) is not None:
+        items.append(item)
+    return items
+
+
+def test_round_robin_across_clients():
+    queue = _FairQueue()
+    for item in ("a1", "a2", "a3"):
+        queue.push(BATCH, "a", item)
+    queue.push(BATCH, "b", "b1")
+    queue.push(BATCH, "c", "c1")
+    # 客户端之间轮转，每个客户端内部先进先出
+    assert drain(queue) == ["a1", "b1", "c1", "a2", "a3"]
+    assert len(queue) == 0
+
+
+def test_interactive_priority_with_burst():
+    queue = _FairQueue()
+    queue.push(BATCH, "batch", "b1")
+    queue.push(BATCH, "batch", "b2")
+    for i in range(6):
+        queue.push(INTERACTIVE, "web", f"i{i + 1}")
+    # 交互任务优先，连续 INTERACTIVE_BURST 次后让批处理任务出队一次
+    assert INTERACTIVE_BURST == 4
+    assert drain(queue) == ["i1", "i2", "i3", "i4", "b1", "i5", "i6", "b2"]
+
+
+def test_remove_waiter():
+    queue = _FairQueue()
+    queue.push(BATCH, "a", "a1")
+    queue.push(BATCH, "b", "b1")
+    assert queue.remove(BATCH, "a", "a1")
+    assert not queue.remove(BATCH, "a", "a1")
+    assert len(queue) == 1 and drain(queue) == ["b1"]
+
+
+async def _wait_queued(slots, count):
+    while len(slots._queue) < count:
+        await asyncio.sleep(0)
+
+
+def test_slot_handoff_skips_cancelled_waiter():
+    async def main():
+        slots = _Slots("test", limit=1)
+        assert await slots.acquire(Job(1, "a")) == 0.0
+        waiter_b = asyncio.create_task(slots.acquire(Job(2, "b")))
+        waiter_c = asyncio.create_task(slots.acquire(Job(3, "c")))
+        await _wait_queued(slots, 2)
+        # 排队中被取消的等待者移出队列，释放的槽位转交给下一个等待者
+        waiter_b.cancel()
+        await asyncio.gather(waiter_b, return_exceptions=True)
+        assert len(slots._queue) == 1
+        slots.release()
+        await waiter_c
+        assert slots.active == 1 and len(slots._queue) == 0
+        slots.release()
+        assert slots.active == 0
+    asyncio.run(main())
+
+
+def test_slot_returned_when_cancelled_after_handoff():
+    async def main():
+        slots = _Slots("test", limit=1)
+        await slots.acquire(Job(1, "a"))
+        waiter_b = asyncio.create_task(slots.acquire(Job(2, "b")))
+        waiter_c = asyncio.create_task(slots.acquire(Job(3, "c")))
+        await _wait_queued(slots, 2)
+        # 槽位已转交给b，但b在恢复运行前被取消：b交还槽位，由c获得
+        slots.release()
+        waiter_b.cancel()
+        await asyncio.gather(waiter_b, return_exceptions=True)
+        assert waiter_b.cancelled()
+        await waiter_c
+        assert slots.active == 1 and len(slots._queue) == 0
+    asyncio.run(main())
+
+
+def test_new_caller_does_not_barge_in():
+    async def main():
+        slots = _Slots("test", limit=1)
+        await slots.acquire(Job(1, "a"))
+        waiter = asyncio.create_task(slots.acquire(Job(2, "b")))
+        await _wait_queued(slots, 1)
+        slots.release()
+        # 槽位已转交给等待者，新来的调用需要排队
+        assert slots.active == 1 and not slots.available()
+        await waiter
+    asyncio.run(main())
+
+
+def test_admit_sets_current_job_and_llm_wait():
+    async def main():
+        scheduler = Scheduler()
+        scheduler.configure(max_jobs=1, llm_concurrency=1)
+        short = scheduler.new_job("short", "web", interactive=True, size=100)
+        long = scheduler.new_job("long", "web", interactive=True, size=scheduler.short_job_chars + 1)
+        assert short.priority == INTERACTIVE and long.priority == BATCH
+
+        async def run(job, hold):
+            async with scheduler.admit(job):
+                async with scheduler.llm_slot():
+                    await asyncio.sleep(hold)
+
+        await asyncio.gather(run(short, 0.05), run(long, 0))
+        # 第二个任务等待任务槽位，进入后无需再等待LLM槽位
+        assert long.admission_wait > 0 and short.admission_wait == 0
+        assert short.llm_calls == 1 and long.llm_calls == 1
+        assert scheduler.jobs.active == 0 and scheduler.llm.active == 0
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"{name} ok")
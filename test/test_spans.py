@@ -0,0 +1,133 @@
+import sys
+import os
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+# 添加项目根目录到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm.spans import SpanError, number_conflicts, apply_spans, acorrect_spans
+
+CHUNK_CONFLICTS = [
+    {"entity_name": "张三", "conflicts": [{"type": "身份", "description": "前后身份不一致"}, {"type": "年龄", "description": "年龄矛盾"}]},
+    {"entity_name": "北京大学", "conflicts": [{"type": "地点", "description": "地点矛盾"}]},
+]
+CONFLICTS = number_conflicts(CHUNK_CONFLICTS)
+
+
+def span(anchor, *ids):
+    return {"anchor": anchor, "conflict_ids": list(ids)}
+
+
+def test_number_conflicts():
+    assert [(c["id"], c["entity_name"], c["type"]) for c in CONFLICTS] == [
+        ("1", "张三", "身份"), ("2", "张三", "年龄"), ("3", "北京大学", "地点")]
+
+
+@pytest.mark.parametrize("text, spans, expected, count", [
+    pytest.param("主角张三在北京。", [span("张三", "1")],
+                 "主角【矛盾::张三::身份】张三【/矛盾】在北京。", 1, id="exact anchor"),
+    pytest.param("张三，推力 80\n吨", [span("推力80吨", "1")],
+                 "张三，【矛盾::张三::身份】推力 80\n吨【/矛盾】", 1, id="whitespace-insensitive anchor"),
+    pytest.param("张三在北京大学", [span("张三", "1", "2")],
+                 "【矛盾::张三::身份/年龄】张三【/矛盾】在北京大学", 1, id="types of one entity merged"),
+    pytest.param("张三在北京大学", [span("张三在", "1", "3")],
+                 "【矛盾::张三::身份】【矛盾::北京大学::地点】张三在【/矛盾】【/矛盾】北京大学", 2, id="same span for two entities nested"),
+    pytest.param("张三在北京大学", [span("在北京大学", "3"), span("北京", "1")],
+                 "张三【矛盾::北京大学::地点】在【矛盾::张三::身份】北京【/矛盾】大学【/矛盾】", 2, id="contained span nested"),
+    pytest.param("ABCD", [span("ABC", "1"), span("BCD", "3")],
+                 "【矛盾::张三::身份】ABC【/矛盾】D", 1, id="partial overlap keeps first"),
+    pytest.param("张三在北京大学", [], "张三在北京大学", 0, id="no spans"),
+])
+def test_apply_spans(text, spans, expected, count):
+    assert apply_spans(text, spans, CONFLICTS) == (expected, count, 0)
+
+
+@pytest.mark.parametrize("text, spans, expected", [
+    pytest.param("他说好，他说不好", [dict(span("他说", "1"), occurrence=2)],
+                 "他说好，【矛盾::张三::身份】他说【/矛盾】不好", id="second occurrence"),
+    pytest.param("他说好，他说不好", [span("他说", "1")],
+                 "【矛盾::张三::身份】他说【/矛盾】好，他说不好", id="first occurrence by default"),
+    pytest.param("他 说好，他\n说不好", [dict(span("他说", "1"), occurrence=2)],
+                 "他 说好，【矛盾::张三::身份】他\n说【/矛盾】不好", id="occurrence ignoring whitespace"),
+])
+def test_apply_spans_occurrence(text, spans, expected):
+    assert apply_spans(text, spans, CONFLICTS) == (expected, 1, 0)
+
+
+@pytest.mark.parametrize("bad", [
+    pytest.param(span("李四", "1"), id="anchor not found"),
+    pytest.param(span(" \n", "1"), id="blank anchor"),
+    pytest.param(span("张三", "9"), id="unknown conflict id"),
+    pytest.param(span("张三"), id="missing conflict ids"),
+    pytest.param({"conflict_ids": ["1"]}, id="bad format"),
+    pytest.param(dict(span("张三", "1"), occurrence=2), id="occurrence out of range"),
+    pytest.param(dict(span("张三", "1"), occurrence=0), id="bad occurrence"),
+])
+def test_apply_spans_drops_unlocatable(bad):
+    # 无法定位的片段只丢弃它自己，其余片段照常标记
+    marked = apply_spans("张三在北京大学", [bad, span("北京大学", "3")], CONFLICTS)
+    assert marked == ("张三在【矛盾::北京大学::地点】北京大学【/矛盾】", 1, 1)
+
+
+@pytest.mark.parametrize("spans", [
+    pytest.param([span("李四", "1")], id="all spans unlocatable"),
+    pytest.param([span("李四", "1"), span("张三", "9")], id="all of several unlocatable"),
+    pytest.param({"anchor": "张三", "conflict_ids": ["1"]}, id="not a list"),
+])
+def test_apply_spans_errors(spans):
+    with pytest.raises(SpanError):
+        apply_spans("张三在北京大学", spans, CONFLICTS)
+
+
+class FakeChain:
+    """按固定输出逐段流式返回的chain"""
+    def __init__(self, output: str, piece: int = 4):
+        self.output = output
+        self.piece = piece
+        self.calls = 0
+
+    async def astream(self, inputs, config=None):
+        self.calls += 1
+        for i in range(0, len(self.output), self.piece):
+            yield SimpleNamespace(content=self.output[i:i + self.piece])
+
+
+def run_correct(span_output, fallback_output, text):
+    deltas = []
+
+    async def on_delta(delta):
+        deltas.append(delta)
+
+    span_chain, fallback_chain = FakeChain(span_output), FakeChain(fallback_output)
+    result = asyncio.run(acorrect_spans(span_chain, text, CHUNK_CONFLICTS, on_delta, fallback_chain=fallback_chain))
+    return result, deltas, fallback_chain.calls
+
+
+def test_spans_deltas_not_streamed():
+    # 标注片段的JSON不流式发送，标注后的文本作为一次增量发送
+    output = json.dumps({"spans": [span("张三", "1")]}, ensure_ascii=False)
+    result, deltas, fallback_calls = run_correct(output, "", "主角张三在北京。")
+    assert result == "主角【矛盾::张三::身份】张三【/矛盾】在北京。"
+    assert deltas == [result] and fallback_calls == 0
+
+
+def test_partial_spans_without_fallback():
+    output = json.dumps({"spans": [span("李四", "1"), span("张三", "1")]}, ensure_ascii=False)
+    result, deltas, fallback_calls = run_correct(output, "不应使用", "主角张三在北京。")
+    assert result == "主角【矛盾::张三::身份】张三【/矛盾】在北京。"
+    assert deltas == [result] and fallback_calls == 0
+
+
+def test_fallback_streams_only_full_output():
+    fallback = "主角【矛盾::张三::身份】张三【/矛盾】在北京。"
+    result, deltas, fallback_calls = run_correct('{"spans": [{"anchor": "李四", "conflict_ids": ["1"]}]}', fallback, "主角张三在北京。")
+    assert result == fallback and "".join(deltas) == fallback
+    assert fallback_calls == 1
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,127 @@
+import sys
+import os
+import gc
+import io
+import json
+import tempfile
+
+# 添加项目根目录到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline.spill import BUDGET, SpillList, result_list, dump_json
+
+ITEMS = [
+    {"original_text": "第一段文本。", "corrected_text": "第一段【矛盾::张三::身份】文本【/矛盾】。"},
+    {"correct": False, "content": "多行\n文本", "reason": "换行与\"引号\"", "edits": [{"start": 0, "end": 2}]},
+    None,
+    ["嵌套", ["列表"], {}],
+    "纯字符串",
+    {"number": 1.5, "empty": [], "nested": {"a": {"b": None}}},
+]
+
+
+class tiny_budget:
+    """临时设置很小的内存预算，使几乎每次写入都会落盘"""
+    def __init__(self, max_bytes: int = 64):
+        self.max_bytes = max_bytes
+
+    def __enter__(self):
+        self._saved = (BUDGET.max_bytes, BUDGET.directory)
+        self._tmp = tempfile.TemporaryDirectory()
+        BUDGET.max_bytes, BUDGET.directory = self.max_bytes, self._tmp.name
+        return self._tmp.name
+
+    def __exit__(self, *exc):
+        gc.collect()
+        BUDGET.max_bytes, BUDGET.directory = self._saved
+        self._tmp.cleanup()
+
+
+def test_round_trip_matches_list():
+    with tiny_budget():
+        used = BUDGET.used
+        items = result_list(name="test")
+        assert isinstance(items, SpillList)
+        items.extend(ITEMS)
+        assert items.path and os.path.exists(items.path) and items._offsets
+        assert len(items) == len(ITEMS) and list(items) == ITEMS
+        assert [items[i] for i in range(-len(ITEMS), 0)] == ITEMS
+        # 落盘后驻留内存的部分不超过预算
+        assert BUDGET.used - used <= BUDGET.max_bytes
+        del items
+
+
+def test_presized_slots_and_overwrite_spilled():
+    with tiny_budget():
+        items = result_list(len(ITEMS), name="test")
+        expected = [None] * len(ITEMS)
+        assert list(items) == expected
+        # 乱序写入，模拟多个分片并发写回结果
+        for i in (3, 0, 5, 1, 4, 2):
+            items[i] = ITEMS[i]
+            expected[i] = ITEMS[i]
+        assert list(items) == expected
+        # 覆盖已落盘的条目：旧的偏移量被丢弃，读到新值
+        spilled = sorted(items._offsets)
+        assert spilled
+        for i in spilled:
+            items[i] = {"overwritten": i}
+            expected[i] = {"overwritten": i}
+        assert list(items) == expected
+        items.spill()
+        assert not items._memory and list(items) == expected
+
+
+def test_index_errors():
+    with tiny_budget():
+        items = result_list(2, name="test")
+        for index in (2, -3):
+            try:
+                items[index]
+            except IndexError:
+                continue
+            raise AssertionError(f"序号 {index} 没有抛出IndexError")
+
+
+def test_file_removed_when_released():
+    with tiny_budget():
+        items = result_list(name="test")
+        items.extend(ITEMS)
+        path = items.path
+        assert os.path.exists(path)
+        del items
+        gc.collect()
+        assert not os.path.exists(path)
+
+
+def test_unbudgeted_result_list_is_plain_list():
+    saved = BUDGET.max_bytes
+    BUDGET.max_bytes = 0
+    try:
+        assert result_list(3) == [None, None, None]
+    finally:
+        BUDGET.max_bytes = saved
+
+
+def test_dump_json_matches_json_dump():
+    cases = [[], [{}], [[]], ITEMS, ITEMS[:1], ["单个字符串"]]
+    for case in cases:
+        expected, actual = io.StringIO(), io.StringIO()
+        json.dump(case, expected, ensure_ascii=False, indent=4)
+        dump_json(case, actual)
+        assert actual.getvalue() == expected.getvalue(), case
+    with tiny_budget():
+        items = result_list(name="test")
+        items.extend(ITEMS)
+        expected, actual = io.StringIO(), io.StringIO()
+        json.dump(ITEMS, expected, ensure_ascii=False, indent=4)
+        dump_json(items, actual)
+        assert actual.getvalue() == expected.getvalue()
+        del items
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"{name} ok")
@@ -1,154 +1,35 @@
-from llm.model import get_grammar_check_chain_with_memory, get_grammar_check_chain, get_entity_extract_chain, get_entity_consistency_check_chain, get_memory_summary_chain, get_consistency_correct_chain, get_feedback_summary_chain
-from llm.entity import EntityStore, extract_entities, summarize_entity_memory, check_entity_consistency
-from filereader.reader import chunking, get_text_from_input
-from feedback import collect_consistency_feedback, collect_grammar_feedback
+from pipeline.engine import PipelineContext
+from pipeline.stages import GRAMMAR_PIPELINE, PIPELINES, EmptyDocumentError, run_consistency_pipeline, run_grammar_pipeline
+from pipeline.results import ResultLog, follow_results, result_path, prune_job_files
+from feedback import submit_feedback, get_feedback_store
+from monitor.tracing import start_trace, trace_path
+from llm.scheduler import SCHEDULER
+from monitor.metrics import WS_QUEUE_DEPTH, WS_DROPPED_FRAMES, WS_COALESCED_FRAMES
 
 import io
+from collections import deque
 from fastapi import APIRouter, UploadFile, File, Form, Request, WebSocket, WebSocketDisconnect
 from fastapi.websockets import WebSocketState
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+import os
 import json
 import base64
+import secrets
 import asyncio
 import uuid
 import logging
 
-# 全局缓存日志和结果
-TASKS = {}  # task_id -> {"logs": [], "result": None, "done": False}
-
-async def run_consistency_pipeline(text: str, args, log_callback, **kwargs):
-    # 初始化模型
-    grammar_check_with_memory = get_grammar_check_chain_with_memory(args.model_name, args.base_url)
-    entity_extract_chain = get_entity_extract_chain(args.model_name, args.base_url)
-    entity_consistency_check_chain = get_entity_consistency_check_chain(args.model_name, args.base_url)
-    memory_summary_chain = get_memory_summary_chain(args.model_name, args.base_url)
-    
-    logger = kwargs.get("logger", logging.getLogger(__name__))
-    cancellation_token = kwargs.get("cancellation_token", None)
-
-    await log_callback(f"开始运行一致性检测pipeline，模型: {args.model_name}")
-    logger.info(f"开始运行一致性检测pipeline，模型: {args.model_name}")
-    # chunking 文本
-    await log_callback(f"文本长度: {len(text)}")
-    logger.info(f"文本长度: {len(text)}")
-    chunks = chunking(text)
-    ent_store = EntityStore()
-    # 处理每个 chunk
-    previous_memory = ""
-    for i, chunk in enumerate(chunks):
-        # 定期检查是否有取消请求
-        await asyncio.sleep(0.1)
-        
-        # 检查是否需要终止
-        if cancellation_token and cancellation_token.is_set():
-            await log_callback(f"pipeline已终止", "error")
-            logger.info(f"pipeline已终止")
-            raise asyncio.CancelledError("Pipeline terminated by user")
-            
-        chunk_input = (
-            f"前文要点总结:{previous_memory}\n当前输入文本:{chunk}"
-            if previous_memory else chunk
-        )
-
-        ents = extract_entities(entity_extract_chain, chunk_input)
-        for ent in ents:
-            ent_store.add_entity(ent)
-        await log_callback(f"第 {i+1} 个 chunk 提取实体: {ents}")
-        logger.info(f"第 {i+1} 个 chunk 提取实体: {ents}")
-        
-        if i < len(chunks) - 1:
-            previous_memory = summarize_entity_memory(
-                memory_summary_chain, chunk_input
-            )
-    # 检查实体一致性
-    await log_callback(f"实体总数: {len(ent_store.all_entities())}")
-    logger.info(f"实体总数: {len(ent_store.all_entities())}")
-    await log_callback(f"开始检查实体一致性")     
-    logger.info(f"开始检查实体一致性")     
-    results = []
-    for ent in ent_store.all_entities():
-        # 定期检查是否有取消请求
-        await asyncio.sleep(0.1)
-
-        # 检查是否需要终止
-        if cancellation_token and cancellation_token.is_set():
-            await log_callback(f"pipeline已终止", "error")
-            logger.info(f"pipeline已终止")
-            raise asyncio.CancelledError("Pipeline terminated by user")
-            
-        res = check_entity_consistency(
-            entity_consistency_check_chain, ent
-        )
-        results.append(res)
-        await log_callback(f"检查实体 {ent.entity_id} 一致性: {res}")
-        logger.info(f"检查实体 {ent.entity_id} 一致性: {res}")
-
-    await log_callback(f"完成检查实体一致性")     
-    logger.info(f"完成检查实体一致性")   
-
-    # 根据检查结果进行修改
-    await log_callback(f"开始修正实体一致性")     
-    logger.info(f"开始修正实体一致性")     
-    res_list = []
-    # 对输入的实体进行剔除，只保留冲突实体
-    conflict_ents = [ent for ent in results if ent["has_conflict"] is True]
-    logger.info(f"冲突实体: {conflict_ents}")
-    consistency_correct_chain = get_consistency_correct_chain(args.model_name, args.base_url)  
-    # 对每个chunk进行修正
-    for chunk in chunks:
-        chunk_input = f"原始文本:{chunk}\n实体冲突分析结果:{results}"
-        res = consistency_correct_chain.invoke(chunk_input).content
-        logger.info(f"段落修正结果: \n{res}")
-        res_dict = {
-            "original_text": chunk,
-            "corrected_text": res
-        }
-        await log_callback(f"段落修正结果: \n{res}")
-        logger.info(f"段落修正结果: \n{res}")
-        res_list.append(res_dict)
-    return res_list
-
-async def run_grammar_pipeline(text: str, args, log_callback, **kwargs):
-    """新的语法纠错pipeline"""
-    logger = kwargs.get("logger", logging.getLogger(__name__))
-    cancellation_token = kwargs.get("cancellation_token", None)
-    # chain获取
-    grammar_check_chain = get_grammar_check_chain(args.model_name, args.base_url)
-    # chunking 文本
-    await log_callback(f"文本长度: {len(text)}")
-    logger.info(f"文本长度: {len(text)}")
-    chunks = chunking(text, chunk_size=128)
-     # 对每个chunk进行语法检查
-    await log_callback(f"开始对 {len(chunks)} 个chunk进行语法检查")
-    logger.info(f"开始对 {len(chunks)} 个chunk进行语法检查")
-    grammar_results = []
-    for chunk in chunks:
-
-        # 检查是否需要终止
-        if cancellation_token and cancellation_token.is_set():
-            await log_callback(f"pipeline已终止", "error")
-            logger.info(f"pipeline已终止")
-            raise asyncio.CancelledError("Pipeline terminated by user") 
-        
-        result = grammar_check_chain.invoke({"new_message": chunk}).content
-        result_dict = json.loads(result)
-        result_dict["original_text"] = chunk
-        grammar_results.append(result_dict)
+# 运行中任务的结果日志，结束后从 {log_dir}/results 读取
+TASKS = {}  # job_id -> ResultLog
+JOBS = {}  # job_id -> (asyncio.Task, 取消令牌)，运行中的检测任务
 
-        await log_callback(f"语法检查结果: {result_dict}")
-        logger.info(f"语法检查结果: {result_dict}")
+FEEDBACK_TITLES = {
+    "consistency": "一致性检测",
+    "grammar": "语法纠错",
+}
 
-    await log_callback(f"语法检查完成，共检查 {len(chunks)} 个chunk")
-    logger.info(f"语法检查完成，共检查 {len(chunks)} 个chunk")
-        
-    await log_callback(f"语法纠错完成")
-    logger.info(f"语法纠错完成")
-    
-    # 返回模拟结果
-    return grammar_results
-
-# 处理反馈的函数
-def process_feedback(feedback_data, args, logger):
-    """处理用户反馈的同步函数"""
+async def process_feedback(feedback_data, args, logger):
+    """总结并保存用户反馈，返回发给前端的消息"""
     try:
         pipeline = feedback_data.get("pipeline")
         results = feedback_data.get("results")
@@ -157,128 +38,357 @@ def process_feedback(feedback_data, args, logger):
         
         if not pipeline or not results:
             logger.error("无效的反馈数据：缺少pipeline或results")
-            return "无效的反馈数据"
+            return "无效的反馈数据", None
+        if pipeline not in FEEDBACK_TITLES:
+            logger.error(f"未知的pipeline类型：{pipeline}")
+            return "未知的pipeline类型", None
         
         # 构造用户反馈字符串
         user_feedback = f"评分: {rating}/5"
         if comment:
             user_feedback += f"\n评论: {comment}"
         
-        # 根据pipeline类型调用相应的反馈处理函数
-        if pipeline == "consistency":
-            # 替换原有函数中的input()调用，直接使用用户提交的反馈
-            import builtins
-            original_input = builtins.input
-            builtins.input = lambda _=None: user_feedback
-            
-            try:
-                summary = collect_consistency_feedback(results, args.log_dir, args, logger)
-            finally:
-                builtins.input = original_input
-            
-            return f"一致性检测反馈已提交。反馈总结: {summary}"
-        
-        elif pipeline == "grammar":
-            # 替换原有函数中的input()调用，直接使用用户提交的反馈
-            import builtins
-            original_input = builtins.input
-            builtins.input = lambda _=None: user_feedback
-            
-            try:
-                summary = collect_grammar_feedback(results, args.log_dir, args, logger)
-            finally:
-                builtins.input = original_input
-            
-            return f"语法纠错反馈已提交。反馈总结: {summary}"
-        
-        else:
-            logger.error(f"未知的pipeline类型：{pipeline}")
-            return "未知的pipeline类型"
+        feedback_id, summary = await submit_feedback(pipeline, results, user_feedback, args.log_dir, args, logger)
+        return f"{FEEDBACK_TITLES[pipeline]}反馈已提交。反馈总结: {summary}", feedback_id
             
     except Exception as e:
         logger.exception("处理反馈时发生错误")
-        return f"处理反馈时发生错误：{str(e)}"
+        return f"处理反馈时发生错误：{str(e)}", None
+
+class OutboundChannel:
+    """
+    每个websocket连接的发送队列，由单独的任务发送，pipeline不会等待socket。
+    队列达到上限时丢弃最早的日志/进度帧，之后发送一条省略提示；同一chunk相邻的增量帧合并为一帧；
+    结果、完成与错误帧从不丢弃（因此队列可能短暂超过上限）。
+    :param max_size: 队列上限（帧数）
+    """
+    DROPPABLE = ("log", "progress")
+
+    def __init__(self, websocket: WebSocket, max_size: int = 256, logger=None):
+        self.websocket = websocket
+        self.max_size = max_size
+        self.logger = logger or logging.getLogger(__name__)
+        self.closed = False
+        self._queue = deque()  # [kind, frame]
+        self._ready = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._dropped = 0
+        self._sender = asyncio.create_task(self._send_loop())
+
+    def put(self, frame: dict, kind: str = "result") -> bool:
+        """放入一帧，不等待发送；连接已关闭时返回False"""
+        if self.closed:
+            return False
+        if kind == "delta" and self._queue:
+            last_kind, last = self._queue[-1]
+            if last_kind == "delta" and last["chunk_index"] == frame["chunk_index"] and last["pipeline"] == frame["pipeline"]:
+                last["delta"] += frame["delta"]
+                WS_COALESCED_FRAMES.inc(kind=kind)
+                return True
+        if len(self._queue) >= self.max_size:
+            victim = next((item for item in self._queue if item[0] in self.DROPPABLE), None)
+            if victim is not None:
+                self._queue.remove(victim)
+                WS_QUEUE_DEPTH.dec()
+                self._drop(victim[0])
+            elif kind in self.DROPPABLE:
+                self._drop(kind)
+                return True
+        self._queue.append([kind, frame])
+        WS_QUEUE_DEPTH.inc()
+        self._drained.clear()
+        self._ready.set()
+        return True
+
+    def _drop(self, kind: str):
+        self._dropped += 1
+        WS_DROPPED_FRAMES.inc(kind=kind)
+
+    async def _send_loop(self):
+        try:
+            while True:
+                if not self._queue:
+                    self._drained.set()
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                if self._dropped:
+                    notice = {"log": f"客户端接收过慢，已省略 {self._dropped} 条日志", "type": "warning"}
+                    self._dropped = 0
+                    await self.websocket.send_json(notice)
+                _, frame = self._queue.popleft()
+                WS_QUEUE_DEPTH.dec()
+                await self.websocket.send_json(frame)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # 连接已断开，接收循环会负责取消pipeline
+            self.logger.debug(f"websocket发送失败: {e!r}")
+        finally:
+            self.closed = True
+            WS_QUEUE_DEPTH.dec(len(self._queue))
+            self._queue.clear()
+            self._drained.set()
+
+    async def aclose(self, drain: bool = True, timeout: float = 5.0):
+        """
+        停止发送任务
+        :param drain: 是否先等待已排队的帧发送完毕（最多timeout秒），连接已断开时无需等待
+        """
+        if drain and not self.closed:
+            try:
+                await asyncio.wait_for(self._drained.wait(), timeout)
+            except asyncio.TimeoutError:
+                self.logger.warning(f"websocket发送队列未能在 {timeout}s 内发送完毕，剩余 {len(self._queue)} 帧")
+        self.closed = True
+        self._sender.cancel()
+        await asyncio.gather(self._sender, return_exceptions=True)
 
 router = APIRouter()
 
+def prune_job_outputs(log_dir: str):
+    """按 --job_retention_hours / --job_retention_count 删除已结束任务的结果文件与trace，运行中任务的文件保留"""
+    for path in (result_path(log_dir, ""), trace_path(log_dir, "")):
+        prune_job_files(os.path.dirname(path), active=TASKS)
+
+def cancel_job(job_id: str, token) -> bool:
+    """
+    取消运行中的任务：进行中的LLM请求与尚未完成的阶段立即中止。
+    只有持有任务取消令牌的调用方（启动任务的连接）才能取消
+    :param token: 任务开始时发给启动连接的取消令牌
+    :return: 是否取消了运行中的任务
+    """
+    task, job_token = JOBS.get(job_id, (None, None))
+    if task is None or task.done() or not isinstance(token, str) or not secrets.compare_digest(token, job_token):
+        return False
+    task.cancel()
+    return True
+
+def decode_upload(file_info):
+    """
+    将前端发来的 base64 文件转成 UploadFile
+    :param file_info: {filename, content}
+    :return: (UploadFile, 文件字节数)
+    """
+    filename = file_info["filename"]
+    content_base64 = file_info["content"].split(",")[-1]  # 去掉 data:*/*;base64,
+    file_bytes = base64.b64decode(content_base64)
+    return UploadFile(filename=filename, file=io.BytesIO(file_bytes)), len(file_bytes)
+
+async def run_detection_job(channel: OutboundChannel, data, job_id: str, args, logger, cancel_token: str = ""):
+    """
+    运行一次检测任务，所有输出经由channel发送；任务被取消时以cancelled状态结束。
+    无论任务如何结束，结果日志都以一条结束行收尾，跟随读取结果的请求总能得到任务的最终状态
+    :param cancel_token: 取消令牌，随任务开始帧只发给启动任务的连接
+    """
+    message = data.get("message")
+    file_info = data.get("file")  # dict {filename, content}
+    pipeline = data.get("pipeline", "consistency")  # 默认使用一致性检测pipeline
+
+    # 每个检测任务一个job_id，trace按job_id导出到 --log_dir
+    channel.put({"job_id": job_id, "pipeline": pipeline, "cancel_token": cancel_token}, "job")
+    result_log = ResultLog(args.log_dir, job_id, pipeline)
+    TASKS[job_id] = result_log
+    try:
+        file = None
+        size = len(message or "")
+        if file_info:
+            # 解析前无法得知字符数，按文件字节数估算任务长度
+            file, size = decode_upload(file_info)
+    except Exception as e:
+        logger.exception(e)
+        channel.put({"error": f"文件解码失败: {e}", "job_id": job_id}, "error")
+        result_log.close("error", str(e))
+        TASKS.pop(job_id, None)
+        JOBS.pop(job_id, None)
+        return
+
+    # 同一客户端的任务共用一个公平队列，前端未指定时按连接地址区分
+    client = channel.websocket.client
+    client_id = data.get("client_id") or (client.host if client else "unknown")
+    job = SCHEDULER.new_job(job_id, client_id, interactive=True, size=size)
+
+    tracer = None
+    status = "error"
+    error = None
+    try:
+        with start_trace(job_id, f"pipeline.{pipeline}", pipeline=pipeline) as tracer:
+            async def log_callback(msg, msg_type="log"):
+                channel.put({"log": msg, "type": msg_type}, "error" if msg_type == "error" else "log")
+
+            # 流式增量输出，按chunk序号标记
+            async def delta_callback(delta, chunk_index):
+                channel.put({"delta": delta, "chunk_index": chunk_index, "pipeline": pipeline}, "delta")
+
+            # 阶段开始/完成事件
+            async def progress_callback(stage, status, **info):
+                channel.put({"progress": {"stage": stage, "status": status, **info}, "pipeline": pipeline}, "progress")
+
+            # 每个chunk的最终结果完成即发送并写入结果日志，不在结束时发送整个结果列表
+            async def result_callback(index, result):
+                result_log.append(index, result)
+                channel.put({"result": result, "index": index, "pipeline": pipeline, "job_id": job_id}, "result")
+
+            ctx = PipelineContext(
+                args,
+                log_callback,
+                logger=logger,
+                delta_callback=delta_callback,
+                progress_callback=progress_callback,
+                result_callback=result_callback
+            )
+            engine = PIPELINES.get(pipeline, GRAMMAR_PIPELINE)
+            if not SCHEDULER.jobs.available():
+                channel.put({"log": "当前运行的任务较多，排队等待中", "type": "log"}, "log")
+            try:
+                async with SCHEDULER.admit(job):
+                    if job.admission_wait:
+                        channel.put({"log": f"排队 {job.admission_wait:.1f}s 后开始执行", "type": "log"}, "log")
+                    await engine.run(ctx, source={"message": message, "file": file})
+                status = "completed"
+            except EmptyDocumentError as e:
+                error = str(e)
+                channel.put({"error": error, "job_id": job_id}, "error")
+                return
+            except asyncio.CancelledError:
+                status = "cancelled"
+                logger.info(f"任务已终止 (job_id={job_id})")
+                channel.put({"log": "pipeline已终止", "type": "error"}, "error")
+            except Exception as e:
+                logger.exception(e)
+                error = str(e)
+                channel.put({"error": error, "job_id": job_id}, "error")
+                return
+
+            channel.put({"done": True, "status": status, "count": result_log.count, "pipeline": pipeline, "job_id": job_id,
+                         "queue_wait": job.report()}, "done")
+    finally:
+        # 先写入结束行：之后的统计与trace导出出错时，跟随读取的请求也不会一直等待
+        result_log.close(status, error)
+        # 排队时间记入日志与trace根span
+        logger.info(f"任务排队统计 (job_id={job_id}, client={client_id}): {job.report()}")
+        if tracer is not None:
+            for key, value in job.report().items():
+                tracer.spans[0].set_attribute(f"scheduler.{key}", value)
+        TASKS.pop(job_id, None)
+        JOBS.pop(job_id, None)
+        if tracer is not None:
+            logger.info(f"trace已保存到: {tracer.export(args.log_dir)}")
+        prune_job_outputs(args.log_dir)
+
 @router.websocket("/ws/chat")
 async def websocket_chat(websocket: WebSocket):
     await websocket.accept()
-    cancellation_token = None
+    args = websocket.app.state.args
+    logger = websocket.app.state.logger
+    # 所有发往客户端的帧经由发送队列，慢客户端不会阻塞pipeline
+    channel = OutboundChannel(websocket, args.ws_queue_size, logger)
+    # 本连接启动的检测任务，连接断开时取消
+    job_tasks = set()
+    job_tokens = {}  # job_id -> 取消令牌，本连接启动的任务
+    # 保留后台反馈任务的引用，连接断开后任务仍会完成并保存
+    feedback_tasks = set()
     try:
         while True:
+            # 检测任务在后台运行，接收循环始终可以处理取消与反馈请求
             data = await websocket.receive_json()
-            logger = websocket.app.state.logger
             
-            # 处理反馈请求
+            # 处理反馈请求：在后台总结与保存，不阻塞本连接上的其他请求
             if data.get("action") == "feedback":
                 logger.info("收到用户反馈请求")
-                args = websocket.app.state.args
-                
-                # 调用同步反馈处理函数
-                feedback_result = process_feedback(data, args, logger)
-                
-                # 发送反馈结果
-                await websocket.send_json({"feedback_result": feedback_result})
-                continue
-            
-            # 处理正常的检测请求
-            message = data.get("message")
-            file_info = data.get("file")  # dict {filename, content}
-            pipeline = data.get("pipeline", "consistency")  # 默认使用一致性检测pipeline
-
-            # 将前端发来的 base64 文件转成 UploadFile
-            file = None
-            if file_info:
-                filename = file_info["filename"]
-                content_base64 = file_info["content"].split(",")[-1]  # 去掉 data:*/*;base64,
-                file_bytes = base64.b64decode(content_base64)
-                file = UploadFile(filename=filename, file=io.BytesIO(file_bytes))
-
-            args = websocket.app.state.args
-            logger = websocket.app.state.logger
-            
-            # 创建取消令牌
-            cancellation_token = asyncio.Event()
 
-            text = get_text_from_input(message, file)
-            if not text.strip():
-                await websocket.send_json({"error": "未提供消息或文件"})
+                async def send_feedback(data=data):
+                    feedback_result, feedback_id = await process_feedback(data, args, logger)
+                    if not channel.put({"feedback_result": feedback_result, "feedback_id": feedback_id}, "feedback"):
+                        logger.info(f"连接已断开，反馈结果未发送 (id={feedback_id})")
+
+                task = asyncio.create_task(send_feedback())
+                feedback_tasks.add(task)
+                task.add_done_callback(feedback_tasks.discard)
                 continue
 
-            async def log_callback(msg, msg_type="log"):
-                await websocket.send_json({"log": msg, "type": msg_type})
-
-            # 根据选择的pipeline执行相应的函数
-            if pipeline == "consistency":
-                results = await run_consistency_pipeline(
-                    text, 
-                    args, 
-                    log_callback, 
-                    logger=logger,
-                    cancellation_token=cancellation_token
-                )
-            else:
-                results = await run_grammar_pipeline(
-                    text, 
-                    args, 
-                    log_callback, 
-                    logger=logger,
-                    cancellation_token=cancellation_token
-                )
-                
-            await websocket.send_json({"results": results, "done": True, "pipeline": pipeline})
+            # 取消任务：本连接启动的任务直接取消，其他任务需要提供该任务的取消令牌
+            if data.get("action") == "cancel":
+                job_id = data.get("job_id", "")
+                cancelled = cancel_job(job_id, job_tokens.get(job_id) or data.get("cancel_token"))
+                logger.info(f"收到取消请求 (job_id={job_id})，{'已取消' if cancelled else '任务不存在或已结束'}")
+                channel.put({"cancel_result": cancelled, "job_id": job_id}, "job")
+                continue
+            
+            # 处理正常的检测请求
+            job_id = str(uuid.uuid4())
+            cancel_token = secrets.token_urlsafe(16)
+            task = asyncio.create_task(run_detection_job(channel, data, job_id, args, logger, cancel_token))
+            JOBS[job_id] = (task, cancel_token)
+            job_tokens[job_id] = cancel_token
+            job_tasks.add(task)
+            task.add_done_callback(job_tasks.discard)
+            task.add_done_callback(lambda _, job_id=job_id: job_tokens.pop(job_id, None))
 
     except WebSocketDisconnect:
-        # WebSocket连接断开时，设置取消令牌
-        if cancellation_token:
-            cancellation_token.set()
         logger.info("WebSocket连接已断开")
-    except asyncio.CancelledError:
-        logger.info("Pipeline执行被用户终止")
     except Exception as e:
         logger.exception(e)
-        await websocket.send_json({"error": str(e)})
+        channel.put({"error": str(e)}, "error")
     finally:
+        # 连接断开时取消本连接的任务，进行中的LLM请求随之中止
+        for task in job_tasks:
+            task.cancel()
+        if job_tasks:
+            await asyncio.gather(*job_tasks, return_exceptions=True)
+        await channel.aclose(drain=websocket.client_state == WebSocketState.CONNECTED)
         if websocket.client_state == WebSocketState.CONNECTED:
-            await websocket.close()
\ No newline at end of file
+            await websocket.close()
+
+@router.get("/traces/{job_id}")
+async def get_trace(job_id: str, request: Request):
+    """按job_id获取任务的trace (OTLP JSON)"""
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        return JSONResponse({"error": "无效的job_id"}, status_code=400)
+    path = trace_path(request.app.state.args.log_dir, job_id)
+    if not os.path.exists(path):
+        return JSONResponse({"error": "trace不存在"}, status_code=404)
+    return FileResponse(path, media_type="application/json")
+
+@router.get("/jobs/{job_id}/results")
+async def get_job_results(job_id: str, request: Request):
+    """
+    以NDJSON流式返回任务结果，每行一条 {"index", "result"}，最后一行为 {"done": true, "status", "count"}。
+    任务仍在运行时，连接保持到任务结束，新结果完成即发送。
+    """
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        return JSONResponse({"error": "无效的job_id"}, status_code=400)
+    result_log = TASKS.get(job_id)
+    path = result_path(request.app.state.args.log_dir, job_id)
+    if result_log is None and not os.path.exists(path):
+        return JSONResponse({"error": "任务不存在"}, status_code=404)
+    return StreamingResponse(follow_results(path, result_log), media_type="application/x-ndjson")
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job_route(job_id: str, request: Request):
+    """取消运行中的任务，需要在 X-Cancel-Token 请求头中提供任务开始时返回的取消令牌"""
+    task, _ = JOBS.get(job_id, (None, None))
+    if task is None or task.done():
+        return JSONResponse({"error": "任务不存在或已结束", "cancelled": False}, status_code=404)
+    if not cancel_job(job_id, request.headers.get("X-Cancel-Token")):
+        return JSONResponse({"error": "取消令牌无效", "cancelled": False}, status_code=403)
+    return {"cancelled": True, "job_id": job_id}
+
+@router.get("/feedback")
+async def list_feedback(request: Request, pipeline: str | None = None, limit: int = 20):
+    """按时间倒序列出已保存的反馈（索引条目）"""
+    store = get_feedback_store(request.app.state.args.log_dir)
+    return {"feedback": store.list(pipeline, limit)}
+
+@router.get("/feedback/{feedback_id}")
+async def get_feedback(feedback_id: str, request: Request):
+    """按id读取一条反馈记录"""
+    record = get_feedback_store(request.app.state.args.log_dir).get(feedback_id)
+    if record is None:
+        return JSONResponse({"error": "反馈不存在"}, status_code=404)
+    return record